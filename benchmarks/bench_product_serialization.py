@@ -0,0 +1,61 @@
+"""Serialization cost of a 100 item product page, old path vs. the precompiled adapter.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_product_serialization
+"""
+import json
+import timeit
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pydantic import TypeAdapter
+
+from src.products.schemas import ProductRead, product_list_adapter
+
+PAGE_SIZE = 100
+ROUNDS = 200
+
+
+def make_page():
+    now = datetime.now()
+    return [
+        SimpleNamespace(
+            id=i, name=f"Product {i}", description="Lorem ipsum dolor sit amet " * 4,
+            price=Decimal("19.99"), gender="unisex", category_id=1, created_at=now, updated_at=now,
+            images=[SimpleNamespace(id=i * 10 + j, image_url=f"media/products/product_{i}/{j}.jpg")
+                    for j in range(3)],
+            specifications=[SimpleNamespace(id=i * 10 + j, key=f"key{j}", value="value", product_id=i)
+                            for j in range(4)],
+        )
+        for i in range(PAGE_SIZE)
+    ]
+
+
+response_adapter = TypeAdapter(list[ProductRead])
+
+
+def old_path(rows):
+    # model_validate per row, then FastAPI validates the returned models against
+    # the response model again, dumps them to python and json.dumps the result
+    products = [ProductRead.model_validate(row) for row in rows]
+    validated = response_adapter.validate_python(products, from_attributes=True)
+    return json.dumps(response_adapter.dump_python(validated, mode="json")).encode()
+
+
+def new_path(rows):
+    products = product_list_adapter.validate_python(rows, from_attributes=True)
+    return product_list_adapter.dump_json(products)
+
+
+def main():
+    rows = make_page()
+    assert json.loads(old_path(rows)) == json.loads(new_path(rows))
+    for name, func in (("old", old_path), ("new", new_path)):
+        seconds = min(timeit.repeat(lambda: func(rows), number=ROUNDS, repeat=5)) / ROUNDS
+        print(f"{name}: {seconds * 1000:.3f} ms/page, {1 / seconds:,.0f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Checkouts of one hot product, with its stock on a single row vs. spread over shards.
+
+Every checkout takes one unit in its own transaction and keeps it open for ``--hold`` ms, like
+the order inserts and the network round trips that follow in a real checkout. With one shard
+the checkouts take turns on the row; with more, ``FOR UPDATE SKIP LOCKED`` lets them pick a
+free shard. Checkouts that found every shard busy until the lock timeout count as busy. The
+stock left at the end is checked against the units sold, so overselling would show. Runs against the
+configured database and removes its product afterwards. Run from the repository root::
+
+    python -m benchmarks.bench_stock_contention --shards 1 4 16 --concurrency 32
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+from src.inventory.repository import StockRepository
+from src.products.models import Category, Product
+from src.session_create import engine, session_maker
+
+
+async def checkout(product_id: int, hold: float) -> tuple[float, int]:
+    started = time.perf_counter()
+    async with session_maker() as session:
+        try:
+            await StockRepository(session).take({product_id: 1})
+        except HTTPException as e:
+            return time.perf_counter() - started, e.status_code
+        await asyncio.sleep(hold)
+        await session.commit()
+    return time.perf_counter() - started, 200
+
+
+async def run(product_id: int, shards: int, args):
+    async with session_maker() as session:
+        await StockRepository(session).set_stock(product_id, args.stock, shards)
+        await session.commit()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with semaphore:
+            return await checkout(product_id, args.hold / 1000)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(args.checkouts)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    codes = [code for _, code in results]
+    sold = codes.count(200)
+    async with session_maker() as session:
+        left = (await StockRepository(session).read(product_id)).quantity
+    print(f"shards {shards:3d}: {args.checkouts / elapsed:7.1f} checkouts/s  "
+          f"p50 {statistics.median(latencies):7.1f} ms  p99 {latencies[int(len(latencies) * 0.99) - 1]:7.1f} ms  "
+          f"sold {sold}  sold out {codes.count(409)}  busy {codes.count(503)}  "
+          f"stock {'ok' if left == args.stock - sold else f'WRONG ({left} left)'}")
+
+
+async def main(args):
+    async with session_maker() as session:
+        category = Category(name=f"bench_stock_{uuid.uuid4().hex[:8]}")
+        session.add(category)
+        await session.flush()
+        product = Product(name="Hot product", price="9.99", category_id=category.id)
+        session.add(product)
+        await session.commit()
+    try:
+        for shards in args.shards:
+            await run(product.id, shards, args)
+    finally:
+        async with session_maker() as session:
+            await session.execute(delete(Product).where(Product.id == product.id))
+            await session.execute(delete(Category).where(Category.id == category.id))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--checkouts", type=int, default=2000)
+    parser.add_argument("--stock", type=int, default=1500, help="less than --checkouts, so it sells out")
+    parser.add_argument("--hold", type=float, default=50, help="ms each checkout keeps its transaction open")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Checkout latency under concurrency, against a running server.
+
+Registers a pool of users, then fires checkouts at increasing concurrency and prints the
+latency percentiles of each level. About one request in ten retries the previous checkout of
+its user with the same Idempotency-Key, like a client that timed out, and must not create
+an order. Run from the repository root::
+
+    uvicorn src.main:app --workers 4 &
+    python -m benchmarks.load_checkout --base-url http://localhost:8000 --concurrency 50 100 200 400
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples: list[float], q: float) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1] if len(samples) > 1 else samples[0]
+
+
+async def register(base_url: str, index: int, run: str) -> httpx.AsyncClient:
+    client = httpx.AsyncClient(base_url=base_url, timeout=60)
+    email, password = f"load-{run}-{index}@example.com", "load-test-password"
+    response = await client.post("/auth/register", json={"email": email, "password": password,
+                                                          "name": "Load", "surname": f"User {index}"})
+    response.raise_for_status()
+    response = await client.post("/auth/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    # the session cookie is marked Secure, pass it explicitly so plain http works too
+    client.headers["cookie"] = "; ".join(f"{name}={value}" for name, value in response.cookies.items())
+    return client
+
+
+async def checkout(client: httpx.AsyncClient, product_ids: list[int], last_keys: dict, retry_rate: float):
+    if client in last_keys and random.random() < retry_rate:
+        key, body = last_keys[client]
+    else:
+        key = uuid.uuid4().hex
+        lines = random.sample(product_ids, k=min(len(product_ids), random.randint(1, 5)))
+        body = {"items": [{"product_id": product_id, "quantity": random.randint(1, 3)} for product_id in lines]}
+        last_keys[client] = key, body
+    started = time.perf_counter()
+    response = await client.post("/orders", json=body, headers={"Idempotency-Key": key})
+    return time.perf_counter() - started, response.status_code
+
+
+async def run_level(clients, product_ids, concurrency: int, requests: int, retry_rate: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    last_keys = {}
+
+    async def one(i: int):
+        async with semaphore:
+            return await checkout(clients[i % len(clients)], product_ids, last_keys, retry_rate)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency * 1000 for latency, _ in results]
+    codes = [code for _, code in results]
+    print(f"concurrency {concurrency:4d}: {requests / elapsed:7.1f} req/s  "
+          f"p50 {percentile(latencies, 50):7.1f} ms  p95 {percentile(latencies, 95):7.1f} ms  "
+          f"p99 {percentile(latencies, 99):7.1f} ms  max {max(latencies):7.1f} ms  "
+          f"created {codes.count(201)}  replayed {codes.count(200)}  "
+          f"errors {len(codes) - codes.count(201) - codes.count(200)}")
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.base_url) as client:
+        products = (await client.get("/products/products", params={"limit": 100})).json()
+    product_ids = [product["id"] for product in products]
+    if not product_ids:
+        raise SystemExit("the catalog is empty, import some products first")
+
+    run = uuid.uuid4().hex[:8]
+    clients = await asyncio.gather(*(register(args.base_url, i, run) for i in range(args.users)))
+    try:
+        for concurrency in args.concurrency:
+            await run_level(clients, product_ids, concurrency, args.requests, args.retry_rate)
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--requests", type=int, default=2000, help="checkouts per concurrency level")
+    parser.add_argument("--retry-rate", type=float, default=0.1)
+    asyncio.run(main(parser.parse_args()))
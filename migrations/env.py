@@ -9,6 +9,7 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from src.auth.models import User
 from src.products.models import Product
 from src.orders.models import Order
+from src.inventory.models import StockShard
 from src.models import Base
 from alembic import context
 
@@ -0,0 +1,30 @@
+"""product sort indexes
+
+Revision ID: 3f1c9a2b7d10
+Revises: 0c5e8a3d1f64
+Create Date: 2026-10-18 09:12:41.503211
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a2b7d10'
+down_revision: Union[str, None] = '0c5e8a3d1f64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_product_created_at_id', 'product', ['created_at', 'id'], unique=False)
+    op.create_index('ix_product_price_id', 'product', ['price', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_price_id', table_name='product')
+    op.drop_index('ix_product_created_at_id', table_name='product')
@@ -0,0 +1,40 @@
+"""product specification upsert
+
+Revision ID: a7d3c6e1b958
+Revises: f18b7a4c2e96
+Create Date: 2026-10-18 18:42:17.204511
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3c6e1b958'
+down_revision: Union[str, None] = 'f18b7a4c2e96'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a key could be stored twice before, the latest value wins
+    op.execute(
+        "DELETE FROM productspecification AS spec USING productspecification AS newer "
+        "WHERE spec.product_id = newer.product_id AND spec.key = newer.key AND spec.id < newer.id"
+    )
+    op.create_unique_constraint('uq_productspecification_product_id_key', 'productspecification',
+                                ['product_id', 'key'])
+    # the unique constraint's index leads with product_id
+    op.drop_index(op.f('ix_productspecification_product_id'), table_name='productspecification')
+    op.create_index('ix_productspecification_key_value_product_id', 'productspecification',
+                    ['key', 'value', 'product_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_productspecification_key_value_product_id', table_name='productspecification')
+    op.create_index(op.f('ix_productspecification_product_id'), 'productspecification', ['product_id'], unique=False)
+    op.drop_constraint('uq_productspecification_product_id_key', 'productspecification', type_='unique')
@@ -0,0 +1,32 @@
+"""order idempotency key
+
+Revision ID: b3e8f1d27c64
+Revises: a7d3c6e1b958
+Create Date: 2026-10-18 20:05:33.918274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e8f1d27c64'
+down_revision: Union[str, None] = 'a7d3c6e1b958'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('order', sa.Column('idempotency_key', sa.String(length=255), nullable=True))
+    op.create_unique_constraint('uq_order_user_id_idempotency_key', 'order', ['user_id', 'idempotency_key'])
+    op.create_index(op.f('ix_orderitem_order_id'), 'orderitem', ['order_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_orderitem_order_id'), table_name='orderitem')
+    op.drop_constraint('uq_order_user_id_idempotency_key', 'order', type_='unique')
+    op.drop_column('order', 'idempotency_key')
@@ -0,0 +1,38 @@
+"""catalog filter and fk indexes
+
+Revision ID: c27d5e90a4f3
+Revises: 8b4e2d61c5a7
+Create Date: 2026-10-18 12:41:05.917332
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c27d5e90a4f3'
+down_revision: Union[str, None] = '8b4e2d61c5a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_product_category_created_at_id', 'product', ['category_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_product_category_price_id', 'product', ['category_id', 'price', 'id'], unique=False)
+    op.create_index('ix_product_gender_created_at_id', 'product', ['gender', 'created_at', 'id'], unique=False)
+    op.create_index('ix_product_gender_price_id', 'product', ['gender', 'price', 'id'], unique=False)
+    op.create_index(op.f('ix_productimage_product_id'), 'productimage', ['product_id'], unique=False)
+    op.create_index(op.f('ix_productspecification_product_id'), 'productspecification', ['product_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_productspecification_product_id'), table_name='productspecification')
+    op.drop_index(op.f('ix_productimage_product_id'), table_name='productimage')
+    op.drop_index('ix_product_gender_price_id', table_name='product')
+    op.drop_index('ix_product_gender_created_at_id', table_name='product')
+    op.drop_index('ix_product_category_price_id', table_name='product')
+    op.drop_index('ix_product_category_created_at_id', table_name='product')
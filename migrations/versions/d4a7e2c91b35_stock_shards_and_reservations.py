@@ -0,0 +1,51 @@
+"""stock shards and reservations
+
+Revision ID: d4a7e2c91b35
+Revises: b3e8f1d27c64
+Create Date: 2026-10-18 21:14:52.630417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a7e2c91b35'
+down_revision: Union[str, None] = 'b3e8f1d27c64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('stockshard',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.CheckConstraint('quantity >= 0', name='ck_stockshard_quantity_non_negative'),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'shard')
+    )
+    op.create_table('stockreservation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cart_id', sa.String(length=255), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id', 'shard'], ['stockshard.product_id', 'stockshard.shard'],
+                            ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_stockreservation_cart_id'), 'stockreservation', ['cart_id'], unique=False)
+    op.create_index(op.f('ix_stockreservation_expires_at'), 'stockreservation', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_stockreservation_expires_at'), table_name='stockreservation')
+    op.drop_index(op.f('ix_stockreservation_cart_id'), table_name='stockreservation')
+    op.drop_table('stockreservation')
+    op.drop_table('stockshard')
@@ -0,0 +1,30 @@
+"""media reference indexes
+
+Revision ID: e5a19c3d8f02
+Revises: c27d5e90a4f3
+Create Date: 2026-10-18 14:02:37.418256
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a19c3d8f02'
+down_revision: Union[str, None] = 'c27d5e90a4f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_category_image'), 'category', ['image'], unique=False)
+    op.create_index(op.f('ix_productimage_image_url'), 'productimage', ['image_url'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_productimage_image_url'), table_name='productimage')
+    op.drop_index(op.f('ix_category_image'), table_name='category')
@@ -0,0 +1,29 @@
+"""order history index
+
+Revision ID: e9c4f7a12d83
+Revises: d4a7e2c91b35
+Create Date: 2026-10-18 22:31:07.518942
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c4f7a12d83'
+down_revision: Union[str, None] = 'd4a7e2c91b35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_order_user_id_created_at_id', 'order', ['user_id', 'created_at', 'id'], unique=False,
+                    postgresql_include=['status', 'total_amount'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_order_user_id_created_at_id', table_name='order')
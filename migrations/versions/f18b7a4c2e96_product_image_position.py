@@ -0,0 +1,34 @@
+"""product image position
+
+Revision ID: f18b7a4c2e96
+Revises: e5a19c3d8f02
+Create Date: 2026-10-18 15:10:52.663120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f18b7a4c2e96'
+down_revision: Union[str, None] = 'e5a19c3d8f02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('productimage', sa.Column('position', sa.Integer(), server_default='0', nullable=False))
+    # keep the upload order of existing images
+    op.execute(
+        "UPDATE productimage SET position = ordered.position FROM ("
+        "SELECT id, row_number() OVER (PARTITION BY product_id ORDER BY id) - 1 AS position FROM productimage"
+        ") AS ordered WHERE productimage.id = ordered.id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('productimage', 'position')
@@ -0,0 +1,28 @@
+"""order idempotency fingerprint
+
+Revision ID: f6b2d9a4c371
+Revises: e9c4f7a12d83
+Create Date: 2026-10-19 09:12:45.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6b2d9a4c371'
+down_revision: Union[str, None] = 'e9c4f7a12d83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('order', sa.Column('idempotency_fingerprint', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('order', 'idempotency_fingerprint')
@@ -8,4 +8,8 @@ from .user_manager import get_user_manager
 fastapi_users = FastAPIUsers[User, uuid.UUID](
     get_user_manager,
     [auth_backend],
-)
\ No newline at end of file
+)
+
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
+current_user_optional = fastapi_users.current_user(active=True, optional=True)
+current_active_user = fastapi_users.current_user(active=True)
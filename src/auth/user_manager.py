@@ -1,12 +1,13 @@
 import uuid
 from typing import Optional
 
-from fastapi import Depends, Request
+from fastapi import Depends, Request, Response
 from fastapi_users import BaseUserManager, UUIDIDMixin, models
 
 from ..services.email_service import email_service
 from .models import User, get_user_db
 from ..configs import settings
+from ..cart.service import merge_anonymous_cart
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     reset_password_token_secret = settings.SECRET_KEY
@@ -16,6 +17,10 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
 
         print(f"User {user.id} has registered.")
 
+    async def on_after_login(self, user: User, request: Optional[Request] = None,
+                             response: Optional[Response] = None):
+        await merge_anonymous_cart(user.id, request, response)
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
@@ -0,0 +1,80 @@
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..auth.f_users import current_active_user, current_user_optional
+from ..auth.models import User
+from ..inventory.repository import StockRepository
+from ..inventory.schemas import ReservationRead
+from ..session_create import get_async_session, get_read_session
+from .schemas import CartItemCreate, CartItemRead, CartItemUpdate, CartRead
+from .service import CartService, anonymous_cart_id, anonymous_token, new_anonymous_token, user_cart_id
+from .store import cart_store
+
+cart_router = APIRouter(
+    prefix="/cart",
+    tags=["cart"],
+)
+
+
+async def get_cart_id(request: Request, response: Response,
+                      user: Annotated[Optional[User], Depends(current_user_optional)]) -> str:
+    """The signed-in user's cart, otherwise the anonymous cart of the ``cart_id`` cookie."""
+    if user is not None:
+        return user_cart_id(user.id)
+    token = anonymous_token(request) or new_anonymous_token(response)
+    return anonymous_cart_id(token)
+
+
+@cart_router.get("", response_model=CartRead)
+async def get_cart(cart_id: Annotated[str, Depends(get_cart_id)],
+                   session: Annotated[AsyncSession, Depends(get_read_session)]):
+    return await CartService(session).read(cart_id)
+
+
+# writes only touch the cart store, never the database
+@cart_router.post("/items", response_model=CartItemRead)
+async def add_cart_item(item: CartItemCreate, cart_id: Annotated[str, Depends(get_cart_id)]):
+    quantity = await CartService().add(cart_id, item)
+    return CartItemRead(product_id=item.product_id, quantity=quantity)
+
+
+@cart_router.put("/items/{product_id}", response_model=CartItemRead)
+async def update_cart_item(product_id: int, item: CartItemUpdate, cart_id: Annotated[str, Depends(get_cart_id)]):
+    await CartService().update(cart_id, product_id, item.quantity)
+    return CartItemRead(product_id=product_id, quantity=item.quantity)
+
+
+@cart_router.delete("/items/{product_id}")
+async def remove_cart_item(product_id: int, cart_id: Annotated[str, Depends(get_cart_id)]):
+    await CartService().remove(cart_id, product_id)
+    return {"status": "success"}
+
+
+@cart_router.delete("")
+async def clear_cart(cart_id: Annotated[str, Depends(get_cart_id)]):
+    await CartService().clear(cart_id)
+    return {"status": "success"}
+
+
+# held while the user checks out, released when it expires unless an order consumes it
+@cart_router.post("/reservation", response_model=ReservationRead)
+async def reserve_cart(user: Annotated[User, Depends(current_active_user)],
+                       session: Annotated[AsyncSession, Depends(get_async_session)]):
+    cart_id = user_cart_id(user.id)
+    lines = await cart_store.get(cart_id)
+    if not lines:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The cart is empty")
+    reservation = await StockRepository(session).reserve(cart_id, lines)
+    await session.commit()
+    return reservation
+
+
+@cart_router.delete("/reservation")
+async def release_cart(user: Annotated[User, Depends(current_active_user)],
+                       session: Annotated[AsyncSession, Depends(get_async_session)]):
+    await StockRepository(session).release(user_cart_id(user.id))
+    await session.commit()
+    return {"status": "success"}
@@ -0,0 +1,36 @@
+from decimal import Decimal
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+MAX_QUANTITY = 99
+
+
+class CartItemCreate(BaseModel):
+    product_id: int
+    quantity: int = Field(default=1, ge=1, le=MAX_QUANTITY)
+
+
+class CartItemUpdate(BaseModel):
+    quantity: int = Field(ge=1, le=MAX_QUANTITY)
+
+
+class CartItemRead(BaseModel):
+    product_id: int
+    quantity: int  # of the whole line, not only what was just added
+
+
+class CartLine(BaseModel):
+    product_id: int
+    quantity: int
+    name: Optional[str] = None
+    image_url: Optional[str] = None
+    unit_price: Optional[Decimal] = None
+    line_total: Optional[Decimal] = None
+    available: bool  # False once the product is gone from the catalog
+
+
+class CartRead(BaseModel):
+    lines: List[CartLine] = Field(default_factory=list)
+    total_quantity: int = 0
+    total: Decimal = Decimal("0.00")
@@ -0,0 +1,95 @@
+import re
+import secrets
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..configs import settings
+from ..interfaces.abs_cart_store import CartStore
+from ..products.repository import ProductRepository
+from .schemas import MAX_QUANTITY, CartItemCreate, CartLine, CartRead
+from .store import cart_store
+
+CART_COOKIE = "cart_id"
+CART_TOKEN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def user_cart_id(user_id) -> str:
+    return f"cart:user:{user_id}"
+
+
+def anonymous_cart_id(token: str) -> str:
+    return f"cart:anon:{token}"
+
+
+def anonymous_token(request: Optional[Request]) -> Optional[str]:
+    token = request.cookies.get(CART_COOKIE) if request is not None else None
+    return token if token and CART_TOKEN.match(token) else None
+
+
+def new_anonymous_token(response: Response) -> str:
+    token = secrets.token_urlsafe(24)
+    response.set_cookie(CART_COOKIE, token, max_age=settings.CART_TTL, httponly=True, samesite="lax")
+    return token
+
+
+class CartService:
+    def __init__(self, session: Optional[AsyncSession] = None, store: CartStore = cart_store):
+        self.session = session
+        self.store = store
+
+    async def read(self, cart_id: str) -> CartRead:
+        """The cart with current prices, all lines priced by one product lookup."""
+        lines = await self.store.get(cart_id)
+        products = await ProductRepository(self.session).summaries(list(lines))
+        cart = CartRead()
+        for product_id, quantity in lines.items():
+            product = products.get(product_id)
+            if product is None:
+                cart.lines.append(CartLine(product_id=product_id, quantity=quantity, available=False))
+                continue
+            line_total = product.price * quantity
+            cart.lines.append(CartLine(product_id=product_id, quantity=quantity, name=product.name,
+                                       image_url=product.image_url, unit_price=product.price,
+                                       line_total=line_total, available=True))
+            cart.total_quantity += quantity
+            cart.total += line_total
+        return cart
+
+    async def add(self, cart_id: str, item: CartItemCreate) -> int:
+        """Add to the line of the product and return its quantity, 400 past the cart limits."""
+        lines = await self.store.get(cart_id)
+        if item.product_id not in lines and len(lines) >= settings.CART_MAX_LINES:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"A cart holds at most {settings.CART_MAX_LINES} products")
+        if lines.get(item.product_id, 0) + item.quantity > MAX_QUANTITY:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"A cart holds at most {MAX_QUANTITY} of a product")
+        # the store caps it as well, for adds that raced past the check above
+        return await self.store.add(cart_id, item.product_id, item.quantity, MAX_QUANTITY)
+
+    async def update(self, cart_id: str, product_id: int, quantity: int):
+        if product_id not in await self.store.get(cart_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Product with id {product_id} is not in the cart")
+        await self.store.set(cart_id, product_id, quantity)
+
+    async def remove(self, cart_id: str, product_id: int):
+        await self.store.remove(cart_id, product_id)
+
+    async def clear(self, cart_id: str):
+        await self.store.clear(cart_id)
+
+
+async def merge_anonymous_cart(user_id, request: Optional[Request], response: Optional[Response],
+                               store: CartStore = cart_store):
+    """Move the lines of the anonymous cart of ``request`` into the user's cart, at login."""
+    token = anonymous_token(request)
+    if token is None:
+        return
+    # capped rather than refused, a login must not fail over the cart
+    await store.merge(anonymous_cart_id(token), user_cart_id(user_id), MAX_QUANTITY, settings.CART_MAX_LINES)
+    if response is not None:
+        response.delete_cookie(CART_COOKIE)
@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+
+from ..configs import settings
+from ..interfaces.abs_cart_store import CartStore
+from .schemas import MAX_QUANTITY
+
+
+class MemoryCartStore(CartStore):
+    """In-process carts, bounded by count (least recently used go first) and idle time.
+
+    Every operation is synchronous under the hood, so each one, ``merge`` included, is atomic
+    on the event loop. Carts live in one process: run a single worker or a shared store.
+    """
+
+    def __init__(self, maxsize: int = settings.CART_MAX_CARTS, ttl: float = settings.CART_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._carts: OrderedDict[str, tuple[float, dict[int, int]]] = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lines(self, cart_id: str, create: bool = False) -> dict[int, int]:
+        item = self._carts.get(cart_id)
+        if item is not None and item[0] <= time.monotonic():
+            del self._carts[cart_id]
+            self.expirations += 1
+            item = None
+        if item is None:
+            if not create:
+                return {}
+            item = (0, {})
+        # idle time counts from the last use, like EXPIRE after every command
+        self._carts[cart_id] = (time.monotonic() + self.ttl, item[1])
+        self._carts.move_to_end(cart_id)
+        while len(self._carts) > self.maxsize:
+            self._carts.popitem(last=False)
+            self.evictions += 1
+        return item[1]
+
+    def _drop_if_empty(self, cart_id: str, lines: dict[int, int]):
+        if not lines:
+            self._carts.pop(cart_id, None)
+
+    async def get(self, cart_id: str) -> dict[int, int]:
+        return dict(self._lines(cart_id))
+
+    async def add(self, cart_id: str, product_id: int, quantity: int, max_quantity: int = MAX_QUANTITY) -> int:
+        lines = self._lines(cart_id, create=True)
+        lines[product_id] = min(lines.get(product_id, 0) + quantity, max_quantity)
+        return lines[product_id]
+
+    async def set(self, cart_id: str, product_id: int, quantity: int):
+        lines = self._lines(cart_id, create=True)
+        lines[product_id] = quantity
+
+    async def remove(self, cart_id: str, *product_ids: int):
+        lines = self._lines(cart_id)
+        for product_id in product_ids:
+            lines.pop(product_id, None)
+        self._drop_if_empty(cart_id, lines)
+
+    async def clear(self, cart_id: str):
+        self._carts.pop(cart_id, None)
+
+    async def merge(self, source_id: str, target_id: str, max_quantity: int = MAX_QUANTITY,
+                    max_lines: int = settings.CART_MAX_LINES) -> dict[int, int]:
+        source = self._lines(source_id)
+        self._carts.pop(source_id, None)
+        if not source:
+            return dict(self._lines(target_id))
+        target = self._lines(target_id, create=True)
+        for product_id, quantity in source.items():
+            if product_id not in target and len(target) >= max_lines:
+                continue
+            target[product_id] = min(target.get(product_id, 0) + quantity, max_quantity)
+        return dict(target)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._carts),
+            "maxsize": self.maxsize,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+cart_store = MemoryCartStore()
@@ -19,6 +19,61 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: str
     MAIL_FROM: str
     BASE_URL: str
+    PRODUCT_CACHE_SIZE: int = 10_000
+    PRODUCT_CACHE_TTL: int = 300
+    # seconds after a commit the product is evicted a second time, for reads that raced the commit
+    PRODUCT_CACHE_REEVICT_DELAY: float = 2
+    FACETS_CACHE_SIZE: int = 1_000
+    FACETS_CACHE_TTL: int = 60
+    FACET_PRICE_BUCKETS: list[int] = [25, 50, 100, 200, 500]
+    IMPORT_BATCH_SIZE: int = 1_000
+    IMPORT_MAX_ERRORS: int = 1_000
+    EXPORT_BATCH_SIZE: int = 1_000
+    IMAGE_VARIANTS: dict[str, int] = {"thumb": 200, "medium": 800}  # name -> longest side in px
+    IMAGE_VARIANT_FORMATS: list[str] = ["webp", "avif"]
+    IMAGE_VARIANT_QUALITY: int = 80
+    IMAGE_WORKERS: int = 2
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024
+    MAX_IMAGE_SIZE: int = 10 * 1024 * 1024  # per file
+    MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024  # all files of one request
+    MEDIA_CACHE_MAX_AGE: int = 365 * 24 * 3600
+    MEDIA_ACCEL_REDIRECT: str | None = None  # internal proxy location, e.g. "/protected-media/"
+    MEDIA_GC_INTERVAL: int = 3600  # seconds between orphan sweeps, 0 disables them
+    MEDIA_GC_BATCH_SIZE: int = 500
+    MEDIA_GC_GRACE_PERIOD: int = 3600  # files younger than this are never collected
+    MEDIA_STORAGE: str = "local"  # "local" or "s3"
+    S3_BUCKET: str | None = None
+    S3_ENDPOINT_URL: str | None = None  # for S3-compatible storages, e.g. MinIO
+    S3_REGION: str | None = None
+    S3_ACCESS_KEY_ID: str | None = None
+    S3_SECRET_ACCESS_KEY: str | None = None
+    S3_PUBLIC_URL: str | None = None  # e.g. a CDN in front of the bucket; presigned URLs when not set
+    MEDIA_URL_TTL: int = 3600  # seconds a presigned download URL is valid
+    UPLOAD_URL_TTL: int = 900
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_REPLICA_URLS: list[str] = []  # postgresql+asyncpg:// URLs of read replicas
+    DB_REPLICA_MAX_LAG: float = 5  # seconds, lagging replicas are skipped
+    DB_REPLICA_CHECK_INTERVAL: float = 5
+    DB_REPLICA_CHECK_TIMEOUT: float = 1
+    READ_YOUR_WRITES_WINDOW: int = 10  # seconds a client reads from the primary after a write
+    SQL_SLOW_QUERY_THRESHOLD: float | None = 0.5  # seconds, slower statements are logged; None disables
+    # per-request query count, DB time and table names as a Server-Timing header; every client
+    # sees it, so keep it to development
+    SQL_SERVER_TIMING: bool = False
+    SQL_TIMING_SLOWEST: int = 3  # slowest statements listed in Server-Timing
+    CART_TTL: int = 7 * 24 * 3600  # seconds an untouched cart is kept
+    CART_MAX_CARTS: int = 100_000
+    CART_MAX_LINES: int = 100
+    STOCK_RESERVATION_TTL: int = 15 * 60  # seconds stock reserved for a checkout is held
+    STOCK_SWEEP_INTERVAL: int = 60  # seconds between releases of expired reservations, 0 disables them
+    STOCK_SWEEP_BATCH_SIZE: int = 500
+    STOCK_MAX_SHARDS: int = 64
+    STOCK_LOCK_TIMEOUT: float = 2  # seconds a checkout retries while the shards it needs are busy
     @property
     def DATABASE_URL_asyncpg(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_Name}"
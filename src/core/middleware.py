@@ -0,0 +1,76 @@
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..configs import settings
+from ..database import READ_PRIMARY_COOKIE, PrimaryCommits, primary_commits, replicas
+from .sql_stats import RequestQueries, current_queries, route_stats
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ReadYourWritesMiddleware:
+    """Pins a client to the primary for a short window after a request committed to it.
+
+    Replicas may not have replayed the write yet, the cookie makes the client's next reads
+    (see ``get_read_session``) go to the primary instead. Writes that never reach the
+    database, like the cart's or uploads, leave the client on the replicas.
+    """
+
+    def __init__(self, app: ASGIApp, window: int = settings.READ_YOUR_WRITES_WINDOW):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not (self.window and replicas.engines):
+            return await self.app(scope, receive, send)
+
+        commits = PrimaryCommits()
+        token = primary_commits.set(commits)
+
+        async def send_with_cookie(message: Message):
+            if message["type"] == "http.response.start" and message["status"] < 400 and commits.committed:
+                until = int(time.time()) + self.window
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{READ_PRIMARY_COOKIE}={until}; Max-Age={self.window}; Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            primary_commits.reset(token)
+
+
+class QueryStatsMiddleware:
+    """Counts and times the SQL statements of every request.
+
+    The totals and the slowest statements go out as a ``Server-Timing`` header and are
+    aggregated per route for ``/internal/sql``.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = settings.SQL_SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        queries = RequestQueries()
+        token = current_queries.set(queries)
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start" and self.server_timing:
+                MutableHeaders(scope=message).append("server-timing", queries.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_queries.reset(token)
+            # the route template, not the path, so ids don't make a new entry each
+            route = scope.get("route")
+            route_stats.record(f"{scope['method']} {route.path if route else '<unrouted>'}", queries)
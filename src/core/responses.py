@@ -0,0 +1,10 @@
+from starlette.responses import Response
+
+
+class JSONBytesResponse(Response):
+    """JSON response for a body that is already serialized, e.g. by ``TypeAdapter.dump_json``.
+
+    Returning it from a route skips FastAPI's response_model validation and
+    re-encoding; the declared response_model still documents the schema.
+    """
+    media_type = "application/json"
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends
+
+from ..auth.f_users import current_superuser
+from ..database import pool_stats, replicas
+from .sql_stats import route_stats
+from ..cart.store import cart_store
+from ..products.cache import product_cache, facets_cache
+
+internal_router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+    dependencies=[Depends(current_superuser)],
+)
+
+
+@internal_router.get("/cache")
+async def get_cache_stats():
+    return {"products": product_cache.stats(), "facets": facets_cache.stats(), "carts": cart_store.stats()}
+
+
+@internal_router.get("/db-pool")
+async def get_db_pool_stats():
+    return {"primary": pool_stats(), "replicas": replicas.stats()}
+
+
+@internal_router.get("/sql")
+async def get_sql_stats():
+    return route_stats.stats()
+
+
+@internal_router.delete("/sql")
+async def reset_sql_stats():
+    route_stats.clear()
+    return {"status": "success"}
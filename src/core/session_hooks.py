@@ -0,0 +1,34 @@
+import asyncio
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+_CALLBACKS_KEY = "on_commit_callbacks"
+_background_tasks = set()
+
+
+def on_commit(session: AsyncSession, callback) -> None:
+    """Run the coroutine function ``callback`` after the session's transaction commits.
+
+    Callbacks are dropped if the transaction is rolled back instead.
+    """
+    session.sync_session.info.setdefault(_CALLBACKS_KEY, []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_callbacks(session: Session):
+    callbacks = session.info.pop(_CALLBACKS_KEY, None)
+    if not callbacks:
+        return
+    loop = asyncio.get_running_loop()
+    for callback in callbacks:
+        task = loop.create_task(callback())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_callbacks(session: Session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_CALLBACKS_KEY, None)
@@ -0,0 +1,105 @@
+import heapq
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..configs import settings
+
+TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+
+def summarize(statement: str) -> str:
+    """``SELECT product`` for a statement, short enough for a header and free of values."""
+    verb = statement.split(None, 1)[0].upper() if statement.strip() else "?"
+    table = TABLE.search(statement)
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+def redact(parameters) -> str:
+    """Parameter types only, the values may be personal data or secrets."""
+    if isinstance(parameters, dict):
+        return repr({key: type(value).__name__ for key, value in parameters.items()})
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"<{len(parameters)} parameter sets>"
+        return repr([type(value).__name__ for value in parameters])
+    return "<none>" if parameters is None else f"<{type(parameters).__name__}>"
+
+
+class RequestQueries:
+    """Statements one request sent to the database."""
+
+    def __init__(self, keep_slowest: int = settings.SQL_TIMING_SLOWEST):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest: list[tuple[float, str]] = []  # min-heap of (duration, statement)
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, (duration, statement))
+        elif self.slowest and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, statement))
+
+    def server_timing(self) -> str:
+        metrics = [f'db;dur={self.duration * 1000:.1f};desc="{self.count} queries"']
+        for i, (duration, statement) in enumerate(sorted(self.slowest, reverse=True), start=1):
+            metrics.append(f'db-{i};dur={duration * 1000:.1f};desc="{summarize(statement)}"')
+        return ", ".join(metrics)
+
+
+class RouteStats:
+    """Queries per request aggregated by route, to spot N+1 regressions."""
+
+    def __init__(self):
+        self.routes: dict[str, dict] = {}
+
+    def record(self, route: str, queries: RequestQueries):
+        stats = self.routes.setdefault(route, {"requests": 0, "queries": 0, "max_queries": 0,
+                                               "db_time": 0.0, "max_db_time": 0.0})
+        stats["requests"] += 1
+        stats["queries"] += queries.count
+        stats["max_queries"] = max(stats["max_queries"], queries.count)
+        stats["db_time"] += queries.duration
+        stats["max_db_time"] = max(stats["max_db_time"], queries.duration)
+
+    def clear(self):
+        self.routes.clear()
+
+    def stats(self) -> dict:
+        # routes spending the most time in the database first
+        ordered = sorted(self.routes.items(), key=lambda item: item[1]["db_time"], reverse=True)
+        return {
+            route: {
+                **stats,
+                "avg_queries": stats["queries"] / stats["requests"],
+                "avg_db_time": stats["db_time"] / stats["requests"],
+            }
+            for route, stats in ordered
+        }
+
+
+current_queries: ContextVar[Optional[RequestQueries]] = ContextVar("current_queries", default=None)
+route_stats = RouteStats()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context._query_started
+    queries = current_queries.get()
+    if queries is not None:
+        queries.record(statement, duration)
+    threshold = settings.SQL_SLOW_QUERY_THRESHOLD
+    if threshold is not None and duration >= threshold:
+        print(f"Slow query ({duration * 1000:.1f} ms): {statement} parameters={redact(parameters)}")
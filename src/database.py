@@ -1,11 +1,172 @@
-from typing import AsyncGenerator
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from fastapi import Depends, Request
+from sqlalchemy import NullPool, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
 
 from src.configs import settings
 
-async_session_factory = async_sessionmaker(create_async_engine(settings.DATABASE_URL_asyncpg), expire_on_commit=False)
+
+def build_engine(url: str = settings.DATABASE_URL_asyncpg, **options) -> AsyncEngine:
+    """The engine every session of the app is made from, tuned from Settings."""
+    engine_options = dict(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        # asyncpg's own prepared statement cache and SQLAlchemy's cache on top of it;
+        # both must be 0 behind a transaction-pooling pgbouncer
+        connect_args={"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+                      "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+    )
+    engine_options.update(options)
+    if engine_options.get("poolclass") is NullPool:
+        for option in ("pool_size", "max_overflow", "pool_timeout"):
+            engine_options.pop(option)
+    return create_async_engine(url, **engine_options)
+
+
+engine = build_engine()
+async_session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_factory() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+# seconds the replica is behind; 0 when it replayed everything it received (or is not a replica at all)
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+# set after a write, reads of this client go to the primary until the timestamp it holds
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+
+class ReplicaSet:
+    """Read replicas picked round robin, skipping the ones that are down or lag too far behind.
+
+    Their lag is probed by a background task every ``check_interval`` seconds (see :meth:`start`),
+    picking a replica for a request only reads the last result. Until the first probe, and while
+    a probe fails, a replica counts as unhealthy.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], max_lag: float = settings.DB_REPLICA_MAX_LAG,
+                 check_interval: float = settings.DB_REPLICA_CHECK_INTERVAL,
+                 check_timeout: float = settings.DB_REPLICA_CHECK_TIMEOUT):
+        self.engines = engines
+        self.session_makers = [async_sessionmaker(engine, expire_on_commit=False) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.lags: list[Optional[float]] = [None] * len(engines)
+        self._next = 0
+
+    async def _lag(self, engine: AsyncEngine) -> float:
+        async with engine.connect() as conn:
+            return float((await conn.execute(REPLICA_LAG_SQL)).scalar())
+
+    async def _check(self, index: int):
+        try:
+            self.lags[index] = await asyncio.wait_for(self._lag(self.engines[index]), self.check_timeout)
+        except Exception as e:
+            print(f"Replica {index} is unavailable: {e.__class__.__name__}: {e}")
+            self.lags[index] = None
+
+    async def refresh(self):
+        """Probe the lag of every replica, all at once."""
+        await asyncio.gather(*(self._check(index) for index in range(len(self.engines))))
+
+    async def run_periodically(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> Optional[asyncio.Task]:
+        if not self.engines:
+            return None
+        return asyncio.get_running_loop().create_task(self.run_periodically())
+
+    def is_healthy(self, index: int) -> bool:
+        lag = self.lags[index]
+        return lag is not None and lag <= self.max_lag
+
+    def session_maker(self) -> Optional[async_sessionmaker]:
+        for offset in range(len(self.engines)):
+            index = (self._next + offset) % len(self.engines)
+            if self.is_healthy(index):
+                self._next = index + 1
+                return self.session_makers[index]
+        return None
+
+    def stats(self) -> list[dict]:
+        return [{"lag": lag, "healthy": self.is_healthy(index), **pool_stats(engine)}
+                for index, (engine, lag) in enumerate(zip(self.engines, self.lags))]
+
+
+replicas = ReplicaSet([build_engine(url) for url in settings.DB_REPLICA_URLS])
+
+
+class PrimaryCommits:
+    """Whether a request committed a transaction on the primary."""
+
+    def __init__(self):
+        self.committed = False
+
+
+# set per request by ReadYourWritesMiddleware; a holder rather than a flag, so commits made in
+# tasks that run with a copy of the request's context are seen too
+primary_commits: ContextVar[Optional[PrimaryCommits]] = ContextVar("primary_commits", default=None)
+
+
+@event.listens_for(Session, "after_commit")
+def _record_primary_commit(session: Session):
+    commits = primary_commits.get()
+    if commits is not None and session.get_bind() not in {engine.sync_engine for engine in replicas.engines}:
+        commits.committed = True
+
+
+def reads_from_primary(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_read_session_maker(request: Request) -> async_sessionmaker:
+    """Session maker for read-only routes: a healthy replica, else the primary."""
+    if not reads_from_primary(request):
+        session_maker = replicas.session_maker()
+        if session_maker is not None:
+            return session_maker
+    return async_session_factory
+
+
+async def get_read_session(
+        session_maker: async_sessionmaker = Depends(get_read_session_maker),
+) -> AsyncGenerator[AsyncSession, None]:
+    async with session_maker() as session:
+        yield session
+
+
+def pool_stats(engine: AsyncEngine = engine) -> dict:
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"pool": pool.__class__.__name__}
+    return {
+        "pool": pool.__class__.__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "timeout": pool.timeout(),
+    }
@@ -0,0 +1,19 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):...
+
+    @abstractmethod
+    async def delete(self, *keys: str):...
+
+    @abstractmethod
+    async def clear(self):...
+
+    @abstractmethod
+    def stats(self) -> dict:...
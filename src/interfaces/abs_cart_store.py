@@ -0,0 +1,36 @@
+from abc import ABC, abstractmethod
+
+
+class CartStore(ABC):
+    """Carts as ``{product_id: quantity}`` maps that expire when left alone.
+
+    Shaped after a Redis hash per cart (HGETALL / HINCRBY / HSET / HDEL / EXPIRE), so a
+    Redis backed store can replace the in-memory one without touching the callers.
+    """
+
+    @abstractmethod
+    async def get(self, cart_id: str) -> dict[int, int]:...
+
+    @abstractmethod
+    async def add(self, cart_id: str, product_id: int, quantity: int, max_quantity: int) -> int:
+        """Increase the quantity of a line, up to ``max_quantity``, and return the new quantity."""
+
+    @abstractmethod
+    async def set(self, cart_id: str, product_id: int, quantity: int):...
+
+    @abstractmethod
+    async def remove(self, cart_id: str, *product_ids: int):...
+
+    @abstractmethod
+    async def clear(self, cart_id: str):...
+
+    @abstractmethod
+    async def merge(self, source_id: str, target_id: str, max_quantity: int, max_lines: int) -> dict[int, int]:
+        """Add every line of ``source_id`` to ``target_id`` and drop ``source_id``, atomically.
+
+        Quantities are capped at ``max_quantity``, products that would take the target past
+        ``max_lines`` lines are left out.
+        """
+
+    @abstractmethod
+    def stats(self) -> dict:...
@@ -0,0 +1,26 @@
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Optional
+
+
+class StorageBackend(ABC):
+    @abstractmethod
+    async def keep(self, key: str) -> bool:
+        """True when ``key`` is stored; also marks it as recently used for garbage collection."""
+
+    @abstractmethod
+    async def put(self, key: str, file: BinaryIO, content_type: str):...
+
+    @abstractmethod
+    async def delete(self, *keys: str):...
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """URL clients download ``key`` from."""
+
+    @abstractmethod
+    def presign_upload(self, key: str, content_type: str, size: int, sha256: str) -> dict:
+        """URL, method and headers a client uses to upload ``key`` straight to the storage."""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path on this node's disk, None for remote storages."""
+        return None
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import CheckConstraint, ForeignKey, ForeignKeyConstraint, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ..models import Base
+from ..products.models import Product
+
+
+class StockShard(Base):
+    """A slice of a product's stock, the product's level is the sum of its shards.
+
+    Products without shards are not stock-tracked. A popular product is split over several
+    shards, so concurrent checkouts decrement different rows instead of queuing on one.
+    """
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id", ondelete="CASCADE"), primary_key=True)
+    shard: Mapped[int] = mapped_column(primary_key=True)
+    quantity: Mapped[int] = mapped_column(nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("quantity >= 0", name="ck_stockshard_quantity_non_negative"),
+    )
+
+
+class StockReservation(Base):
+    """Stock taken from a shard for a cart at checkout, given back if it expires unused."""
+    id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
+    cart_id: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
+    product_id: Mapped[int] = mapped_column(nullable=False)
+    shard: Mapped[int] = mapped_column(nullable=False)
+    quantity: Mapped[int] = mapped_column(nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
+
+    __table_args__ = (
+        ForeignKeyConstraint(["product_id", "shard"], ["stockshard.product_id", "stockshard.shard"],
+                             ondelete="CASCADE"),
+    )
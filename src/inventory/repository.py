@@ -0,0 +1,301 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, column, delete, func, insert, select, true, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..configs import settings
+from .models import StockReservation, StockShard
+from .schemas import ReservationRead, StockRead
+
+# quantity taken per (product_id, shard)
+Allocations = dict[tuple[int, int], int]
+
+
+def lines_table(lines: dict[int, int]):
+    """``{product_id: quantity}`` as an inline VALUES table."""
+    return values(column("product_id", Integer), column("quantity", Integer),
+                  name="lines").data(list(lines.items()))
+
+
+def allocations_table(allocations: Allocations):
+    return values(column("product_id", Integer), column("shard", Integer), column("quantity", Integer),
+                  name="allocations").data([(*key, quantity) for key, quantity in allocations.items()])
+
+
+def split(quantity: int, shards: int) -> list[int]:
+    """``quantity`` spread as evenly as possible over ``shards``."""
+    return [quantity // shards + (1 if shard < quantity % shards else 0) for shard in range(shards)]
+
+
+class StockRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def take(self, lines: dict[int, int], timeout: float = settings.STOCK_LOCK_TIMEOUT) -> Allocations:
+        """Decrement the stock of ``lines`` (``{product_id: quantity}``), 409 if a product is short.
+
+        Each line is served by one shard that holds enough stock and that no other transaction
+        has locked (``FOR UPDATE SKIP LOCKED``), all lines in one statement, so checkouts of a
+        product with several shards do not wait for each other. A line no single free shard can
+        serve is spread over the free shards of its product. A checkout never waits for a row
+        lock on a shard, so two checkouts cannot deadlock: while all the shards a line needs are
+        busy it is retried, until a 503 after ``timeout`` seconds. Products without shards are
+        not stock-tracked.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.002
+        allocations: Allocations = {}
+        while True:
+            taken, unserved = await self._take_from_one_shard(lines)
+            allocations.update(taken)
+            if unserved:
+                spread, unserved = await self._take_from_free_shards(unserved)
+                allocations.update(spread)
+            if not unserved:
+                return allocations
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail=f"Stock of products {sorted(unserved)} is busy, try again")
+            # jittered exponential backoff, so retries neither burn the database nor go in lockstep
+            await asyncio.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, 0.05)
+            lines = unserved
+
+    async def _take_from_one_shard(self, lines: dict[int, int]) -> tuple[Allocations, dict[int, int]]:
+        table = lines_table(lines)
+        candidate = (
+            select(StockShard.shard)
+            .where(StockShard.product_id == table.c.product_id, StockShard.quantity >= table.c.quantity)
+            .order_by(func.random())
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .lateral("candidate")
+        )
+        # NULL for products without shards
+        available = (
+            select(func.sum(StockShard.quantity))
+            .where(StockShard.product_id == table.c.product_id)
+            .scalar_subquery()
+        )
+        picked = (
+            select(table.c.product_id, table.c.quantity, candidate.c.shard, available.label("available"))
+            .select_from(table.outerjoin(candidate, true()))
+            .cte("picked")
+        )
+        taken = (
+            update(StockShard)
+            .where(StockShard.product_id == picked.c.product_id, StockShard.shard == picked.c.shard,
+                   StockShard.quantity >= picked.c.quantity)
+            .values(quantity=StockShard.quantity - picked.c.quantity)
+            .returning(StockShard.product_id, StockShard.shard)
+            .cte("taken")
+        )
+        result = await self.session.execute(
+            select(picked.c.product_id, picked.c.available, taken.c.shard)
+            .select_from(picked.outerjoin(taken, taken.c.product_id == picked.c.product_id))
+        )
+        allocations: Allocations = {}
+        unserved = {}
+        short = []
+        for product_id, stock, shard in result:
+            if shard is not None:
+                allocations[(product_id, shard)] = lines[product_id]
+            elif stock is not None and stock < lines[product_id]:
+                short.append(product_id)
+            elif stock is not None:
+                unserved[product_id] = lines[product_id]
+        if short:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"Not enough stock for products: {sorted(short)}")
+        return allocations, unserved
+
+    async def _take_from_free_shards(self, lines: dict[int, int]) -> tuple[Allocations, dict[int, int]]:
+        result = await self.session.execute(
+            select(StockShard.product_id, StockShard.shard, StockShard.quantity)
+            .where(StockShard.product_id.in_(list(lines)), StockShard.quantity > 0)
+            .with_for_update(skip_locked=True)
+        )
+        shards = defaultdict(list)
+        for product_id, shard, quantity in result:
+            shards[product_id].append((shard, quantity))
+        allocations: Allocations = {}
+        unserved = {}
+        for product_id, needed in lines.items():
+            if sum(quantity for _, quantity in shards[product_id]) < needed:
+                unserved[product_id] = needed
+                continue
+            for shard, quantity in shards[product_id]:
+                if needed == 0:
+                    break
+                allocations[(product_id, shard)] = min(quantity, needed)
+                needed -= allocations[(product_id, shard)]
+        if allocations:
+            await self._adjust(allocations, -1)
+        return allocations, unserved
+
+    async def give_back(self, allocations: Allocations):
+        # unlike taking, this waits for the shard locks: stock is always given back before any
+        # is taken in a transaction, so the waiting transaction holds no shard lock itself
+        if allocations:
+            await self._adjust(allocations, 1)
+
+    async def _lock(self, keys):
+        """Lock the shards ``(product_id, shard)``, in that order.
+
+        One UPDATE of several shards locks them in whatever order its plan visits them, two of
+        them can then deadlock. Every transaction that waits for shard locks takes them here
+        first, always in the same order.
+        """
+        await self.session.execute(
+            select(StockShard.product_id)
+            .where(tuple_(StockShard.product_id, StockShard.shard).in_(sorted(keys)))
+            .order_by(StockShard.product_id, StockShard.shard)
+            .with_for_update()
+        )
+
+    async def _adjust(self, allocations: Allocations, sign: int):
+        await self._lock(allocations)
+        table = allocations_table(allocations)
+        await self.session.execute(
+            update(StockShard)
+            .where(StockShard.product_id == table.c.product_id, StockShard.shard == table.c.shard)
+            .values(quantity=StockShard.quantity + sign * table.c.quantity)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def reserve(self, cart_id: str, lines: dict[int, int],
+                      ttl: int = settings.STOCK_RESERVATION_TTL) -> ReservationRead:
+        """Hold the stock of ``lines`` for the cart, replacing its previous reservation.
+
+        The stock is taken right away and given back by :meth:`release_expired` unless the
+        cart is checked out within ``ttl`` seconds.
+        """
+        await self.release(cart_id)
+        allocations = await self.take(lines)
+        expires_at = datetime.now() + timedelta(seconds=ttl)
+        if allocations:
+            await self.session.execute(
+                insert(StockReservation).values([
+                    {"cart_id": cart_id, "product_id": product_id, "shard": shard, "quantity": quantity,
+                     "expires_at": expires_at}
+                    for (product_id, shard), quantity in allocations.items()
+                ])
+            )
+        return ReservationRead(expires_at=expires_at, lines=lines)
+
+    async def consume(self, cart_id: str, lines: dict[int, int]):
+        """Take the stock of ``lines`` for a checkout of the cart, from its reservation first.
+
+        Reserved stock the lines do not need is given back, lines the reservation does not
+        cover (it expired and was released, or the cart grew since) are taken like without one.
+        """
+        result = await self.session.execute(
+            delete(StockReservation)
+            .where(StockReservation.cart_id == cart_id)
+            .returning(StockReservation.product_id, StockReservation.shard, StockReservation.quantity)
+        )
+        held: Allocations = defaultdict(int)
+        for product_id, shard, quantity in result:
+            held[(product_id, shard)] += quantity
+        reserved = defaultdict(int)
+        for (product_id, _), quantity in held.items():
+            reserved[product_id] += quantity
+
+        surplus: Allocations = {}
+        excess = {product_id: quantity - lines.get(product_id, 0) for product_id, quantity in reserved.items()}
+        for (product_id, shard), quantity in held.items():
+            if excess[product_id] > 0:
+                surplus[(product_id, shard)] = min(quantity, excess[product_id])
+                excess[product_id] -= surplus[(product_id, shard)]
+        await self.give_back(surplus)
+
+        missing = {product_id: quantity - reserved[product_id] for product_id, quantity in lines.items()
+                   if quantity > reserved[product_id]}
+        if missing:
+            await self.take(missing)
+
+    async def release(self, cart_id: str) -> int:
+        """Give the stock reserved for the cart back."""
+        return await self._release(select(StockReservation.id).where(StockReservation.cart_id == cart_id))
+
+    async def release_expired(self, batch_size: int = settings.STOCK_SWEEP_BATCH_SIZE) -> int:
+        """Give back the stock of up to ``batch_size`` expired reservations.
+
+        Reservations a checkout is consuming right now are skipped, not waited for.
+        """
+        return await self._release(
+            select(StockReservation.id)
+            .where(StockReservation.expires_at <= datetime.now())
+            .order_by(StockReservation.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+
+    async def _release(self, reservation_ids) -> int:
+        result = await self.session.execute(
+            delete(StockReservation)
+            .where(StockReservation.id.in_(reservation_ids))
+            .returning(StockReservation.product_id, StockReservation.shard, StockReservation.quantity)
+        )
+        released = 0
+        totals: Allocations = defaultdict(int)
+        for product_id, shard, quantity in result:
+            totals[(product_id, shard)] += quantity
+            released += 1
+        await self.give_back(totals)
+        return released
+
+    async def set_stock(self, product_id: int, quantity: int, shards: int = 1):
+        """Spread ``quantity`` over ``shards`` shards of the product, 409 if less is reserved.
+
+        ``quantity`` counts the stock reserved for carts: it is held off the shards, which
+        get it back when the reservations are released. Reservations held on shards that are
+        dropped by the change are dropped with them.
+        """
+        # no reservation is made on the shards or released back to them until the commit
+        await self.session.execute(
+            select(StockShard.shard)
+            .where(StockShard.product_id == product_id)
+            .order_by(StockShard.shard)
+            .with_for_update()
+        )
+        reserved = await self.session.scalar(
+            select(func.coalesce(func.sum(StockReservation.quantity), 0))
+            .where(StockReservation.product_id == product_id, StockReservation.shard < shards)
+        )
+        if reserved > quantity:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"{reserved} units of product {product_id} are reserved")
+        removed = (
+            delete(StockShard)
+            .where(StockShard.product_id == product_id, StockShard.shard >= shards)
+            .cte("removed")
+        )
+        stmt = pg_insert(StockShard).values([
+            {"product_id": product_id, "shard": shard, "quantity": shard_quantity}
+            for shard, shard_quantity in enumerate(split(quantity - reserved, shards))
+        ])
+        await self.session.execute(
+            stmt.on_conflict_do_update(index_elements=[StockShard.product_id, StockShard.shard],
+                                       set_={"quantity": stmt.excluded.quantity})
+            .add_cte(removed)
+        )
+
+    async def read(self, product_id: int) -> StockRead:
+        reserved = (
+            select(func.coalesce(func.sum(StockReservation.quantity), 0))
+            .where(StockReservation.product_id == product_id)
+            .scalar_subquery()
+        )
+        quantity, shards, reserved = (await self.session.execute(
+            select(func.coalesce(func.sum(StockShard.quantity), 0), func.count(), reserved)
+            .where(StockShard.product_id == product_id)
+        )).one()
+        return StockRead(product_id=product_id, quantity=quantity, reserved=reserved, shards=shards)
@@ -0,0 +1,34 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..auth.f_users import current_superuser
+from ..products.models import Product
+from ..session_create import get_async_session, get_read_session
+from .repository import StockRepository
+from .schemas import StockRead, StockUpdate
+
+inventory_router = APIRouter(
+    prefix="/inventory",
+    tags=["inventory"],
+)
+
+
+@inventory_router.get("/{product_id}", response_model=StockRead)
+async def get_stock(product_id: int, session: Annotated[AsyncSession, Depends(get_read_session)]):
+    return await StockRepository(session).read(product_id)
+
+
+@inventory_router.put("/{product_id}", response_model=StockRead, dependencies=[Depends(current_superuser)])
+async def set_stock(product_id: int, payload: StockUpdate,
+                    session: Annotated[AsyncSession, Depends(get_async_session)]):
+    if await session.scalar(select(Product.id).where(Product.id == product_id)) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    repository = StockRepository(session)
+    await repository.set_stock(product_id, payload.quantity, payload.shards)
+    stock = await repository.read(product_id)
+    await session.commit()
+    return stock
@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Dict
+
+from pydantic import BaseModel, Field
+
+from ..configs import settings
+
+
+class StockUpdate(BaseModel):
+    quantity: int = Field(ge=0)
+    # more shards for products many customers check out at the same time
+    shards: int = Field(default=1, ge=1, le=settings.STOCK_MAX_SHARDS)
+
+
+class StockRead(BaseModel):
+    product_id: int
+    quantity: int  # available, reservations excluded
+    reserved: int
+    shards: int
+
+
+class ReservationRead(BaseModel):
+    expires_at: datetime
+    lines: Dict[int, int] = Field(default_factory=dict)  # reserved quantity per product id
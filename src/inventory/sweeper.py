@@ -0,0 +1,41 @@
+import asyncio
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..configs import settings
+from .repository import StockRepository
+
+
+async def release_expired(session_maker: async_sessionmaker,
+                          batch_size: int = settings.STOCK_SWEEP_BATCH_SIZE) -> int:
+    """Give the stock of abandoned checkouts back, one short transaction per batch.
+
+    Several app processes may sweep at the same time: each one skips the reservations
+    another one has locked.
+    """
+    released = 0
+    while True:
+        async with session_maker() as session:
+            count = await StockRepository(session).release_expired(batch_size)
+            await session.commit()
+        released += count
+        if count < batch_size:
+            return released
+
+
+async def run_periodically(session_maker: async_sessionmaker, interval: int = settings.STOCK_SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            released = await release_expired(session_maker)
+            if released:
+                print(f"Stock sweeper released {released} expired reservations")
+        except Exception as e:
+            print(f"Releasing expired stock reservations failed: {e}")
+
+
+def start(session_maker: async_sessionmaker) -> Optional[asyncio.Task]:
+    if not settings.STOCK_SWEEP_INTERVAL:
+        return None
+    return asyncio.get_running_loop().create_task(run_periodically(session_maker))
@@ -2,17 +2,35 @@ import os
 
 import uvicorn
 from fastapi import FastAPI
-from starlette.staticfiles import StaticFiles
 from fastadmin import fastapi_app as admin_app
 import fastadmin
 from src.auth.f_users import fastapi_users
 from src.auth.authentiaction_backend import auth_backend
 from src.auth.schemas import UserRead, UserCreate, UserUpdate
 from src.products.routers import products_router
+from src.cart.routers import cart_router
+from src.orders.routers import orders_router
+from src.inventory.routers import inventory_router
+from src.inventory import sweeper as stock_sweeper
+from src.core.routers import internal_router
+from src.core.middleware import QueryStatsMiddleware, ReadYourWritesMiddleware
 from src.configs import MEDIA_DIR
+from src.session_create import engine, session_maker
+from src.database import replicas
+from src.media import gc as media_gc
+from src.media.routers import uploads_router
+from src.media.serving import MediaFiles
+from src.media.variants import shutdown_pool
 from src.auth.admin import *
 app = FastAPI()
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(QueryStatsMiddleware)
 app.include_router(products_router)
+app.include_router(cart_router)
+app.include_router(orders_router)
+app.include_router(inventory_router)
+app.include_router(internal_router)
+app.include_router(uploads_router)
 app.include_router(
     fastapi_users.get_auth_router(auth_backend),
     prefix="/auth",
@@ -40,7 +58,7 @@ app.include_router(
     tags=["users"],
 )
 
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+app.mount("/media", MediaFiles(directory=MEDIA_DIR), name="media")
 app.mount("/admin", admin_app)
 
 os.environ["ADMIN_USER_MODEL"] = "User"
@@ -60,6 +78,21 @@ async def startup_event():
     for key in dir(admin_settings):
         if key.isupper() and key in admin_params:
             setattr(admin_settings, key, admin_params[key])
+    app.state.media_gc = media_gc.start(session_maker)
+    app.state.stock_sweeper = stock_sweeper.start(session_maker)
+    app.state.replica_monitor = replicas.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if getattr(app.state, "media_gc", None):
+        app.state.media_gc.cancel()
+    if getattr(app.state, "stock_sweeper", None):
+        app.state.stock_sweeper.cancel()
+    if getattr(app.state, "replica_monitor", None):
+        app.state.replica_monitor.cancel()
+    shutdown_pool()
+    await engine.dispose()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import pathlib
+import time
+from itertools import islice
+from typing import Iterator, Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..configs import MEDIA_DIR, settings
+from .storage import LocalStorage, get_storage, remove_files
+from .store import lock_objects, referenced_paths
+from .variants import source_stem
+
+ORIGINAL, VARIANT, TMP = "original", "variant", "tmp"
+
+
+def iter_stale_files(root: str, cutoff: float) -> Iterator[tuple[str, str]]:
+    """Yield ``(image path, kind)`` for every file under ``root`` last modified before ``cutoff``.
+
+    Variants are only yielded when their original is gone, otherwise they go with the original.
+    """
+    media_root = pathlib.Path(root).parent
+    for directory, _, filenames in os.walk(root):
+        original_stems = {os.path.splitext(name)[0] for name in filenames
+                          if not name.endswith(".tmp") and source_stem(name) is None}
+        for name in filenames:
+            full_path = os.path.join(directory, name)
+            try:
+                if os.stat(full_path).st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            image_path = os.path.relpath(full_path, media_root)
+            if name.endswith(".tmp"):
+                yield image_path, TMP
+            elif (stem := source_stem(name)) is not None:
+                if stem not in original_stems:
+                    yield image_path, VARIANT
+            else:
+                yield image_path, ORIGINAL
+
+
+def remove_orphans(root: str, image_paths: list[str]):
+    media_root = pathlib.Path(root).parent
+    for image_path in image_paths:
+        remove_files(image_path, media_root)
+
+
+async def collect_orphans(session_maker: async_sessionmaker, root: str = MEDIA_DIR,
+                          batch_size: int = settings.MEDIA_GC_BATCH_SIZE,
+                          grace_period: int = settings.MEDIA_GC_GRACE_PERIOD) -> int:
+    """Remove media files no product image or category references any more.
+
+    The directory is walked in a worker thread one batch at a time and every batch costs one
+    query, so a sweep never blocks the event loop for long. Files younger than ``grace_period``
+    are left alone: they may belong to an upload whose transaction has not committed yet.
+    """
+    files = iter_stale_files(root, time.time() - grace_period)
+    removed = 0
+    while True:
+        batch = await asyncio.to_thread(lambda: list(islice(files, batch_size)))
+        if not batch:
+            break
+        originals = [path for path, kind in batch if kind == ORIGINAL]
+        async with session_maker() as session, session.begin():
+            # the originals stay locked until they are removed, so an upload that reuses one
+            # meanwhile either waits for the removal and stores it again, or is seen as a reference
+            await lock_objects(session, originals)
+            referenced = await referenced_paths(session, originals) if originals else set()
+            orphans = [path for path, kind in batch if kind != ORIGINAL or path not in referenced]
+            if orphans:
+                await asyncio.to_thread(remove_orphans, root, orphans)
+                removed += len(orphans)
+    return removed
+
+
+async def run_periodically(session_maker: async_sessionmaker, interval: int = settings.MEDIA_GC_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await collect_orphans(session_maker)
+            if removed:
+                print(f"Media garbage collector removed {removed} orphaned files")
+        except Exception as e:
+            print(f"Media garbage collection failed: {e}")
+
+
+def start(session_maker: async_sessionmaker) -> Optional[asyncio.Task]:
+    # remote storages reclaim orphans with their own lifecycle rules
+    if not settings.MEDIA_GC_INTERVAL or not isinstance(get_storage(), LocalStorage):
+        return None
+    return asyncio.get_running_loop().create_task(run_periodically(session_maker))
+
+
+if __name__ == "__main__":
+    from ..session_create import session_maker
+
+    print(f"Removed {asyncio.run(collect_orphans(session_maker))} orphaned files")
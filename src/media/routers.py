@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, Request
+
+from ..auth.f_users import current_active_user
+from .schemas import DirectUpload, UploadIntent
+from .uploads import SavedImage, prepare_direct_upload, receive_direct_upload
+
+uploads_router = APIRouter(
+    prefix="/uploads",
+    tags=["media"],
+)
+
+
+@uploads_router.post("", response_model=DirectUpload, dependencies=[Depends(current_active_user)])
+async def create_upload(intent: UploadIntent):
+    return await prepare_direct_upload(intent)
+
+
+@uploads_router.put("/{token}", response_model=SavedImage)
+async def receive_upload(token: str, request: Request):
+    # target of the presigned URLs handed out by the local storage backend; like an S3 presigned
+    # URL the signed token is the authorization, the client only sends the headers it was given
+    return await receive_direct_upload(token, request.stream())
@@ -0,0 +1,28 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+from ..configs import settings
+from .store import CONTENT_TYPE_FORMATS
+
+
+class UploadIntent(BaseModel):
+    sha256: str = Field(pattern=r"^[0-9a-f]{64}$")
+    content_type: str
+    size: int = Field(gt=0, le=settings.MAX_IMAGE_SIZE)
+
+    @field_validator("content_type")
+    @classmethod
+    def check_content_type(cls, value: str) -> str:
+        if value not in CONTENT_TYPE_FORMATS:
+            raise ValueError(f"content_type must be one of {', '.join(CONTENT_TYPE_FORMATS)}")
+        return value
+
+
+class DirectUpload(BaseModel):
+    key: str
+    exists: bool  # content is already stored, nothing to upload
+    url: Optional[str] = None
+    method: Optional[str] = None
+    headers: dict[str, str] = Field(default_factory=dict)
+    expires_in: Optional[int] = None
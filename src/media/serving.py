@@ -0,0 +1,144 @@
+import os
+import re
+from mimetypes import guess_type
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from ..configs import settings
+from .variants import source_stem
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+# sha256 (content-addressed store) or uuid4 (older uploads), optionally followed by a variant name
+SHA256_NAME = re.compile(r"^(?P<sha>[0-9a-f]{64})(?:_\w+)?$")
+UUID_NAME = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?:_\w+)?$")
+SINGLE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_immutable(path: str) -> bool:
+    """Files whose name is derived from their content (or is never reused) can be cached forever."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return bool(SHA256_NAME.match(stem) or UUID_NAME.match(stem))
+
+
+def cache_control(path: str) -> str:
+    if is_immutable(path):
+        return f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+    return "public, no-cache"
+
+
+def content_etag(path: str) -> str | None:
+    # an original in the content-addressed store is named after the hash of its bytes
+    match = SHA256_NAME.match(os.path.splitext(os.path.basename(path))[0])
+    if match and match.group(0) == match.group("sha"):
+        return f'"{match.group("sha")}"'
+    return None
+
+
+def single_range(http_range: str, file_size: int) -> tuple[int, int] | None:
+    """``(start, end)`` of a ``bytes=`` header asking for one satisfiable range, None otherwise."""
+    match = SINGLE_RANGE.match(http_range.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(file_size - int(last), 0), file_size
+    else:
+        start, end = int(first), min(int(last) + 1, file_size) if last else file_size
+    if start >= end:
+        return None
+    return start, end
+
+
+class MediaFileResponse(FileResponse):
+    """FileResponse that hands the file to the server when it supports the zero-copy send extension.
+
+    Only whole files and single ranges are sent that way, everything else (HEAD, ``If-Range``,
+    multiple, malformed or unsatisfiable ranges) is left to FileResponse.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (ZEROCOPY_EXTENSION not in (scope.get("extensions") or {}) or scope["method"].upper() == "HEAD"
+                or self.stat_result is None):
+            return await super().__call__(scope, receive, send)
+        headers = Headers(scope=scope)
+        http_range = headers.get("range")
+        if http_range is None:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await self._sendfile(send, 0, None)
+        else:
+            file_size = self.stat_result.st_size
+            byte_range = single_range(http_range, file_size)
+            if byte_range is None or "if-range" in headers:
+                return await super().__call__(scope, receive, send)
+            start, end = byte_range
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+            self.headers["content-length"] = str(end - start)
+            await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+            await self._sendfile(send, start, end - start)
+        if self.background is not None:
+            await self.background()
+
+    async def _sendfile(self, send: Send, offset: int, count: int | None) -> None:
+        with open(self.path, "rb") as file:
+            await send({"type": ZEROCOPY_EXTENSION, "file": file, "offset": offset, "count": count,
+                        "more_body": False})
+
+
+class MediaFiles(StaticFiles):
+    """Serves uploaded media with long-lived caching, strong ETags, Range and zero-copy sends.
+
+    With ``MEDIA_ACCEL_REDIRECT`` set, the file is not sent at all: the response only carries an
+    ``X-Accel-Redirect`` header and the front proxy serves the file from its internal location.
+
+    A variant that was not generated (yet) is answered with its original, not cached by clients.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            full_path, stat_result = await run_in_threadpool(self.lookup_original, path)
+            if stat_result is None:
+                raise
+        response = self.file_response(full_path, stat_result, scope)
+        response.headers["cache-control"] = "public, no-cache"
+        return response
+
+    def lookup_original(self, path: str) -> tuple[str, os.stat_result | None]:
+        directory, filename = os.path.split(path)
+        stem = source_stem(filename)
+        full_directory, stat_result = self.lookup_path(directory)
+        if stem is None or stat_result is None:
+            return "", None
+        for name in os.listdir(full_directory):
+            if os.path.splitext(name)[0] == stem and not name.endswith(".tmp") and source_stem(name) is None:
+                return self.lookup_path(os.path.join(directory, name))
+        return "", None
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        path = os.path.relpath(full_path, self.directory)
+        if path.endswith(".tmp"):
+            # upload still being written
+            raise HTTPException(status_code=404)
+        headers = {"cache-control": cache_control(path)}
+        etag = content_etag(path)
+        if etag:
+            headers["etag"] = etag
+
+        if settings.MEDIA_ACCEL_REDIRECT:
+            headers["x-accel-redirect"] = settings.MEDIA_ACCEL_REDIRECT.rstrip("/") + "/" + path.replace(os.sep, "/")
+            return Response(status_code=status_code, headers=headers,
+                            media_type=guess_type(full_path)[0] or "application/octet-stream")
+
+        response = MediaFileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
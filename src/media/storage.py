@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import pathlib
+import shutil
+import time
+import uuid
+from typing import BinaryIO, Optional
+
+import aiofiles.os
+from fastapi import HTTPException
+from starlette import status
+
+from ..configs import MEDIA_DIR, settings
+from ..interfaces.abs_storage import StorageBackend
+from .variants import variant_files
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # only needed for MEDIA_STORAGE=s3
+    boto3 = None
+
+    class ClientError(Exception):
+        """Stand-in for botocore's, for an S3Storage given its client without boto3 installed."""
+
+touch = aiofiles.os.wrap(os.utime)
+
+_storage: Optional[StorageBackend] = None
+
+
+def remove_files(image_path: str, media_root=pathlib.Path(MEDIA_DIR).parent):
+    """Remove a local file and its generated variants."""
+    for path in (image_path, *variant_files(image_path)):
+        try:
+            os.remove(os.path.join(media_root, path))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Image {path} could not be deleted: {e}")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def sign_upload(payload: dict) -> str:
+    body = _b64(json.dumps(payload, separators=(",", ":")).encode())
+    signature = hmac.new(settings.SECRET_KEY.encode(), body.encode(), hashlib.sha256).digest()
+    return f"{body}.{_b64(signature)}"
+
+
+def verify_upload(token: str) -> dict:
+    try:
+        body, signature = token.split(".")
+        expected = hmac.new(settings.SECRET_KEY.encode(), body.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(_unb64(signature), expected):
+            raise ValueError("bad signature")
+        payload = json.loads(_unb64(body))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid upload URL")
+    if payload["exp"] < time.time():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Upload URL expired")
+    return payload
+
+
+class LocalStorage(StorageBackend):
+    """Files under MEDIA_DIR; direct uploads go to this API's ``PUT /uploads/{token}``."""
+
+    def __init__(self, root: str = MEDIA_DIR, upload_url: str = "/uploads"):
+        self.media_root = pathlib.Path(root).parent
+        self.upload_url = upload_url
+
+    def local_path(self, key: str) -> Optional[str]:
+        return os.path.join(self.media_root, key)
+
+    async def keep(self, key: str) -> bool:
+        try:
+            await touch(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def put(self, key: str, file: BinaryIO, content_type: str):
+        await asyncio.to_thread(self._write, key, file)
+
+    def _write(self, key: str, file: BinaryIO):
+        target = self.local_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # concurrent uploads of the same content each write their own tmp file, the rename is atomic
+        tmp_target = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_target, "wb") as f:
+                shutil.copyfileobj(file, f, settings.UPLOAD_CHUNK_SIZE)
+            os.replace(tmp_target, target)
+        except BaseException:
+            try:
+                os.remove(tmp_target)
+            except FileNotFoundError:
+                pass
+            raise
+
+    async def delete(self, *keys: str):
+        await asyncio.to_thread(lambda: [remove_files(key, self.media_root) for key in keys])
+
+    def url(self, key: str) -> str:
+        # served by the /media mount, relative to the API root like before
+        return key
+
+    def presign_upload(self, key: str, content_type: str, size: int, sha256: str) -> dict:
+        token = sign_upload({"key": key, "content_type": content_type, "size": size, "sha256": sha256,
+                             "exp": int(time.time()) + settings.UPLOAD_URL_TTL})
+        return {"url": f"{self.upload_url}/{token}", "method": "PUT", "headers": {"Content-Type": content_type}}
+
+
+class S3Storage(StorageBackend):
+    """Any S3-compatible object storage (AWS, MinIO, ...). Requires boto3."""
+
+    def __init__(self, bucket: str, client=None, **client_options):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("MEDIA_STORAGE=s3 requires boto3, install the 's3' extra")
+            client = boto3.client("s3", **client_options)
+        self.bucket = bucket
+        self.client = client
+
+    async def keep(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def put(self, key: str, file: BinaryIO, content_type: str):
+        await asyncio.to_thread(self.client.upload_fileobj, file, self.bucket, key,
+                                ExtraArgs={"ContentType": content_type})
+
+    async def delete(self, *keys: str):
+        # DeleteObjects takes at most 1000 keys
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": key} for key in keys[start:start + 1000]]
+            await asyncio.to_thread(self.client.delete_objects, Bucket=self.bucket,
+                                    Delete={"Objects": objects, "Quiet": True})
+
+    def url(self, key: str) -> str:
+        if settings.S3_PUBLIC_URL:
+            return f"{settings.S3_PUBLIC_URL.rstrip('/')}/{key}"
+        # private bucket; cached product responses must expire before the URL, see PRODUCT_CACHE_TTL
+        return self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": key},
+                                                  ExpiresIn=settings.MEDIA_URL_TTL)
+
+    def presign_upload(self, key: str, content_type: str, size: int, sha256: str) -> dict:
+        # the checksum is part of the signature, so storage rejects any other content
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type, "ContentLength": size,
+                    "ChecksumSHA256": checksum},
+            ExpiresIn=settings.UPLOAD_URL_TTL,
+        )
+        return {"url": url, "method": "PUT",
+                "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": checksum}}
+
+
+def media_url(image_path: Optional[str]) -> Optional[str]:
+    """URL of a stored image, other paths (e.g. ones set by hand) are returned as they are."""
+    if not image_path or not str(image_path).startswith("media"):
+        return image_path
+    return get_storage().url(image_path)
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        if settings.MEDIA_STORAGE == "s3":
+            _storage = S3Storage(settings.S3_BUCKET, endpoint_url=settings.S3_ENDPOINT_URL,
+                                 region_name=settings.S3_REGION, aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+                                 aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY)
+        else:
+            _storage = LocalStorage()
+    return _storage
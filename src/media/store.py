@@ -0,0 +1,79 @@
+import os
+import pathlib
+import re
+
+from sqlalchemy import String, column, func, select, union, values
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from ..configs import MEDIA_DIR
+from ..products.models import Category, ProductImage
+from .storage import get_storage
+
+MEDIA_ROOT = pathlib.Path(MEDIA_DIR).parent
+OBJECTS_FOLDER = "objects"
+
+# file extension per Pillow format, so the same bytes always map to the same object
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp", "AVIF": ".avif",
+              "BMP": ".bmp", "TIFF": ".tiff"}
+# Pillow format per declared content type of a direct upload
+CONTENT_TYPE_FORMATS = {"image/jpeg": "JPEG", "image/png": "PNG", "image/gif": "GIF", "image/webp": "WEBP",
+                        "image/avif": "AVIF"}
+OBJECT_KEY = re.compile(rf"^media/{OBJECTS_FOLDER}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.[a-z]+$")
+
+
+def object_path(sha256: str, image_format: str) -> str:
+    """``media/objects/ab/cd/abcd....jpg`` for the given content hash."""
+    ext = EXTENSIONS.get(image_format, f".{image_format.lower()}")
+    # storage keys, always "/" separated
+    return "/".join(("media", OBJECTS_FOLDER, sha256[:2], sha256[2:4], f"{sha256}{ext}"))
+
+
+def is_object_key(key: str) -> bool:
+    return bool(OBJECT_KEY.match(key))
+
+
+def full_path(image_path: str) -> str:
+    return os.path.join(MEDIA_ROOT, image_path)
+
+
+async def count_references(session: AsyncSession, image_path: str) -> int:
+    """Number of product images and categories pointing at ``image_path``."""
+    images = select(func.count()).where(ProductImage.image_url == image_path).scalar_subquery()
+    categories = select(func.count()).where(Category.image == image_path).scalar_subquery()
+    return (await session.execute(select(images + categories))).scalar_one()
+
+
+async def referenced_paths(session: AsyncSession, paths: list[str]) -> set[str]:
+    """The subset of ``paths`` still used by a product image or a category."""
+    stmt = union(
+        select(ProductImage.image_url).where(ProductImage.image_url.in_(paths)),
+        select(Category.image).where(Category.image.in_(paths)),
+    )
+    return set((await session.execute(stmt)).scalars())
+
+
+async def lock_objects(session: AsyncSession, image_paths: list[str]):
+    """Lock the stored files until the session's transaction ends.
+
+    Held while a file is checked for references and deleted, and while a new reference to a
+    stored file is recorded, so a file is never deleted under a reference that has not
+    committed yet. Taken in path order, so transactions locking several files do not deadlock.
+    """
+    if not image_paths:
+        return
+    paths = values(column("path", String), name="paths").data([(path,) for path in sorted(set(image_paths))])
+    await session.execute(select(func.pg_advisory_xact_lock(func.hashtext(paths.c.path))))
+
+
+async def remove_if_unreferenced(session: AsyncSession, image_path: str) -> bool:
+    await lock_objects(session, [image_path])
+    if await count_references(session, image_path):
+        return False
+    await get_storage().delete(image_path)
+    return True
+
+
+async def remove_unreferenced(bind: AsyncEngine, image_path: str) -> bool:
+    # counted in a fresh session, so only committed references keep the file alive
+    async with AsyncSession(bind) as session, session.begin():
+        return await remove_if_unreferenced(session, image_path)
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import io
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..configs import settings
+from .schemas import DirectUpload, UploadIntent
+from .storage import get_storage, verify_upload
+from .store import CONTENT_TYPE_FORMATS, is_object_key, lock_objects, object_path
+from .variants import schedule_variants
+
+# image headers (incl. EXIF/ICC blocks) are expected within the first bytes of the file
+HEADER_PROBE_SIZE = 512 * 1024
+# direct uploads up to this size are buffered in memory
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+@dataclass
+class SavedImage:
+    path: str
+    size: int
+    sha256: str
+    width: int
+    height: int
+    created: bool  # False when the same content was already stored
+
+
+class UploadBudget:
+    """Bytes the uploads of a single request may still write."""
+
+    def __init__(self, limit: int = settings.MAX_UPLOAD_SIZE):
+        self.limit = limit
+        self.remaining = limit
+
+    def consume(self, size: int):
+        self.remaining -= size
+        if self.remaining < 0:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Uploads exceed the limit of {self.limit} bytes per request")
+
+
+def probe_image(header: bytes) -> Optional[tuple[str, tuple[int, int]]]:
+    """``(format, (width, height))`` parsed from the header, pixel data is never decoded here."""
+    try:
+        with Image.open(io.BytesIO(header)) as image:
+            return image.format, image.size
+    except Exception:
+        return None
+
+
+class UploadInspector:
+    """Enforces the size limits, hashes and probes an upload chunk by chunk."""
+
+    def __init__(self, max_size: Optional[int] = None, budget: Optional[UploadBudget] = None):
+        self.max_size = max_size or settings.MAX_IMAGE_SIZE
+        self.budget = budget
+        self.digest = hashlib.sha256()
+        self.header = bytearray()
+        self.probed = None
+        self.size = 0
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Image exceeds the limit of {self.max_size} bytes")
+        if self.budget is not None:
+            self.budget.consume(len(chunk))
+        self.digest.update(chunk)
+        if len(self.header) < HEADER_PROBE_SIZE:
+            self.header += chunk[:HEADER_PROBE_SIZE - len(self.header)]
+
+    def result(self) -> tuple[str, int, int]:
+        # probed once, when the whole header has arrived, not again for every chunk
+        if self.probed is None:
+            self.probed = probe_image(bytes(self.header))
+        if self.probed is None:
+            raise HTTPException(status_code=400, detail="Invalid image")
+        image_format, (width, height) = self.probed
+        return image_format, width, height
+
+
+async def _store(key: str, file, content_type: str, session: Optional[AsyncSession] = None) -> bool:
+    storage = get_storage()
+    if session is not None:
+        # held until the reference the caller records commits, see lock_objects
+        await lock_objects(session, [key])
+    if await storage.keep(key):
+        return False
+    await storage.put(key, file, content_type)
+    if storage.local_path(key):
+        schedule_variants(key)
+    return True
+
+
+async def save_upload(file: UploadFile, budget: Optional[UploadBudget] = None,
+                      session: Optional[AsyncSession] = None) -> SavedImage:
+    """Store ``file`` under its SHA-256 in the content-addressed media store.
+
+    The upload is read twice in chunks: the first pass enforces the size limits, hashes and
+    probes it, the second one writes it out and is skipped when the content is already stored.
+    At most one chunk (plus the header probe) is held in memory, whatever the size of the upload.
+    With a ``session`` the stored file is locked until its transaction ends, so it is not
+    removed as unreferenced before the reference recorded in that transaction commits.
+    """
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid image type")
+    if file.size is not None and file.size > settings.MAX_IMAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Image exceeds the limit of {settings.MAX_IMAGE_SIZE} bytes")
+    inspector = UploadInspector(budget=budget)
+    while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+        inspector.feed(chunk)
+    image_format, width, height = inspector.result()
+
+    sha256 = inspector.digest.hexdigest()
+    key = object_path(sha256, image_format)
+    await file.seek(0)
+    created = await _store(key, file.file, file.content_type, session)
+    return SavedImage(path=key, size=inspector.size, sha256=sha256, width=width, height=height, created=created)
+
+
+async def prepare_direct_upload(intent: UploadIntent) -> DirectUpload:
+    """Key and presigned upload of an image the client sends straight to the storage."""
+    key = object_path(intent.sha256, CONTENT_TYPE_FORMATS[intent.content_type])
+    storage = get_storage()
+    if await storage.keep(key):
+        return DirectUpload(key=key, exists=True)
+    upload = storage.presign_upload(key, intent.content_type, intent.size, intent.sha256)
+    return DirectUpload(key=key, exists=False, expires_in=settings.UPLOAD_URL_TTL, **upload)
+
+
+async def receive_direct_upload(token: str, chunks: AsyncIterator[bytes]) -> SavedImage:
+    """Body of a presigned upload to the local storage, checked against what was signed."""
+    upload = verify_upload(token)
+    inspector = UploadInspector(max_size=upload["size"])
+    # same spooling as starlette's multipart parser: small bodies stay in memory
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        async for chunk in chunks:
+            inspector.feed(chunk)
+            # past max_size the spool has moved to (or moves to) a file on disk
+            if inspector.size > SPOOL_MAX_SIZE:
+                await asyncio.to_thread(spool.write, chunk)
+            else:
+                spool.write(chunk)
+        image_format, width, height = inspector.result()
+        sha256 = inspector.digest.hexdigest()
+        if sha256 != upload["sha256"] or inspector.size != upload["size"]:
+            raise HTTPException(status_code=400, detail="Uploaded content does not match the signed upload")
+        if image_format != CONTENT_TYPE_FORMATS[upload["content_type"]]:
+            raise HTTPException(status_code=400, detail="Uploaded image does not match its content type")
+        spool.seek(0)
+        created = await _store(upload["key"], spool, upload["content_type"])
+    return SavedImage(path=upload["key"], size=inspector.size, sha256=sha256, width=width, height=height,
+                      created=created)
+
+
+async def verify_uploaded_keys(session: AsyncSession, keys: list[str]) -> list[str]:
+    """Keys of direct uploads a client wants to attach, rejected unless they are stored.
+
+    The files are locked like in :func:`save_upload` before they are checked.
+    """
+    storage = get_storage()
+    await lock_objects(session, [key for key in keys if is_object_key(key)])
+    stored = await asyncio.gather(*(storage.keep(key) for key in keys if is_object_key(key)))
+    if len(stored) != len(keys) or not all(stored):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Images must be uploaded before they can be attached")
+    return keys
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from PIL import Image, ImageOps, features
+
+from ..configs import MEDIA_DIR, settings
+
+# Pillow format names for the encodings we generate
+FORMATS = {"webp": "WEBP", "avif": "AVIF", "jpeg": "JPEG"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_background_tasks = set()
+
+
+def enabled_formats() -> list[str]:
+    return [fmt for fmt in settings.IMAGE_VARIANT_FORMATS
+            if fmt in FORMATS and (fmt == "jpeg" or features.check(fmt))]
+
+
+def variant_path(image_path: str, variant: str, fmt: str) -> str:
+    stem, _ = os.path.splitext(image_path)
+    return f"{stem}_{variant}.{fmt}"
+
+
+def variant_paths(image_path: Optional[str]) -> dict[str, dict[str, str]]:
+    """Paths of every configured variant of an uploaded image, e.g. ``{"thumb": {"webp": ...}}``."""
+    # variants are only generated for media stored on the local disk
+    if not image_path or not str(image_path).startswith("media") or settings.MEDIA_STORAGE != "local":
+        return {}
+    formats = enabled_formats()
+    return {
+        variant: {fmt: variant_path(image_path, variant, fmt) for fmt in formats}
+        for variant in settings.IMAGE_VARIANTS
+    }
+
+
+def variant_urls(image_path: Optional[str]) -> dict[str, dict[str, str]]:
+    """URLs of the variants of :func:`variant_paths`.
+
+    Variants are created in the background after the upload and may still be pending or have
+    failed; nothing is checked here, ``MediaFiles`` serves the original for those.
+    """
+    from .storage import media_url  # storage imports this module
+
+    return {variant: {fmt: media_url(path) for fmt, path in formats.items()}
+            for variant, formats in variant_paths(image_path).items()}
+
+
+def source_stem(filename: str) -> Optional[str]:
+    """Stem of the original a variant file was generated from, None for non-variant files."""
+    stem, ext = os.path.splitext(filename)
+    if ext[1:] not in FORMATS:
+        return None
+    for variant in settings.IMAGE_VARIANTS:
+        if stem.endswith(f"_{variant}"):
+            return stem[:-len(variant) - 1]
+    return None
+
+
+def is_variant(filename: str) -> bool:
+    return source_stem(filename) is not None
+
+
+def generate_variants(source: str, variants: dict[str, int], formats: list[str], quality: int) -> list[str]:
+    """Resize ``source`` to every variant and encode it in every format. Runs in a worker process."""
+    created = []
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        for variant, size in variants.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                target = variant_path(source, variant, fmt)
+                encoded = resized if fmt != "jpeg" else resized.convert("RGB")
+                if encoded.mode not in ("RGB", "RGBA"):
+                    encoded = encoded.convert("RGBA" if "A" in encoded.getbands() else "RGB")
+                tmp_target = f"{target}.tmp"
+                encoded.save(tmp_target, format=FORMATS[fmt], quality=quality)
+                os.replace(tmp_target, target)
+                created.append(target)
+    return created
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def create_variants(image_path: str) -> list[str]:
+    full_path = os.path.join(pathlib.Path(MEDIA_DIR).parent, image_path)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), generate_variants, full_path,
+                                      dict(settings.IMAGE_VARIANTS), enabled_formats(),
+                                      settings.IMAGE_VARIANT_QUALITY)
+
+
+def schedule_variants(image_path: str):
+    """Generate the variants of a freshly saved upload in the background."""
+
+    async def _run():
+        try:
+            await create_variants(image_path)
+        except Exception as e:
+            print(f"Variants for {image_path} could not be created: {e}")
+
+    task = asyncio.get_running_loop().create_task(_run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def variant_files(image_path: str) -> list[str]:
+    return [path for formats in variant_paths(image_path).values() for path in formats.values()]
+
+
+async def backfill(batch_size: int = 100) -> int:
+    """Create missing variants for every original image under MEDIA_DIR."""
+    media_root = pathlib.Path(MEDIA_DIR).parent
+    pending = []
+    for root, _, files in os.walk(MEDIA_DIR):
+        for filename in files:
+            if is_variant(filename) or filename.endswith(".tmp"):
+                continue
+            image_path = os.path.relpath(os.path.join(root, filename), media_root)
+            if all(os.path.exists(os.path.join(media_root, path)) for path in variant_files(image_path)):
+                continue
+            pending.append(image_path)
+
+    done = 0
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        results = await asyncio.gather(*(create_variants(path) for path in batch), return_exceptions=True)
+        for path, result in zip(batch, results):
+            if isinstance(result, Exception):
+                print(f"Variants for {path} could not be created: {result}")
+            else:
+                done += 1
+    return done
+
+
+if __name__ == "__main__":
+    print(f"Created variants for {asyncio.run(backfill())} images")
+    shutdown_pool()
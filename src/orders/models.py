@@ -1,8 +1,10 @@
 import uuid
 from decimal import Decimal
 
-from sqlalchemy import ForeignKey, Numeric, Enum, UUID
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from typing import Optional
+
+from sqlalchemy import ForeignKey, Index, Numeric, Enum, UUID, String, UniqueConstraint
+from sqlalchemy.orm import Mapped, backref, mapped_column, relationship
 
 from ..auth.models import User
 from ..models import Base
@@ -29,18 +31,29 @@ class Order(Base, TimestampMixin):
         ForeignKey('user.id', ondelete="CASCADE"),
         nullable=False
     )
+    # client supplied, a retried checkout with the same key returns the first order
+    idempotency_key: Mapped[Optional[str]] = mapped_column(String(255))
+    # of the lines ordered under the key, a reuse of the key for other lines is refused
+    idempotency_fingerprint: Mapped[Optional[str]] = mapped_column(String(64))
 
-    user: Mapped["User"] = relationship("User", back_populates="orders")
+    user: Mapped["User"] = relationship("User", backref=backref("orders", passive_deletes=True))
     items: Mapped[list["OrderItem"]] = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_key", name="uq_order_user_id_idempotency_key"),
+        # order history, newest first by a backward scan; the included columns make it index-only
+        Index("ix_order_user_id_created_at_id", "user_id", "created_at", "id",
+              postgresql_include=["status", "total_amount"]),
+    )
+
 
 
 class OrderItem(Base):
     id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
-    order_id: Mapped[int] = mapped_column(ForeignKey('order.id', ondelete="CASCADE"), nullable=False)
+    order_id: Mapped[int] = mapped_column(ForeignKey('order.id', ondelete="CASCADE"), nullable=False, index=True)
     product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete="CASCADE"), nullable=False)
     quantity: Mapped[int] = mapped_column(nullable=False)
     unit_price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)  # copy product price at the time of order
 
     order: Mapped["Order"] = relationship("Order", back_populates="items")
-    product: Mapped["Product"] = relationship("Product", back_populates="order_items")
\ No newline at end of file
+    product: Mapped["Product"] = relationship("Product", backref=backref("order_items", passive_deletes=True))
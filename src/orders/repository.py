@@ -0,0 +1,149 @@
+import hashlib
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, Numeric, column, func, insert, literal, select, tuple_, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette import status
+
+from ..core.pagination import decode_cursor, encode_cursor
+from ..inventory.repository import StockRepository
+from ..products.models import Product, ProductImage
+from .models import Order, OrderItem, OrderStatusEnum
+from .schemas import OrderHistoryFilter, OrderHistoryRead, OrderRead
+
+HISTORY_SORT = "newest"
+
+
+def lines_table(lines: dict[int, tuple[int, Decimal]]):
+    """``{product_id: (quantity, unit_price)}`` as an inline VALUES table."""
+    return values(column("product_id", Integer), column("quantity", Integer), column("unit_price", Numeric(10, 2)),
+                  name="lines").data([(product_id, *line) for product_id, line in lines.items()])
+
+
+def lines_fingerprint(lines: dict[int, int]) -> str:
+    """Hash of ``{product_id: quantity}``, whatever the order of the lines."""
+    return hashlib.sha256(",".join(f"{product_id}:{quantity}"
+                                   for product_id, quantity in sorted(lines.items())).encode()).hexdigest()
+
+
+class OrderRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def place(self, user_id, lines: dict[int, int],
+                    idempotency_key: Optional[str] = None,
+                    cart_id: Optional[str] = None) -> tuple[OrderRead, bool]:
+        """Create a pending order for ``lines`` (``{product_id: quantity}``), totalled by the database.
+
+        Returns the order and whether it was created: a request with an ``idempotency_key`` that
+        a concurrent one with the same key committed first gets that order back, or a 409 if
+        that order has other lines. Callers look up earlier orders of the key with
+        :meth:`get_by_key` first. The stock is
+        taken in the same transaction, from the reservation of ``cart_id`` when the order is
+        placed from a cart, and a 409 is raised if a product is sold out.
+        """
+        # read once, without locking the product rows: concurrent checkouts of a popular
+        # product must not queue on it. Total and item snapshots both use these prices.
+        result = await self.session.execute(select(Product.id, Product.price).where(Product.id.in_(list(lines))))
+        prices = dict(result.all())
+        missing = set(lines) - prices.keys()
+        if missing:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Products not available: {sorted(missing)}")
+        stock = StockRepository(self.session)
+        if cart_id is not None:
+            await stock.consume(cart_id, lines)
+        else:
+            await stock.take(lines)
+
+        table = lines_table({product_id: (quantity, prices[product_id]) for product_id, quantity in lines.items()})
+        total = select(func.sum(table.c.unit_price * table.c.quantity)).scalar_subquery()
+        fingerprint = lines_fingerprint(lines) if idempotency_key is not None else None
+        order = await self.session.scalar(
+            pg_insert(Order)
+            .values(user_id=user_id, status=OrderStatusEnum.PENDING, total_amount=total,
+                    idempotency_key=idempotency_key, idempotency_fingerprint=fingerprint)
+            .on_conflict_do_nothing(index_elements=[Order.user_id, Order.idempotency_key])
+            .returning(Order)
+        )
+        if order is None:
+            # a concurrent request with the same key committed first
+            return await self.get_by_key(user_id, idempotency_key, lines), False
+
+        items = await self.session.scalars(
+            insert(OrderItem)
+            .from_select(["order_id", "product_id", "quantity", "unit_price"],
+                         select(literal(order.id), table.c.product_id, table.c.quantity, table.c.unit_price))
+            .returning(OrderItem)
+        )
+        return self.read(order, list(items)), True
+
+    async def history(self, user_id, filters: OrderHistoryFilter) -> tuple[list[OrderHistoryRead], Optional[str]]:
+        """One page of the user's orders, newest first, and the cursor of the next page.
+
+        Two queries whatever the page size: the orders, then all their items with the
+        product name and first image.
+        """
+        rows = (await self.session.execute(self._history_stmt(user_id, filters))).all()
+        next_cursor = None
+        if len(rows) > filters.limit:
+            rows = rows[:filters.limit]
+            next_cursor = encode_cursor(HISTORY_SORT, (rows[-1].created_at, rows[-1].id))
+
+        items = defaultdict(list)
+        if rows:
+            first_image = (
+                select(ProductImage.image_url).where(ProductImage.product_id == OrderItem.product_id)
+                .order_by(ProductImage.position, ProductImage.id).limit(1).scalar_subquery()
+            )
+            result = await self.session.execute(
+                select(OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity,
+                       OrderItem.unit_price, Product.name, first_image.label("image_url"))
+                .join(Product, Product.id == OrderItem.product_id)
+                .where(OrderItem.order_id.in_([row.id for row in rows]))
+                .order_by(OrderItem.order_id, OrderItem.id)
+            )
+            for item in result:
+                items[item.order_id].append(item)
+        orders = [OrderHistoryRead.model_validate({**row._mapping, "items": items[row.id]}) for row in rows]
+        return orders, next_cursor
+
+    def _history_stmt(self, user_id, filters: OrderHistoryFilter):
+        sort_key = (Order.created_at, Order.id)
+        stmt = (
+            select(Order.id, Order.status, Order.total_amount, Order.created_at)
+            .where(Order.user_id == user_id)
+        )
+        if filters.cursor:
+            cursor_values = decode_cursor(filters.cursor, HISTORY_SORT, (datetime, int))
+            boundary = tuple_(*(literal(value, key.type) for key, value in zip(sort_key, cursor_values)))
+            stmt = stmt.where(tuple_(*sort_key) < boundary)
+        # One extra row tells us whether there is a next page
+        return stmt.order_by(Order.created_at.desc(), Order.id.desc()).limit(filters.limit + 1)
+
+    async def get_by_key(self, user_id, idempotency_key: str,
+                         lines: Optional[dict[int, int]] = None) -> Optional[OrderRead]:
+        """The user's order placed under ``idempotency_key``, 409 if it was not for ``lines``."""
+        order = await self.session.scalar(
+            select(Order).where(Order.user_id == user_id, Order.idempotency_key == idempotency_key)
+            .options(selectinload(Order.items))
+        )
+        # orders placed before fingerprints were kept have none
+        if (order is not None and lines and order.idempotency_fingerprint is not None
+                and order.idempotency_fingerprint != lines_fingerprint(lines)):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="The Idempotency-Key was used for an order of other items")
+        return OrderRead.model_validate(order) if order is not None else None
+
+    @staticmethod
+    def read(order: Order, items: list[OrderItem]) -> OrderRead:
+        return OrderRead.model_validate({
+            "id": order.id, "status": order.status, "total_amount": order.total_amount,
+            "created_at": order.created_at, "items": items,
+        })
@@ -0,0 +1,80 @@
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..auth.f_users import current_active_user
+from ..auth.models import User
+from ..cart.service import user_cart_id
+from ..cart.store import cart_store
+from ..core.session_hooks import on_commit
+from ..session_create import get_async_session, get_read_session
+from .repository import OrderRepository
+from .schemas import OrderCreate, OrderHistoryFilter, OrderHistoryRead, OrderRead
+
+orders_router = APIRouter(
+    prefix="/orders",
+    tags=["orders"],
+)
+
+
+@orders_router.get("", response_model=list[OrderHistoryRead])
+async def get_orders(
+        response: Response,
+        filters: Annotated[OrderHistoryFilter, Depends()],
+        session: Annotated[AsyncSession, Depends(get_read_session)],
+        user: Annotated[User, Depends(current_active_user)],
+):
+    orders, next_cursor = await OrderRepository(session).history(user.id, filters)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return orders
+
+
+@orders_router.post("", response_model=OrderRead, status_code=status.HTTP_201_CREATED)
+async def place_order(
+        response: Response,
+        session: Annotated[AsyncSession, Depends(get_async_session)],
+        user: Annotated[User, Depends(current_active_user)],
+        payload: Annotated[Optional[OrderCreate], Body()] = None,
+        idempotency_key: Annotated[Optional[str], Header(max_length=255)] = None,
+):
+    repository = OrderRepository(session)
+    from_cart = payload is None or payload.items is None
+    lines: dict[int, int] = {}
+    if from_cart:
+        lines = await cart_store.get(user_cart_id(user.id))
+    else:
+        for item in payload.items:
+            lines[item.product_id] = lines.get(item.product_id, 0) + item.quantity
+    # before the lines are validated: a retry gets its order back even though the cart it was
+    # placed from is empty by now, other lines under the same key are a 409
+    if idempotency_key is not None:
+        existing = await repository.get_by_key(user.id, idempotency_key, lines)
+        if existing is not None:
+            response.status_code = status.HTTP_200_OK
+            return existing
+    if not lines:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The order has no items")
+
+    order, created = await repository.place(user.id, lines, idempotency_key,
+                                            cart_id=user_cart_id(user.id) if from_cart else None)
+    if not created:
+        # give back the stock this attempt took
+        await session.rollback()
+        response.status_code = status.HTTP_200_OK
+        return order
+    if from_cart:
+        async def clear_cart():
+            await cart_store.clear(user_cart_id(user.id))
+        on_commit(session, clear_cart)
+    try:
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"details: {e}"
+        )
+    return order
@@ -0,0 +1,50 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+
+from ..cart.schemas import CartItemCreate
+from ..media.storage import media_url
+from .models import OrderStatusEnum
+
+
+class OrderCreate(BaseModel):
+    # the signed-in user's cart when omitted
+    items: Optional[List[CartItemCreate]] = Field(default=None, min_length=1)
+
+
+class OrderItemRead(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    unit_price: Decimal
+    model_config = ConfigDict(from_attributes=True)
+
+
+class OrderRead(BaseModel):
+    id: int
+    status: OrderStatusEnum
+    total_amount: Decimal
+    created_at: datetime
+    items: List[OrderItemRead] = Field(default_factory=list)
+    model_config = ConfigDict(from_attributes=True)
+
+
+class OrderHistoryFilter(BaseModel):
+    cursor: Optional[str] = None  # opaque keyset cursor from X-Next-Cursor
+    limit: Optional[int] = Field(default=20, ge=1, le=100)
+
+
+class OrderHistoryItemRead(OrderItemRead):
+    name: str
+    image_url: Optional[str] = None  # storage key of the product's first image
+
+    @computed_field
+    @property
+    def image_download_url(self) -> Optional[str]:
+        return media_url(self.image_url)
+
+
+class OrderHistoryRead(OrderRead):
+    items: List[OrderHistoryItemRead] = Field(default_factory=list)
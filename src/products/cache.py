@@ -0,0 +1,19 @@
+import json
+
+from ..configs import settings
+from ..core.cache import LRUCache
+
+product_cache = LRUCache(maxsize=settings.PRODUCT_CACHE_SIZE, ttl=settings.PRODUCT_CACHE_TTL)
+# facet counts change with every product and category write, so they are only bounded by TTL
+facets_cache = LRUCache(maxsize=settings.FACETS_CACHE_SIZE, ttl=settings.FACETS_CACHE_TTL)
+
+
+def product_key(product_id) -> str:
+    return f"product:{product_id}"
+
+
+def facets_key(filters) -> str:
+    key = filters.model_dump_json(include={"category_id", "gender", "min_price", "max_price", "search"})
+    if filters.specs:
+        key += json.dumps(filters.specs, sort_keys=True)
+    return "facets:" + key
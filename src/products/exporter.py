@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from .repository import EXPORT_COLUMNS, ProductRepository
+from .schemas import CatalogFormatEnum, ProductFilter
+from ..configs import settings
+
+CSV_HEADER = [column.key for column in EXPORT_COLUMNS] + ["specifications", "images"]
+
+
+def _plain(row: dict) -> dict:
+    return {
+        **row,
+        "price": str(row["price"]),
+        "gender": row["gender"].value,
+        "created_at": row["created_at"].isoformat(),
+        "updated_at": row["updated_at"].isoformat(),
+    }
+
+
+def _encode_ndjson(rows: list[dict]) -> bytes:
+    return "".join(json.dumps(_plain(row), ensure_ascii=False) + "\n" for row in rows).encode()
+
+
+def _encode_csv(rows: list[dict], header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_HEADER)
+    for row in rows:
+        row = _plain(row)
+        # same cell encoding the importer accepts
+        row["specifications"] = json.dumps(row["specifications"], ensure_ascii=False)
+        row["images"] = "|".join(row["images"])
+        writer.writerow(row[column] for column in CSV_HEADER)
+    return buffer.getvalue().encode()
+
+
+async def export_catalog(session_maker, filters: ProductFilter, fmt: CatalogFormatEnum,
+                         batch_size: int = settings.EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    # the response outlives request dependencies, so the export owns its session
+    async with session_maker() as session, session.begin():
+        repository = ProductRepository(session)
+        if fmt == CatalogFormatEnum.csv:
+            yield _encode_csv([], header=True)
+        async for rows in repository.stream_rows(filters, batch_size):
+            yield _encode_csv(rows) if fmt == CatalogFormatEnum.csv else _encode_ndjson(rows)
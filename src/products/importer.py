@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from itertools import islice
+from typing import BinaryIO, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Product, ProductImage, ProductSpecification
+from .schemas import CatalogFormatEnum, ImportReport, ImportRowError, ProductImportRow
+from ..configs import settings
+
+PRODUCT_FIELDS = {"name", "description", "price", "gender", "category_id"}
+
+
+def detect_format(filename: str | None, content_type: str | None = None) -> CatalogFormatEnum:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".ndjson", ".jsonl") or (content_type or "").endswith(("ndjson", "jsonl")):
+        return CatalogFormatEnum.ndjson
+    return CatalogFormatEnum.csv
+
+
+def decode_lines(file: BinaryIO, invalid: dict[int, UnicodeDecodeError]) -> Iterator[str]:
+    """The lines of ``file`` as text; lines that are not UTF-8 are collected in ``invalid`` and
+    yielded with replacement characters, so the reader keeps its place."""
+    for line_number, line in enumerate(file, start=1):
+        try:
+            yield line.decode("utf-8")
+        except UnicodeDecodeError as e:
+            invalid[line_number] = e
+            yield line.decode("utf-8", errors="replace")
+
+
+def iter_rows(file: BinaryIO, fmt: CatalogFormatEnum) -> Iterator[tuple[int, dict | Exception]]:
+    """Yield ``(line number, raw row)`` pairs, or the decode or parse error in place of the row."""
+    if fmt == CatalogFormatEnum.csv:
+        yield from iter_csv_rows(file)
+        return
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            # UnicodeDecodeError is a ValueError too
+            yield line_number, json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            yield line_number, e
+
+
+def iter_csv_rows(file: BinaryIO) -> Iterator[tuple[int, dict | Exception]]:
+    invalid: dict[int, UnicodeDecodeError] = {}
+    reader = csv.DictReader(decode_lines(file, invalid))
+    last_line = 0
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # the reader goes on with the next line, but line_num is not always updated yet
+            row = e
+        # a quoted field can span several lines
+        first_line = last_line + 1
+        last_line = max(reader.line_num, first_line)
+        error = next((invalid[line] for line in range(first_line, last_line + 1) if line in invalid), None)
+        yield last_line, error or row
+
+
+class ProductImporter:
+    """Streams rows from a CSV/NDJSON file into the catalog in batches.
+
+    Only one batch is held in memory at a time and every batch is committed on
+    its own, so a bad batch does not roll back the rows imported before it.
+    """
+
+    def __init__(self, session: AsyncSession,
+                 batch_size: int = settings.IMPORT_BATCH_SIZE,
+                 max_errors: int = settings.IMPORT_MAX_ERRORS):
+        self.session = session
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.report = ImportReport()
+
+    async def run(self, file: BinaryIO, fmt: CatalogFormatEnum) -> ImportReport:
+        started = time.perf_counter()
+        rows = iter_rows(file, fmt)
+        while True:
+            # parsing is CPU bound, keep it off the event loop
+            batch = await asyncio.to_thread(lambda: list(islice(rows, self.batch_size)))
+            if not batch:
+                break
+            await self._import_batch(batch)
+        self.report.elapsed_seconds = round(time.perf_counter() - started, 3)
+        if self.report.elapsed_seconds:
+            self.report.rows_per_second = round(self.report.imported / self.report.elapsed_seconds, 1)
+        return self.report
+
+    def _add_error(self, line: int, error: str):
+        self.report.failed += 1
+        if len(self.report.errors) < self.max_errors:
+            self.report.errors.append(ImportRowError(line=line, error=error))
+
+    async def _import_batch(self, batch: list[tuple[int, dict | Exception]]):
+        valid: list[tuple[int, ProductImportRow]] = []
+        for line, raw in batch:
+            self.report.total += 1
+            if isinstance(raw, Exception):
+                self._add_error(line, f"Invalid row: {raw}")
+                continue
+            try:
+                valid.append((line, ProductImportRow.model_validate(raw)))
+            except ValidationError as e:
+                error = e.errors()[0]
+                location = ".".join(str(part) for part in error["loc"])
+                self._add_error(line, f"{location}: {error['msg']}" if location else error["msg"])
+        if not valid:
+            return
+
+        try:
+            result = await self.session.execute(
+                insert(Product).returning(Product.id, sort_by_parameter_order=True),
+                [row.model_dump(include=PRODUCT_FIELDS) for _, row in valid],
+            )
+            product_ids = result.scalars().all()
+            specifications = [
+                {"product_id": product_id, "key": key, "value": value}
+                for product_id, (_, row) in zip(product_ids, valid)
+                for key, value in row.specifications.items()
+            ]
+            images = [
+                {"product_id": product_id, "image_url": image_url}
+                for product_id, (_, row) in zip(product_ids, valid)
+                for image_url in row.images
+            ]
+            if specifications:
+                await self.session.execute(insert(ProductSpecification), specifications)
+            if images:
+                await self.session.execute(insert(ProductImage), images)
+            await self.session.commit()
+        except Exception as e:
+            await self.session.rollback()
+            for line, _ in valid:
+                self._add_error(line, f"Batch failed: {e.__class__.__name__}: {e}".splitlines()[0])
+            return
+        self.report.imported += len(valid)
+
+
+async def main():
+    from ..session_create import session_maker
+
+    parser = argparse.ArgumentParser(description="Bulk import products from a CSV or NDJSON file.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=[fmt.value for fmt in CatalogFormatEnum])
+    parser.add_argument("--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = CatalogFormatEnum(args.format) if args.format else detect_format(args.path)
+    async with session_maker() as session:
+        with open(args.path, "rb") as file:
+            report = await ProductImporter(session, batch_size=args.batch_size).run(file, fmt)
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
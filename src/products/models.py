@@ -1,32 +1,39 @@
 from decimal import Decimal
 from typing import Optional
 
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, UniqueConstraint, Numeric
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, UniqueConstraint, Numeric, Index, \
+    Computed, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship, Mapped, mapped_column, Relationship
 from datetime import datetime
 from ..models import Base
 import enum
+
+# text search configuration used for the product search vector
+SEARCH_CONFIG = "simple"
+
 class GenderEnum(str, enum.Enum):
     MAN = "man"
     WOMAN = "woman"
     UNISEX = "unisex"
 
 class TimestampMixin:
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now())
-    updated_at: Mapped[datetime] = mapped_column(default=datetime.now(),
-                                                 onupdate=datetime.now())
+    created_at: Mapped[datetime] = mapped_column(default=datetime.now)
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.now,
+                                                 onupdate=datetime.now)
 
 class Category(Base):
     id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
     name: Mapped[str] = mapped_column(unique=True)
-    image: Mapped[Optional[str]] = mapped_column(String(500))
+    image: Mapped[Optional[str]] = mapped_column(String(500), index=True)
 
     products: Mapped[list["Product"]] = relationship('Product', back_populates='category')
 
 class ProductImage(Base):
     id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
-    image_url: Mapped[str] = mapped_column(nullable=False)
-    product_id: Mapped[int] = mapped_column(ForeignKey("product.id", ondelete="CASCADE"))
+    image_url: Mapped[str] = mapped_column(nullable=False, index=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id", ondelete="CASCADE"), index=True)
+    position: Mapped[int] = mapped_column(default=0, server_default="0")
 
 
 class Product(Base, TimestampMixin):
@@ -38,10 +45,33 @@ class Product(Base, TimestampMixin):
                                              )
 
     gender: Mapped[GenderEnum] = mapped_column(Enum(GenderEnum), nullable=False, default=GenderEnum.UNISEX)
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+        deferred=True,
+    )
     category: Mapped["Category"] = relationship('Category', back_populates='products')
     specifications: Mapped[list["ProductSpecification"]] = relationship("ProductSpecification", back_populates="product")
-    images: Mapped[list["ProductImage"]] = relationship("ProductImage", backref="product")
+    images: Mapped[list["ProductImage"]] = relationship("ProductImage", backref="product",
+                                                        order_by="(ProductImage.position, ProductImage.id)")
 
+    __table_args__ = (
+        Index("ix_product_created_at_id", "created_at", "id"),
+        Index("ix_product_price_id", "price", "id"),
+        # equality filters first, then the sort key, so filtered pages are still index seeks
+        Index("ix_product_category_created_at_id", "category_id", "created_at", "id"),
+        Index("ix_product_category_price_id", "category_id", "price", "id"),
+        Index("ix_product_gender_created_at_id", "gender", "created_at", "id"),
+        Index("ix_product_gender_price_id", "gender", "price", "id"),
+        Index("ix_product_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_product_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
+
+event.listen(Product.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
 
 
 class ProductSpecification(Base):
@@ -52,3 +82,10 @@ class ProductSpecification(Base):
 
     product: Mapped["Product"] = relationship("Product", back_populates="specifications")
 
+    __table_args__ = (
+        # upsert target; also serves the lookups by product_id
+        UniqueConstraint("product_id", "key", name="uq_productspecification_product_id_key"),
+        # spec.<key>=<value> filters, product_id included so they never touch the heap
+        Index("ix_productspecification_key_value_product_id", "key", "value", "product_id"),
+    )
+
@@ -1,17 +1,29 @@
 import asyncio
 import json
-import os
-from typing import Optional
+from typing import List, Optional
 
 from fastapi import HTTPException
 from starlette import status
-from .models import Category, Product, ProductImage, ProductSpecification
-from .schemas import CategoryRead, ProductRead, ProductFilter
+from .models import Category, Product, ProductImage, ProductSpecification, SEARCH_CONFIG
+from .schemas import CategoryRead, ProductRead, ProductFilter, ProductSortEnum, ProductFacets, \
+    CategoryFacet, GenderFacet, PriceBucketFacet, ProductProjection, ProductSparseRead, ProductImageRead, \
+    PRODUCT_COLUMNS, product_adapter, product_list_adapter
+from .cache import product_cache, product_key, facets_cache, facets_key
+from ..core.pagination import encode_cursor, decode_cursor
+from ..core.session_hooks import on_commit
+from ..interfaces.abs_cache import CacheBackend
 from ..interfaces.abs_repository import Repository
+from ..configs import settings
+from ..database import replicas
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, exists, and_, delete, update
-from sqlalchemy.orm import selectinload
-from ..utils import delete_image, save_image
+from sqlalchemy import select, exists, or_, delete, insert, update, tuple_, literal, literal_column, func, type_coerce, \
+    Float, case, cast
+from sqlalchemy.dialects.postgresql import REGCONFIG, insert as pg_insert
+from sqlalchemy.orm import selectinload, load_only
+from ..media.storage import get_storage
+from ..media.store import is_object_key, lock_objects
+from ..media.uploads import UploadBudget, verify_uploaded_keys
+from ..utils import delete_image, discard_image, save_image
 
 
 class ProductCategoryRepository(Repository):
@@ -58,9 +70,11 @@ class ProductCategoryRepository(Repository):
                 if key == "image":
                     image_path = None
                     if cat.image:
-                        await delete_image(cat.image)
-                    if value:
-                        image_path = await save_image("categories", value)
+                        await delete_image(self.session, cat.image)
+                    if isinstance(value, str):
+                        image_path, = await verify_uploaded_keys(self.session, [value])
+                    elif value:
+                        image_path = await save_image(value, session=self.session)
                     setattr(cat, key, image_path)
                 else:
                     setattr(cat, key, value)
@@ -73,7 +87,12 @@ class ProductCategoryRepository(Repository):
         cat = await self._get(_id)
         if cat:
             if cat.image:
-                await delete_image(cat.image)
+                await delete_image(self.session, cat.image)
+            # the category_id of its products is set to NULL, so their cached rows are stale
+            product_ids = await self.session.scalars(select(Product.id).where(Product.category_id == _id))
+            products = ProductRepository(self.session)
+            for product_id in product_ids:
+                await products.invalidate(product_id)
             await self.session.delete(cat)
             return True
         raise HTTPException(
@@ -81,35 +100,212 @@ class ProductCategoryRepository(Repository):
             detail=f"Category with id {_id} not found"
         )
 
+# sort option -> (column, descending); Product.id is always the tie-breaker
+SORT_KEYS = {
+    ProductSortEnum.newest: (Product.created_at, True),
+    ProductSortEnum.price_asc: (Product.price, False),
+    ProductSortEnum.price_desc: (Product.price, True),
+}
+
+
+SPECIFICATION_COLUMNS = (
+    ProductSpecification.id, ProductSpecification.product_id, ProductSpecification.key, ProductSpecification.value,
+)
+
+EXPORT_COLUMNS = (
+    Product.id, Product.name, Product.description, Product.price, Product.gender,
+    Product.category_id, Product.created_at, Product.updated_at,
+)
+
+
+def search_query(term: str):
+    return func.websearch_to_tsquery(cast(literal(SEARCH_CONFIG), REGCONFIG), term)
+
+
 class ProductRepository(Repository):
-    def __init__(self, session):
+    def __init__(self, session, cache: CacheBackend = product_cache,
+                 facets_cache: CacheBackend = facets_cache):
         self.session: AsyncSession = session
+        self.cache = cache
+        self.facets_cache = facets_cache
+
     async def get(self, _id):
+        cached = await self.cache.get(product_key(_id))
+        if cached is not None:
+            return ProductRead.model_validate_json(cached)
+        product, _ = await self._load(_id)
+        return product
+
+    async def get_json(self, _id) -> bytes:
+        """Serialized ProductRead, served straight from the cache when possible."""
+        cached = await self.cache.get(product_key(_id))
+        if cached is not None:
+            return cached
+        _, payload = await self._load(_id)
+        return payload
+
+    async def _load(self, _id) -> tuple[ProductRead, bytes]:
         product = await self._get(_id)
         if not product:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail="Product not found")
-        return ProductRead.model_validate(product)
+        product = ProductRead.model_validate(product)
+        payload = product_adapter.dump_json(product)
+        await self.cache.set(product_key(_id), payload)
+        return product, payload
+
+    async def invalidate(self, product_id):
+        # drop the entry now for this session's own reads, and again after commit
+        # in case a concurrent request cached the old row in between
+        key = product_key(product_id)
+        await self.cache.delete(key)
+
+        async def evict():
+            await self.cache.delete(key)
+            # a read that started before the commit, on the primary or on a replica that has
+            # not replayed it yet, may cache the old row again after this
+            delay = settings.PRODUCT_CACHE_REEVICT_DELAY
+            if replicas.engines:
+                delay += settings.DB_REPLICA_MAX_LAG
+            await asyncio.sleep(delay)
+            await self.cache.delete(key)
+
+        on_commit(self.session, evict)
 
     async def _get(self, _id):
         stmt = (
             select(Product).where(Product.id == _id).options(selectinload(Product.images),
                                                              selectinload(Product.specifications))
+            .execution_options(populate_existing=True)
         )
         product = await self.session.execute(stmt)
         return product.scalars().first()
 
     async def list(self, filters: Optional[ProductFilter]):
+        products, _ = await self.list_page(filters)
+        return products
+
+    async def list_page(self, filters: ProductFilter, projection: Optional[ProductProjection] = None):
+        """Return one page of products and the cursor of the next page.
+
+        With a sparse projection the page holds ProductSparseRead items instead
+        of ProductRead.
+        """
+        stmt = self._list_stmt(filters, projection)
+        result = await self.session.execute(stmt)
+        rows = result.all()
+
+        next_cursor = None
+        if len(rows) > filters.limit:
+            rows = rows[:filters.limit]
+            product, sort_value = rows[-1]
+            next_cursor = encode_cursor(self._sort(filters).value, (sort_value, product.id))
+        products = [product for product, _ in rows]
+        if projection and projection.is_sparse:
+            return await self._project(products, projection), next_cursor
+        return product_list_adapter.validate_python(products, from_attributes=True), next_cursor
+
+    async def get_projected(self, _id, projection: ProductProjection) -> ProductSparseRead:
+        cached = await self.cache.get(product_key(_id))
+        if cached is not None:
+            product = ProductRead.model_validate_json(cached)
+            data = product.model_dump(include=projection.columns | projection.relations)
+            if projection.thumbnail:
+                data["thumbnail"] = product.images[0] if product.images else None
+            return ProductSparseRead.model_validate(data)
+
+        stmt = select(Product).where(Product.id == _id).options(*self._load_options(projection))
+        result = await self.session.execute(stmt)
+        product = result.scalars().first()
+        if not product:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Product not found")
+        return (await self._project([product], projection))[0]
+
+    def _load_options(self, projection: Optional[ProductProjection]) -> list:
+        if not projection or not projection.is_sparse:
+            return [selectinload(Product.images), selectinload(Product.specifications)]
+        options = [load_only(*(getattr(Product, column) for column in projection.columns))]
+        options += [selectinload(getattr(Product, relation)) for relation in projection.relations]
+        return options
+
+    async def _project(self, products: List[Product], projection: ProductProjection) -> List[ProductSparseRead]:
+        fields = projection.columns | projection.relations
+        thumbnails = {}
+        if projection.thumbnail and products:
+            thumbnails = await self._thumbnails([product.id for product in products])
+        projected = []
+        for product in products:
+            data = {field: getattr(product, field) for field in fields}
+            if projection.thumbnail:
+                data["thumbnail"] = thumbnails.get(product.id)
+            projected.append(ProductSparseRead.model_validate(data))
+        return projected
+
+    async def _thumbnails(self, product_ids: List[int]) -> dict[int, ProductImage]:
         stmt = (
-            select(Product)
-            .options(
-                selectinload(Product.images),
-                selectinload(Product.specifications)
-            )
-            .offset(filters.offset)
-            .limit(filters.limit)
+            select(ProductImage)
+            .where(ProductImage.product_id.in_(product_ids))
+            .distinct(ProductImage.product_id)
+            .order_by(ProductImage.product_id, ProductImage.position, ProductImage.id)
+        )
+        result = await self.session.execute(stmt)
+        return {image.product_id: image for image in result.scalars()}
+
+    async def summaries(self, product_ids) -> dict:
+        """Name, price and first image of each of ``product_ids`` that exists, in one query."""
+        if not product_ids:
+            return {}
+        first_image = (
+            select(ProductImage.image_url).where(ProductImage.product_id == Product.id)
+            .order_by(ProductImage.position, ProductImage.id).limit(1).scalar_subquery()
+        )
+        stmt = (select(Product.id, Product.name, Product.price, first_image.label("image_url"))
+                .where(Product.id.in_(product_ids)))
+        result = await self.session.execute(stmt)
+        return {row.id: row for row in result}
+
+    def _sort(self, filters: ProductFilter) -> ProductSortEnum:
+        if filters.sort is None:
+            return ProductSortEnum.relevance if filters.search else ProductSortEnum.newest
+        if filters.sort == ProductSortEnum.relevance and not filters.search:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Sorting by relevance requires a search term")
+        return filters.sort
+
+    def _sort_key(self, filters: ProductFilter):
+        sort = self._sort(filters)
+        if sort == ProductSortEnum.relevance:
+            query = search_query(filters.search)
+            rank = (func.ts_rank_cd(Product.search_vector, query)
+                    + func.similarity(Product.name, filters.search))
+            return sort, type_coerce(rank, Float), True
+        column, descending = SORT_KEYS[sort]
+        return sort, column, descending
+
+    def _list_stmt(self, filters: ProductFilter, projection: Optional[ProductProjection] = None):
+        sort, sort_column, descending = self._sort_key(filters)
+        sort_key = (sort_column, Product.id)
+        stmt = (
+            select(Product, sort_column.label("sort_value"))
+            .options(*self._load_options(projection))
         )
 
+        conditions = self._filter_conditions(filters)
+        if filters.cursor:
+            values = decode_cursor(filters.cursor, sort.value, tuple(column.type.python_type for column in sort_key))
+            boundary = tuple_(*(literal(value, column.type) for column, value in zip(sort_key, values)))
+            conditions.append(tuple_(*sort_key) < boundary if descending else tuple_(*sort_key) > boundary)
+        else:
+            stmt = stmt.offset(filters.offset)
+
+        stmt = stmt.where(*conditions)
+
+        order_by = [column.desc() if descending else column.asc() for column in sort_key]
+        # One extra row tells us whether there is a next page
+        return stmt.order_by(*order_by).limit(filters.limit + 1)
+
+    def _filter_conditions(self, filters: ProductFilter) -> list:
         conditions = []
         if filters.category_id:
             conditions.append(Product.category_id == filters.category_id)
@@ -120,69 +316,251 @@ class ProductRepository(Repository):
         if filters.max_price:
             conditions.append(Product.price <= filters.max_price)
         if filters.search:
-            search_term = f"%{filters.search.lower()}%"
-            conditions.append(Product.name.ilike(search_term))  # assumes Product has 'name'
+            # full-text match on name/description, trigram similarity on name catches typos
+            conditions.append(or_(Product.search_vector.op("@@", is_comparison=True)(search_query(filters.search)),
+                                  Product.name.op("%", is_comparison=True)(filters.search)))
+        for key, value in filters.specs.items():
+            # index-only scan of ix_productspecification_key_value_product_id
+            conditions.append(Product.id.in_(
+                select(ProductSpecification.product_id)
+                .where(ProductSpecification.key == key, ProductSpecification.value == value)
+            ))
+        return conditions
+
+    async def facets(self, filters: ProductFilter) -> ProductFacets:
+        key = facets_key(filters)
+        cached = await self.facets_cache.get(key)
+        if cached is not None:
+            return ProductFacets.model_validate_json(cached)
+
+        bounds = settings.FACET_PRICE_BUCKETS
+        # bounds are rendered inline so the CASE in SELECT and GROUP BY is the same expression
+        bucket = case(*((Product.price < literal_column(str(int(bound))), index) for index, bound in enumerate(bounds)),
+                      else_=len(bounds))
+        grouped = (Product.category_id, Product.gender, bucket)
+        stmt = (
+            select(*grouped, func.grouping(*grouped).label("grouping"), func.count().label("count"))
+            .where(*self._filter_conditions(filters))
+            .group_by(func.grouping_sets(tuple_(Product.category_id), tuple_(Product.gender), tuple_(bucket),
+                                         literal_column("()")))
+        )
+        result = await self.session.execute(stmt)
 
-        if conditions:
-            stmt = stmt.where(and_(*conditions))
+        total, categories, genders, price_buckets = 0, [], [], []
+        # grouping() sets a bit for every column that is aggregated away in the row's grouping set
+        for category_id, gender, bucket_index, grouping, count in result.all():
+            if grouping == 0b011:
+                categories.append(CategoryFacet(category_id=category_id, count=count))
+            elif grouping == 0b101:
+                genders.append(GenderFacet(gender=gender.value, count=count))
+            elif grouping == 0b110:
+                price_buckets.append(PriceBucketFacet(
+                    min_price=bounds[bucket_index - 1] if bucket_index > 0 else None,
+                    max_price=bounds[bucket_index] if bucket_index < len(bounds) else None,
+                    count=count,
+                ))
+            else:
+                total = count
+        facets = ProductFacets(
+            total=total,
+            categories=sorted(categories, key=lambda facet: -facet.count),
+            genders=sorted(genders, key=lambda facet: -facet.count),
+            price_buckets=sorted(price_buckets, key=lambda facet: facet.min_price or 0),
+        )
+        await self.facets_cache.set(key, facets.model_dump_json().encode())
+        return facets
 
-        products = await self.session.execute(stmt)
-        result = products.scalars()
-        return [ProductRead.model_validate(product) for product in result]
+    async def stream_rows(self, filters: ProductFilter, batch_size: int):
+        """Yield batches of product rows with their images and specifications.
+
+        Rows come from a server-side cursor, so the session must be inside a
+        transaction. Each batch costs two extra lookups instead of one per row.
+        """
+        stmt = (
+            select(*EXPORT_COLUMNS)
+            .where(*self._filter_conditions(filters))
+            .order_by(Product.id)
+            .execution_options(yield_per=batch_size)
+        )
+        result = await self.session.stream(stmt)
+        async for rows in result.mappings().partitions():
+            products = {row["id"]: {**row, "specifications": {}, "images": []} for row in rows}
+            images = await self.session.execute(
+                select(ProductImage.product_id, ProductImage.image_url)
+                .where(ProductImage.product_id.in_(products))
+                .order_by(ProductImage.position, ProductImage.id)
+            )
+            for product_id, image_url in images:
+                products[product_id]["images"].append(image_url)
+            specifications = await self.session.execute(
+                select(ProductSpecification.product_id, ProductSpecification.key, ProductSpecification.value)
+                .where(ProductSpecification.product_id.in_(products))
+            )
+            for product_id, key, value in specifications:
+                products[product_id]["specifications"][key] = value
+            yield list(products.values())
 
     async def create(self, payload: dict):
         product = Product(**payload)
         self.session.add(product)
         return product
 
-    async def create_images(self, images, product_id):
-        for image in images:
-            self.session.add(ProductImage(image_url=image, product_id=product_id))
+    async def insert(self, payload: dict) -> Product:
+        """Insert a product and get the row back, defaults included, in a single statement."""
+        return await self.session.scalar(insert(Product).values(**payload).returning(Product))
 
-    async def add_specifications(self, specs, product_id):
-        parsed_specs = json.loads(specs)
-        for key, value in parsed_specs.items():
-            self.session.add(ProductSpecification(key=key, value=value, product_id=product_id))
+    async def create_images(self, images, product_id, start_position: int = 0) -> List[ProductImage]:
+        await self.invalidate(product_id)
+        if not images:
+            return []
+        result = await self.session.scalars(insert(ProductImage).values([
+            {"image_url": image, "product_id": product_id, "position": position}
+            for position, image in enumerate(images, start=start_position)
+        ]).returning(ProductImage))
+        return list(result)
 
-    async def update(self, _id, payload):
-        product = await self.get(_id)
-        if product:
-            for (key, value) in payload.items():
-                setattr(product, key, value)
-            return product
-        else:
+    async def add_specifications(self, specs, product_id) -> List[ProductSpecification]:
+        await self.invalidate(product_id)
+        rows = self._specification_rows(specs, product_id)
+        if not rows:
+            return []
+        result = await self.session.scalars(insert(ProductSpecification).values(rows).returning(ProductSpecification))
+        return list(result)
+
+    @staticmethod
+    def _specification_rows(specs, product_id) -> List[dict]:
+        if not specs:
+            return []
+        return [{"key": key, "value": value, "product_id": product_id} for key, value in json.loads(specs).items()]
+
+    async def update(self, _id, payload) -> Product:
+        product = await self.session.scalar(
+            update(Product).where(Product.id == _id).values(**payload).returning(Product)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        if product is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Product with id {_id} not found")
+        await self.invalidate(_id)
+        return product
+
+    @staticmethod
+    def read(product: Product, images, specifications) -> ProductRead:
+        """ProductRead of a written row, built from what the write statements returned."""
+        return ProductRead.model_validate({
+            **{field: getattr(product, field) for field in PRODUCT_COLUMNS},
+            "images": images,
+            "specifications": specifications,
+        })
 
-    async def update_product_images(self, product: Product, images):
-        for image in product.images:
-            await delete_image(image.image_url)
-        stmt = (delete(ProductImage).where(Product.id == product.id))
-        await self.session.execute(stmt)
-        if images:
-            product_images_folder = os.path.join("products", f"product_{product.id}")
-            images = [save_image(product_images_folder, image) for image in images]
-            image_list = await asyncio.gather(*images)
-            await self.create_images(image_list, product.id)
+    async def update_product_images(self, product_id, image_ids: Optional[List[int]] = None, uploads=None):
+        """Apply an image diff: keep ``image_ids`` in that order, remove the others, append ``uploads``.
+
+        ``image_ids=None`` keeps every current image in place, so only uploads are added.
+        Each of remove / reorder / add is a single statement and only touches changed rows and files.
+        Returns the images of the product afterwards, in order.
+        """
+        result = await self.session.execute(
+            select(ProductImage.id, ProductImage.image_url, ProductImage.position)
+            .where(ProductImage.product_id == product_id)
+            .order_by(ProductImage.position, ProductImage.id)
+        )
+        current = {image.id: image for image in result}
+        if image_ids is None:
+            image_ids = list(current)
+        unknown = set(image_ids) - current.keys()
+        if unknown or len(set(image_ids)) != len(image_ids):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Invalid image ids for product {product_id}: {sorted(unknown) or image_ids}")
+
+        removed = [current[image_id] for image_id in current.keys() - set(image_ids)]
+        moved = [{"id": image_id, "position": position} for position, image_id in enumerate(image_ids)
+                 if current[image_id].position != position]
+        images = [ProductImageRead(id=image_id, image_url=current[image_id].image_url, position=position)
+                  for position, image_id in enumerate(image_ids)]
+        if not (removed or moved or uploads):
+            return images
+        await self.invalidate(product_id)
+        if removed:
+            await self.session.execute(
+                delete(ProductImage).where(ProductImage.id.in_([image.id for image in removed]))
+            )
+            for image in removed:
+                await delete_image(self.session, image.image_url)
+        if moved:
+            await self.session.execute(update(ProductImage), moved)
+        if uploads:
+            image_list = await self.save_images(uploads)
+            images += await self.create_images(image_list, product_id, start_position=len(image_ids))
+        return images
+
+    async def save_images(self, images) -> List[str]:
+        # one budget for all files of the request; if any upload fails the others are discarded again
+        budget = UploadBudget()
+        results = await asyncio.gather(*(save_image(image, budget) for image in images), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    await discard_image(self.session, result)
+            raise errors[0]
+        # saved concurrently, outside the session, so the files are only locked now; one that
+        # was removed as unreferenced in between is stored again
+        stored = [path for path in results if is_object_key(path)]
+        await lock_objects(self.session, stored)
+        for image, path in zip(images, results):
+            if path in stored and not await get_storage().keep(path):
+                await image.seek(0)
+                await save_image(image, session=self.session)
+        return results
 
 
     async def add_product_image(self, image_url, product_id):
-        self.session.add(ProductImage(image_url=image_url, product_id =product_id))
+        await self.invalidate(product_id)
+        last_position = (select(func.coalesce(func.max(ProductImage.position) + 1, 0))
+                         .where(ProductImage.product_id == product_id).scalar_subquery())
+        self.session.add(ProductImage(image_url=image_url, product_id =product_id, position=last_position))
 
 
     async def delete(self, _id):
         product = await self._get(_id)
         if product:
-            await self.update_product_images(product, [])
-            await self.update_product_specifications(product)
+            await self.invalidate(_id)
+            await self.update_product_images(_id, [])
+            await self.update_product_specifications(_id)
             await self.session.delete(product)
         else:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Product with id {_id} not found")
 
 
-    async def update_product_specifications(self, product: Product, specs=""):
-        stmt = (delete(ProductSpecification).where(Product.id == product.id))
-        await self.session.execute(stmt)
-        if specs:
-            await self.add_specifications(specs, product.id)
+    async def update_product_specifications(self, product_id, specs="") -> List[ProductSpecification]:
+        """Make the specifications of a product match ``specs`` in one statement.
+
+        Changed and new keys are upserted, keys no longer present deleted; unchanged rows are
+        not written at all and come back from the statement's snapshot.
+        """
+        await self.invalidate(product_id)
+        removed = delete(ProductSpecification).where(ProductSpecification.product_id == product_id)
+        rows = self._specification_rows(specs, product_id)
+        if not rows:
+            await self.session.execute(removed)
+            return []
+        keys = [row["key"] for row in rows]
+        upsert = pg_insert(ProductSpecification).values(rows)
+        upserted = upsert.on_conflict_do_update(
+            constraint="uq_productspecification_product_id_key",
+            set_={"value": upsert.excluded.value},
+            where=ProductSpecification.value.is_distinct_from(upsert.excluded.value),
+        ).returning(*SPECIFICATION_COLUMNS).cte("upserted")
+        unchanged = select(*SPECIFICATION_COLUMNS).where(
+            ProductSpecification.product_id == product_id,
+            ProductSpecification.key.in_(keys),
+            ProductSpecification.key.not_in(select(upserted.c.key)),
+        )
+        stmt = (
+            select(upserted).union_all(unchanged)
+            .add_cte(removed.where(ProductSpecification.key.not_in(keys)).cte("removed"))
+        )
+        result = await self.session.execute(stmt)
+        return list(result)
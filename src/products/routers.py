@@ -1,15 +1,21 @@
-import asyncio
 import json
 from typing import Annotated, Optional
 
-from fastapi import APIRouter, HTTPException, Form, UploadFile, File, Body, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.responses import JSONResponse
-from .schemas import ProductRead, ProductCreateForm, ProductFilter, CategoryRead, GenderEnum, ProductSpecificationCreate
+from fastapi import APIRouter, HTTPException, Form, UploadFile, File, Body, Depends, Request
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from starlette.responses import JSONResponse, StreamingResponse
+from .schemas import ProductRead, ProductCreateForm, ProductFilter, CategoryRead, GenderEnum, ProductSpecificationCreate, \
+    ProductFacets, CatalogFormatEnum, ImportReport, ProductProjection, ProductImageRead, product_list_adapter, \
+    product_sparse_list_adapter, product_adapter, parse_image_ids, parse_image_keys, \
+    parse_spec_filters
 from .repository import ProductCategoryRepository, ProductRepository
-from ..session_create import  get_async_session
-from ..utils import save_image, delete_image
-import os
+from .importer import ProductImporter, detect_format
+from .exporter import export_catalog
+from ..session_create import  get_async_session, get_read_session, get_read_session_maker
+from ..core.responses import JSONBytesResponse
+from ..media.uploads import verify_uploaded_keys
+from ..utils import save_image, discard_image
 
 from starlette import status
 products_router = APIRouter(
@@ -18,12 +24,26 @@ products_router = APIRouter(
 )
 
 
+def product_filters(request: Request, filters: Annotated[ProductFilter, Depends()]) -> ProductFilter:
+    return filters.with_specs(parse_spec_filters(request.query_params))
+
+
+def product_projection(fields: Optional[str] = None, include: Optional[str] = None) -> ProductProjection:
+    # built here rather than as a class dependency: FastAPI turns a ValidationError raised
+    # while resolving a dependency into a 500
+    try:
+        return ProductProjection(fields=fields, include=include)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="; ".join(str(error.get("ctx", {}).get("error", error["msg"])) for error in e.errors()))
+
+
 @products_router.get("/categories/{_id}", response_model=CategoryRead)
 async def get_category(_id: int,
-                       session: Annotated[AsyncSession, Depends(get_async_session)]):
+                       session: Annotated[AsyncSession, Depends(get_read_session)]):
     repository = ProductCategoryRepository(session)
     category = await repository.get(_id)
-    return category.model_validate(category)
+    return category
 
 
 @products_router.post("/categories", response_model=CategoryRead, status_code=status.HTTP_201_CREATED)
@@ -35,7 +55,7 @@ async def create_category(
 ):
     image_path = None
     if file:
-        image_path = await save_image("categories", file)
+        image_path = await save_image(file, session=session)
     repository = ProductCategoryRepository(session)
     category = await repository.create({
         "name": name,
@@ -46,7 +66,7 @@ async def create_category(
         await session.flush()
     except Exception as e:
         await session.rollback()
-        await delete_image(image_path)
+        await discard_image(session, image_path)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"details: {e}"
@@ -55,7 +75,7 @@ async def create_category(
 
 
 @products_router.get("/categories", response_model=list[CategoryRead| None])
-async def get_categories(session: Annotated[AsyncSession, Depends(get_async_session)],):
+async def get_categories(session: Annotated[AsyncSession, Depends(get_read_session)],):
     repository = ProductCategoryRepository(session)
     categories = await repository.list()
     return categories
@@ -64,14 +84,16 @@ async def get_categories(session: Annotated[AsyncSession, Depends(get_async_sess
 @products_router.put("/categories/{_id}", response_model=CategoryRead)
 async def update_category(_id: int,
                           session: Annotated[AsyncSession, Depends(get_async_session)],
-                          file: Annotated[UploadFile | None, File()],
+                          file: Annotated[UploadFile | None, File()] = None,
                           name: str = Form(...),
+                          image_key: Annotated[Optional[str], Form()] = None,
                           ):
     repository = ProductCategoryRepository(session)
-    category =  await repository.update(_id, {
-        "name": name,
-        "image": file
-    })
+    payload = {"name": name}
+    # the image is only replaced when a new one is sent
+    if image_key or file:
+        payload["image"] = image_key or file
+    category =  await repository.update(_id, payload)
     try:
         await session.commit()
         await session.flush()
@@ -80,7 +102,7 @@ async def update_category(_id: int,
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"details: {e}"
         )
-    return category.model_validate(category)
+    return category
 
 @products_router.delete("/categories/{_id}",)
 async def delete_category(_id: int,
@@ -95,18 +117,30 @@ async def delete_category(_id: int,
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"details: {e}"
         )
-@products_router.get("/products")
-async def get_products(filters: Annotated[ProductFilter, Depends()],
-                       session: Annotated[AsyncSession, Depends(get_async_session)]) -> list[ProductRead]:
+@products_router.get("/products", response_model=list[ProductRead])
+async def get_products(filters: Annotated[ProductFilter, Depends(product_filters)],
+                       projection: Annotated[ProductProjection, Depends(product_projection)],
+                       session: Annotated[AsyncSession, Depends(get_read_session)]):
     repository = ProductRepository(session)
-    products = await repository.list(filters)
-    return products
+    products, next_cursor = await repository.list_page(filters, projection)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if projection.is_sparse:
+        return JSONBytesResponse(product_sparse_list_adapter.dump_json(products, exclude_unset=True),
+                                 headers=headers)
+    return JSONBytesResponse(product_list_adapter.dump_json(products), headers=headers)
+
+@products_router.get("/products/facets", response_model=ProductFacets)
+async def get_product_facets(filters: Annotated[ProductFilter, Depends(product_filters)],
+                             session: Annotated[AsyncSession, Depends(get_read_session)]):
+    repository = ProductRepository(session)
+    return await repository.facets(filters)
 
 @products_router.post("/products", response_model=ProductRead, status_code=status.HTTP_201_CREATED)
 async def create_product(
         session: Annotated[AsyncSession, Depends(get_async_session)],
         form_data: ProductCreateForm = Depends(),
         product_images: Annotated[list[UploadFile] | None, File()] = None,
+        image_keys: Annotated[Optional[str], Form()] = None,
 ):
     product_data = {
         "name": form_data.name,
@@ -116,37 +150,64 @@ async def create_product(
         "category_id": form_data.category_id,
     }
     repository = ProductRepository(session)
-    product = await repository.create(product_data)
-    await session.flush()
-
-    if product_images:
-        product_images_folder = os.path.join("products", f"product_{product.id}")
-        images = [save_image(product_images_folder, image) for image in product_images]
-        image_list = await asyncio.gather(*images)
-        await repository.create_images(image_list, product.id)
-
-    if form_data.specifications:
-        await repository.add_specifications(form_data.specifications, product.id)
+    # the statements fail on a bad category_id and the like, not only the commit
     try:
+        product = await repository.insert(product_data)
+
+        # images uploaded straight to the storage are only recorded, multipart uploads are stored first
+        image_list = await verify_uploaded_keys(session, parse_image_keys(image_keys) or [])
+        if product_images:
+            image_list += await repository.save_images(product_images)
+        images = await repository.create_images(image_list, product.id)
+        specifications = await repository.add_specifications(form_data.specifications, product.id)
         await session.commit()
+    except HTTPException:
+        await session.rollback()
+        raise
     except Exception as e:
         await session.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"details: {e}"
         )
-    product = await repository.get(product.id)
+    # answered from the returned rows, nothing is read back
+    return JSONBytesResponse(product_adapter.dump_json(repository.read(product, images, specifications)),
+                             status_code=status.HTTP_201_CREATED)
+
+
+@products_router.post("/products/import", response_model=ImportReport)
+async def import_products(
+        session: Annotated[AsyncSession, Depends(get_async_session)],
+        file: Annotated[UploadFile, File()],
+        format: Optional[CatalogFormatEnum] = None,
+):
+    fmt = format or detect_format(file.filename, file.content_type)
+    importer = ProductImporter(session)
+    return await importer.run(file.file, fmt)
 
-    return product
+
+@products_router.get("/products/export")
+async def export_products(filters: Annotated[ProductFilter, Depends(product_filters)],
+                          session_maker: Annotated[async_sessionmaker, Depends(get_read_session_maker)],
+                          format: CatalogFormatEnum = CatalogFormatEnum.ndjson):
+    media_type = "text/csv" if format == CatalogFormatEnum.csv else "application/x-ndjson"
+    return StreamingResponse(
+        export_catalog(session_maker, filters, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format.value}"'},
+    )
 
 
 @products_router.get("/products/{_id}", response_model=ProductRead)
 async def get_product(_id: int,
-                      session: Annotated[AsyncSession, Depends(get_async_session)],
+                      session: Annotated[AsyncSession, Depends(get_read_session)],
+                      projection: Annotated[ProductProjection, Depends(product_projection)],
                       ):
     repository = ProductRepository(session)
-    product = await repository.get(_id)
-    return product
+    if projection.is_sparse:
+        product = await repository.get_projected(_id, projection)
+        return JSONBytesResponse(product.model_dump_json(exclude_unset=True))
+    return JSONBytesResponse(await repository.get_json(_id))
 
 
 @products_router.put("/products/{_id}", response_model=ProductRead)
@@ -154,7 +215,8 @@ async def update_product(
                  _id: int ,
                  session: Annotated[AsyncSession, Depends(get_async_session)],
                  form_data: ProductCreateForm = Depends(),
-                 product_images: Annotated[list[UploadFile] | None, File()] = None
+                 product_images: Annotated[list[UploadFile] | None, File()] = None,
+                 image_ids: Annotated[Optional[str], Form()] = None,
                       ):
     repository = ProductRepository(session)
     product_data = {
@@ -164,18 +226,42 @@ async def update_product(
         "gender": form_data.gender,
         "category_id": form_data.category_id,
     }
-    product = await repository.update(_id, product_data)
-    await repository.update_product_images(product, product_images)
-    await repository.update_product_specifications(product, form_data.specifications)
+    try:
+        product = await repository.update(_id, product_data)
+        images = await repository.update_product_images(_id, parse_image_ids(image_ids), product_images)
+        specifications = await repository.update_product_specifications(_id, form_data.specifications)
+        await session.commit()
+    except HTTPException:
+        await session.rollback()
+        raise
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"details: {e}"
+        )
+    return JSONBytesResponse(product_adapter.dump_json(repository.read(product, images, specifications)))
+
+
+@products_router.patch("/products/{_id}/images", response_model=list[ProductImageRead])
+async def update_product_images(
+        _id: int,
+        session: Annotated[AsyncSession, Depends(get_async_session)],
+        image_ids: Annotated[Optional[str], Form()] = None,
+        product_images: Annotated[list[UploadFile] | None, File()] = None,
+):
+    repository = ProductRepository(session)
+    await repository.get(_id)
+    images = await repository.update_product_images(_id, parse_image_ids(image_ids), product_images)
     try:
         await session.commit()
-        await session.flush()
-        return product
     except Exception as e:
+        await session.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"details: {e}"
         )
+    return images
 
 
 @products_router.delete("/products/{_id}")
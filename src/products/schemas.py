@@ -4,14 +4,31 @@ from decimal import Decimal
 from datetime import datetime
 from enum import Enum
 
-from fastapi import Form
-from pydantic import BaseModel, ConfigDict, Field
+import json
+
+from fastapi import Form, HTTPException
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, TypeAdapter, ValidationError, computed_field, \
+    field_validator
+from starlette import status
+
+from ..media.storage import media_url
+from ..media.variants import variant_urls
 
 class GenderEnum(str, Enum):
     man = "man"
     woman = "woman"
     unisex = "unisex"
 
+class CatalogFormatEnum(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+class ProductSortEnum(str, Enum):
+    newest = "newest"
+    price_asc = "price_asc"
+    price_desc = "price_desc"
+    relevance = "relevance"
+
 # ---------- Category ----------
 class CategoryBase(BaseModel):
     name: str
@@ -24,6 +41,16 @@ class CategoryRead(CategoryBase):
     id: int
     model_config = ConfigDict(from_attributes=True)
 
+    @computed_field
+    @property
+    def image_url(self) -> Optional[str]:
+        return media_url(self.image)
+
+    @computed_field
+    @property
+    def image_variants(self) -> dict[str, dict[str, str]]:
+        return variant_urls(self.image)
+
 # ---------- Product Image ----------
 class ProductImageBase(BaseModel):
     image_url: str
@@ -33,8 +60,19 @@ class ProductImageCreate(ProductImageBase):
 
 class ProductImageRead(ProductImageBase):
     id: int
+    position: int = 0
     model_config = ConfigDict(from_attributes=True)
 
+    @computed_field
+    @property
+    def url(self) -> str:
+        return media_url(self.image_url)
+
+    @computed_field
+    @property
+    def variants(self) -> dict[str, dict[str, str]]:
+        return variant_urls(self.image_url)
+
 # ---------- Product Specification ----------
 class ProductSpecificationCreate(BaseModel):
     key: str
@@ -86,13 +124,186 @@ class ProductRead(ProductBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+# built once, reused for every request
+product_adapter = TypeAdapter(ProductRead)
+product_list_adapter = TypeAdapter(List[ProductRead])
+image_ids_adapter = TypeAdapter(List[int])
+image_keys_adapter = TypeAdapter(List[str])
+
+
+def _parse_json_list(adapter: TypeAdapter, raw: Optional[str], detail: str) -> Optional[list]:
+    if raw is None:
+        return None
+    try:
+        return adapter.validate_json(raw)
+    except ValidationError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def parse_image_ids(raw: Optional[str]) -> Optional[List[int]]:
+    """``image_ids`` form field: a JSON list of the image ids to keep, in display order."""
+    return _parse_json_list(image_ids_adapter, raw, "image_ids must be a JSON list of image ids")
+
+
+def parse_image_keys(raw: Optional[str]) -> Optional[List[str]]:
+    """``image_keys`` form field: a JSON list of storage keys of direct uploads."""
+    return _parse_json_list(image_keys_adapter, raw, "image_keys must be a JSON list of storage keys")
+
+PRODUCT_COLUMNS = {"id", "name", "description", "price", "gender", "category_id", "created_at", "updated_at"}
+PRODUCT_RELATIONS = {"images", "specifications"}
+PRODUCT_INCLUDES = PRODUCT_RELATIONS | {"thumbnail"}
+
+class ProductSparseRead(BaseModel):
+    """A ProductRead with only the requested fields, serialize with ``exclude_unset``."""
+    id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[Decimal] = None
+    gender: Optional[GenderEnum] = None
+    category_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    specifications: Optional[List[ProductSpecificationRead]] = None
+    images: Optional[List[ProductImageRead]] = None
+    thumbnail: Optional[ProductImageRead] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ProductProjection(BaseModel):
+    fields: Optional[str] = None  # Comma separated ProductRead fields, e.g. "name,price"
+    include: Optional[str] = None  # Comma separated extras: images, specifications, thumbnail
+
+    @field_validator("fields")
+    @classmethod
+    def validate_fields(cls, value):
+        unknown = _split(value) - PRODUCT_COLUMNS - PRODUCT_RELATIONS
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return value
+
+    @field_validator("include")
+    @classmethod
+    def validate_include(cls, value):
+        unknown = _split(value) - PRODUCT_INCLUDES
+        if unknown:
+            raise ValueError(f"Unknown includes: {', '.join(sorted(unknown))}")
+        return value
+
+    @property
+    def is_sparse(self) -> bool:
+        return bool(self.fields or self.include)
+
+    @property
+    def columns(self) -> set[str]:
+        if not self.fields:
+            return set(PRODUCT_COLUMNS)
+        return (_split(self.fields) & PRODUCT_COLUMNS) | {"id"}
+
+    @property
+    def relations(self) -> set[str]:
+        return (_split(self.fields) | _split(self.include)) & PRODUCT_RELATIONS
+
+    @property
+    def thumbnail(self) -> bool:
+        return "thumbnail" in _split(self.include)
+
+product_sparse_list_adapter = TypeAdapter(List[ProductSparseRead])
+
+def _split(value: Optional[str]) -> set[str]:
+    return {part.strip() for part in (value or "").split(",") if part.strip()}
+
 class ProductFilter(BaseModel):
     category_id: Optional[int] = None
     gender: Optional[GenderEnum] = None
     min_price: Optional[float] = Field(None, ge=0)  # Minimum price, must be >= 0
     max_price: Optional[float] = Field(None, ge=0)  # Maximum price, must be >= 0
     search: Optional[str] = None
+    sort: Optional[ProductSortEnum] = None  # Defaults to relevance when searching, newest otherwise
+    cursor: Optional[str] = None  # Opaque keyset cursor, takes precedence over offset
     offset: Optional[int] = Field(default=0, ge=0)
     limit: Optional[int] = Field(default=20, ge=1, le=100)
+    # spec.<key>=<value> query parameters; not a field, FastAPI can't declare arbitrary parameter names
+    _specs: dict[str, str] = PrivateAttr(default_factory=dict)
 
     model_config = ConfigDict(from_attributes=True)
+
+    @property
+    def specs(self) -> dict[str, str]:
+        return self._specs
+
+    def with_specs(self, specs: dict[str, str]) -> "ProductFilter":
+        self._specs = dict(specs)
+        return self
+
+
+SPEC_FILTER_PREFIX = "spec."
+MAX_SPEC_FILTERS = 10
+
+
+def parse_spec_filters(query_params) -> dict[str, str]:
+    """``{"material": "cotton"}`` for ``?spec.material=cotton``."""
+    specs = {name[len(SPEC_FILTER_PREFIX):]: value for name, value in query_params.items()
+             if name.startswith(SPEC_FILTER_PREFIX) and len(name) > len(SPEC_FILTER_PREFIX)}
+    if len(specs) > MAX_SPEC_FILTERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {MAX_SPEC_FILTERS} spec filters are allowed")
+    return specs
+
+
+class CategoryFacet(BaseModel):
+    category_id: Optional[int] = None
+    count: int
+
+class GenderFacet(BaseModel):
+    gender: GenderEnum
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    min_price: Optional[Decimal] = None
+    max_price: Optional[Decimal] = None
+    count: int
+
+class ProductFacets(BaseModel):
+    total: int = 0
+    categories: List[CategoryFacet] = Field(default_factory=list)
+    genders: List[GenderFacet] = Field(default_factory=list)
+    price_buckets: List[PriceBucketFacet] = Field(default_factory=list)
+
+# ---------- Bulk import ----------
+class ProductImportRow(ProductBase):
+    price: Decimal = Field(ge=0, max_digits=10, decimal_places=2)
+    specifications: dict[str, str] = Field(default_factory=dict)
+    images: List[str] = Field(default_factory=list)
+
+    @field_validator("description", "category_id", mode="before")
+    @classmethod
+    def empty_to_none(cls, value):
+        return None if value == "" else value
+
+    @field_validator("specifications", mode="before")
+    @classmethod
+    def parse_specifications(cls, value):
+        # CSV cells carry the specifications as a JSON object
+        if isinstance(value, str):
+            return json.loads(value) if value else {}
+        return value
+
+    @field_validator("images", mode="before")
+    @classmethod
+    def parse_images(cls, value):
+        # CSV cells carry image paths separated by "|"
+        if isinstance(value, str):
+            return [image for image in value.split("|") if image]
+        return value
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    total: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = Field(default_factory=list)
+    elapsed_seconds: float = 0
+    rows_per_second: float = 0
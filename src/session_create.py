@@ -1,27 +1,18 @@
 from contextlib import asynccontextmanager
 
-from .configs import settings
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 
-engine = create_async_engine(settings.DATABASE_URL_asyncpg)
-session_maker = async_sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+# one engine and pool for the whole app, see database.py
+from .database import engine, async_session_factory as session_maker, get_async_session, get_read_session, \
+    get_read_session_maker
 
-async def get_async_session():
-    session = session_maker()
-    yield session
+
+def get_session_maker():
+    return session_maker
 
 class UnitOfWork:
     def __init__(self):
-        self.engine = create_async_engine(settings.DATABASE_URL_asyncpg)
-        self.session_maker = async_sessionmaker(
-            bind=self.engine,
-            class_=AsyncSession,
-            expire_on_commit=False,
-        )
+        self.session_maker = session_maker
 
     async def __aenter__(self):
         self.session: AsyncSession = self.session_maker()
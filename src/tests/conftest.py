@@ -3,23 +3,44 @@ import os
 
 import pytest
 import pytest_asyncio
-from sqlalchemy import NullPool
+from sqlalchemy import NullPool, event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from src.configs import tmp_settings
 from src.products.models import Base
 from ..main import app
-from ..session_create import get_async_session
+from ..session_create import get_async_session, get_session_maker, get_read_session, get_read_session_maker
 
 engine_test = create_async_engine(tmp_settings.DATABASE_URL_asyncpg, poolclass=NullPool)
 async_session_maker = async_sessionmaker(engine_test, expire_on_commit=False)
 Base.metadata.bind = engine_test
 
 
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("RUN_QUERY_PLAN_TESTS"):
+        return
+    skip = pytest.mark.skip(reason="seeds a large dataset, set RUN_QUERY_PLAN_TESTS=1 to run")
+    for item in items:
+        if "query_plan" in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest_asyncio.fixture
 async def session():
     async with async_session_maker() as session:
         yield session
 
+@pytest.fixture
+def statements():
+    """SQL statements sent to the test database while the test runs."""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine_test.sync_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine_test.sync_engine, "before_cursor_execute", record)
+
 # Override FastAPI dependency before tests run
 @pytest_asyncio.fixture(autouse=True, scope="session")
 def override_get_async_session():
@@ -27,6 +48,9 @@ def override_get_async_session():
         async with async_session_maker() as session:
             yield session
     app.dependency_overrides[get_async_session] = _override
+    app.dependency_overrides[get_read_session] = _override
+    app.dependency_overrides[get_session_maker] = lambda: async_session_maker
+    app.dependency_overrides[get_read_session_maker] = lambda: async_session_maker
     yield
     app.dependency_overrides.clear()
 
@@ -0,0 +1,116 @@
+import time
+import uuid
+from unittest.mock import patch
+
+import httpx
+from httpx import AsyncClient
+from sqlalchemy import delete
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.cart.service import CART_COOKIE, anonymous_cart_id, merge_anonymous_cart, user_cart_id
+from src.cart.store import MemoryCartStore, cart_store
+from src.main import app
+from src.products.models import Category, Product, ProductImage
+
+
+async def test_memory_cart_store_expires_and_evicts():
+    store = MemoryCartStore(maxsize=2, ttl=60)
+    await store.add("a", 1, 2)
+    assert await store.add("a", 1, 1) == 3
+    await store.set("b", 1, 1)
+    await store.get("a")
+    await store.add("c", 1, 1)
+    # "b" was used least recently
+    assert await store.get("b") == {}
+    assert await store.get("a") == {1: 3}
+    assert store.stats()["evictions"] == 1
+
+    with patch("src.cart.store.time.monotonic", return_value=time.monotonic() + 61):
+        assert await store.get("a") == {}
+    assert store.stats()["expirations"] == 1
+
+
+async def test_memory_cart_store_merges_atomically():
+    store = MemoryCartStore(maxsize=10, ttl=60)
+    await store.add("anon", 1, 2)
+    await store.add("anon", 2, 1)
+    await store.add("user", 1, 1)
+    assert await store.merge("anon", "user") == {1: 3, 2: 1}
+    assert await store.get("anon") == {}
+    assert await store.merge("anon", "user") == {1: 3, 2: 1}
+
+
+async def test_memory_cart_store_merge_keeps_the_cart_limits():
+    store = MemoryCartStore(maxsize=10, ttl=60)
+    await store.add("anon", 1, 60)
+    await store.add("anon", 2, 1)
+    await store.add("anon", 3, 1)
+    await store.add("user", 1, 60)
+    await store.add("user", 4, 1)
+    assert await store.merge("anon", "user", max_quantity=99, max_lines=3) == {1: 99, 2: 1, 4: 1}
+
+
+async def test_cart_item_quantity_is_capped_cumulatively():
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/cart/items", json={"product_id": 1, "quantity": 60})
+        assert response.json() == {"product_id": 1, "quantity": 60}
+        response = await client.post("/cart/items", json={"product_id": 1, "quantity": 60})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "A cart holds at most 99 of a product"
+        response = await client.post("/cart/items", json={"product_id": 1, "quantity": 39})
+        assert response.json() == {"product_id": 1, "quantity": 99}
+        await client.delete("/cart")
+
+
+async def test_cart_is_priced_in_one_query(session, statements):
+    category = Category(name=f"cart_{uuid.uuid4().hex[:8]}")
+    session.add(category)
+    await session.flush()
+    shirt = Product(name="Cart shirt", price="10.50", category_id=category.id)
+    boots = Product(name="Cart boots", price="40.00", category_id=category.id)
+    session.add_all([shirt, boots])
+    await session.flush()
+    session.add(ProductImage(image_url="media/shirt.jpg", product_id=shirt.id))
+    await session.commit()
+
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        statements.clear()
+        response = await client.post("/cart/items", json={"product_id": shirt.id, "quantity": 2})
+        assert response.json() == {"product_id": shirt.id, "quantity": 2}
+        assert CART_COOKIE in response.cookies
+        await client.post("/cart/items", json={"product_id": boots.id})
+        await client.post("/cart/items", json={"product_id": boots.id + 1000})
+        await client.put(f"/cart/items/{boots.id}", json={"quantity": 3})
+        assert statements == []
+
+        response = await client.get("/cart")
+        assert len(statements) == 1
+    cart = response.json()
+    lines = {line["product_id"]: line for line in cart["lines"]}
+    assert lines[shirt.id]["line_total"] == "21.00"
+    assert lines[shirt.id]["image_url"] == "media/shirt.jpg"
+    assert lines[boots.id]["quantity"] == 3
+    assert lines[boots.id + 1000]["available"] is False
+    assert cart["total"] == "141.00"
+    assert cart["total_quantity"] == 5
+
+    await session.execute(delete(Product).where(Product.category_id == category.id))
+    await session.execute(delete(Category).where(Category.id == category.id))
+    await session.commit()
+
+
+async def test_anonymous_cart_merges_at_login():
+    token = uuid.uuid4().hex
+    user_id = uuid.uuid4()
+    await cart_store.add(anonymous_cart_id(token), 7, 2)
+    await cart_store.add(user_cart_id(user_id), 7, 1)
+    request = Request({"type": "http", "method": "POST",
+                       "headers": [(b"cookie", f"{CART_COOKIE}={token}".encode())]})
+    response = Response()
+
+    await merge_anonymous_cart(user_id, request, response)
+    assert await cart_store.get(user_cart_id(user_id)) == {7: 3}
+    assert await cart_store.get(anonymous_cart_id(token)) == {}
+    assert f'{CART_COOKIE}=""' in response.headers["set-cookie"]
+    await cart_store.clear(user_cart_id(user_id))
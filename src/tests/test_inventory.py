@@ -0,0 +1,145 @@
+import asyncio
+import uuid
+from datetime import timedelta
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from httpx import AsyncClient
+from sqlalchemy import delete, update
+
+from src.auth.f_users import current_active_user
+from src.auth.models import User
+from src.cart.service import user_cart_id
+from src.cart.store import cart_store
+from src.inventory.models import StockReservation
+from src.inventory.repository import StockRepository, split
+from src.main import app
+from src.products.models import Category, Product
+from .conftest import async_session_maker
+
+
+@pytest_asyncio.fixture
+async def product(session):
+    category = Category(name=f"stock_{uuid.uuid4().hex[:8]}")
+    session.add(category)
+    await session.flush()
+    product = Product(name="Stock product", price="5.00", category_id=category.id)
+    session.add(product)
+    await session.commit()
+    yield product
+    await session.execute(delete(Product).where(Product.id == product.id))
+    await session.execute(delete(Category).where(Category.id == category.id))
+    await session.commit()
+
+
+def test_split_spreads_the_remainder():
+    assert split(10, 4) == [3, 3, 2, 2]
+    assert split(1, 3) == [1, 0, 0]
+
+
+async def test_take_skips_shards_locked_by_other_checkouts(session, product):
+    stock = StockRepository(session)
+    await stock.set_stock(product.id, 4, shards=4)
+    await session.commit()
+    async with async_session_maker() as first, async_session_maker() as second:
+        taken = await StockRepository(first).take({product.id: 1})
+        # the first transaction still holds its shard, the second one does not wait for it
+        other = await asyncio.wait_for(StockRepository(second).take({product.id: 1}), timeout=2)
+        assert taken.keys() != other.keys()
+        await first.commit()
+        await second.commit()
+    assert (await stock.read(product.id)).quantity == 2
+
+
+async def test_take_gives_up_on_busy_shards_instead_of_waiting(session, product):
+    await StockRepository(session).set_stock(product.id, 3)
+    await session.commit()
+    async with async_session_maker() as first, async_session_maker() as second:
+        await StockRepository(first).take({product.id: 1})
+        with pytest.raises(HTTPException) as error:
+            await StockRepository(second).take({product.id: 1}, timeout=0.05)
+        assert error.value.status_code == 503
+        await first.commit()
+
+
+async def test_take_across_shards_when_no_single_shard_has_enough(session, product):
+    stock = StockRepository(session)
+    await stock.set_stock(product.id, 5, shards=5)
+    assert sum((await stock.take({product.id: 3})).values()) == 3
+    with pytest.raises(HTTPException) as error:
+        await stock.take({product.id: 3})
+    assert error.value.status_code == 409
+    await session.commit()
+    assert (await stock.read(product.id)).quantity == 2
+
+
+async def test_set_stock_keeps_reserved_stock_off_the_shards(session, product):
+    stock = StockRepository(session)
+    await stock.set_stock(product.id, 10, shards=2)
+    await stock.reserve("cart:test:set_stock", {product.id: 3})
+    await stock.set_stock(product.id, 10, shards=2)
+    assert (await stock.read(product.id)).model_dump() == {
+        "product_id": product.id, "quantity": 7, "reserved": 3, "shards": 2}
+    with pytest.raises(HTTPException) as error:
+        await stock.set_stock(product.id, 2, shards=2)
+    assert error.value.status_code == 409
+    assert await stock.release("cart:test:set_stock") == 1
+    await session.commit()
+    assert (await stock.read(product.id)).quantity == 10
+
+
+async def test_give_back_locks_shards_in_order(session, product):
+    stock = StockRepository(session)
+    await stock.set_stock(product.id, 4, shards=4)
+    await session.commit()
+    allocations = {(product.id, 3): 1, (product.id, 0): 1, (product.id, 2): 1}
+    reversed_order = dict(reversed(list(allocations.items())))
+
+    async def give_back(allocations):
+        async with async_session_maker() as other:
+            await StockRepository(other).give_back(allocations)
+            await asyncio.sleep(0.05)
+            await other.commit()
+
+    # without a common lock order these two would deadlock more often than not
+    await asyncio.wait_for(asyncio.gather(give_back(allocations), give_back(reversed_order)), timeout=5)
+    assert (await stock.read(product.id)).quantity == 10
+
+
+async def test_reservation_is_consumed_by_checkout_or_released_when_expired(session, product):
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x", name="Test", surname="Stock")
+    session.add(user)
+    stock = StockRepository(session)
+    await stock.set_stock(product.id, 10, shards=2)
+    await session.commit()
+    app.dependency_overrides[current_active_user] = lambda: user
+    try:
+        await cart_store.set(user_cart_id(user.id), product.id, 3)
+        async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/cart/reservation")
+            assert response.status_code == 200
+            assert response.json()["lines"] == {str(product.id): 3}
+            assert (await stock.read(product.id)).model_dump() == {
+                "product_id": product.id, "quantity": 7, "reserved": 3, "shards": 2}
+
+            # the cart grew after the reservation, only the difference is taken
+            await cart_store.set(user_cart_id(user.id), product.id, 4)
+            assert (await client.post("/orders")).status_code == 201
+            assert (await stock.read(product.id)).model_dump() == {
+                "product_id": product.id, "quantity": 6, "reserved": 0, "shards": 2}
+
+            await cart_store.set(user_cart_id(user.id), product.id, 2)
+            assert (await client.post("/cart/reservation")).status_code == 200
+        await session.execute(
+            update(StockReservation).values(expires_at=StockReservation.expires_at - timedelta(hours=1)))
+        assert await stock.release_expired() == 1
+        await session.commit()
+        assert (await stock.read(product.id)).model_dump() == {
+            "product_id": product.id, "quantity": 6, "reserved": 0, "shards": 2}
+    finally:
+        del app.dependency_overrides[current_active_user]
+        await cart_store.clear(user_cart_id(user.id))
+        await session.execute(delete(User).where(User.id == user.id))
+        await session.commit()
@@ -0,0 +1,324 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+import uuid
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi import HTTPException, UploadFile
+from httpx import AsyncClient
+from PIL import Image
+from sqlalchemy import delete
+from starlette.datastructures import Headers
+
+from src.auth.f_users import current_active_user
+from src.configs import MEDIA_DIR, settings
+from src.core import session_hooks
+from src.main import app
+from src.media.gc import collect_orphans
+from src.media.serving import MediaFiles, ZEROCOPY_EXTENSION, single_range
+from src.media.storage import S3Storage, get_storage, remove_files
+from src.media.store import count_references, full_path, object_path, remove_unreferenced
+from src.media.uploads import UploadBudget, probe_image, save_upload
+from src.media.variants import generate_variants, variant_path, variant_paths, variant_urls
+from src.products.models import Category
+from src.products.repository import ProductCategoryRepository
+from src.tests.conftest import async_session_maker, engine_test
+
+
+def test_generate_variants(tmp_path):
+    source = os.path.join(tmp_path, "photo.png")
+    Image.new("RGBA", (1200, 600), (255, 0, 0, 128)).save(source)
+
+    created = generate_variants(source, {"thumb": 200}, ["webp", "jpeg"], quality=80)
+
+    assert created == [variant_path(source, "thumb", "webp"), variant_path(source, "thumb", "jpeg")]
+    with Image.open(created[0]) as thumb:
+        assert thumb.size == (200, 100)
+
+
+def test_variant_urls_without_touching_the_disk():
+    image_path = f"media/products/test_{uuid.uuid4().hex}/photo.jpg"
+    thumb = image_path.replace("photo.jpg", "photo_thumb.webp")
+    assert variant_paths(image_path)["thumb"]["webp"] == thumb
+    with patch("os.path.exists") as mock_exists:
+        assert variant_urls(image_path)["thumb"]["webp"] == thumb
+    mock_exists.assert_not_called()
+    assert variant_urls("../assets/test_image.jpg") == {}
+    assert variant_urls(None) == {}
+
+
+def make_upload(data: bytes, filename="photo.png", content_type="image/png") -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=filename, headers=Headers({"content-type": content_type}))
+
+
+def png_bytes(size=(320, 240), color="blue") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def saved_paths():
+    paths = []
+    with patch("src.media.uploads.schedule_variants"):
+        yield paths
+    for path in paths:
+        remove_files(path)
+
+
+async def test_save_upload_streams_hash_and_dimensions(saved_paths):
+    data = png_bytes()
+    with patch.object(settings, "UPLOAD_CHUNK_SIZE", 100), \
+            patch("src.media.uploads.probe_image", wraps=probe_image) as mock_probe:
+        saved = await save_upload(make_upload(data))
+    saved_paths.append(saved.path)
+    # probed once for the whole upload, not for every chunk
+    assert mock_probe.call_count == 1
+
+    assert (saved.width, saved.height) == (320, 240)
+    assert saved.size == len(data)
+    assert saved.sha256 == hashlib.sha256(data).hexdigest()
+    assert saved.path == f"media/objects/{saved.sha256[:2]}/{saved.sha256[2:4]}/{saved.sha256}.png"
+    with open(full_path(saved.path), "rb") as f:
+        assert f.read() == data
+
+
+async def test_save_upload_deduplicates(saved_paths):
+    data = png_bytes(color="green")
+    first = await save_upload(make_upload(data, filename="a.png"))
+    saved_paths.append(first.path)
+    with patch.object(get_storage(), "put") as mock_put:
+        second = await save_upload(make_upload(data, filename="b.jpeg"))
+
+    assert first.created and not second.created
+    assert second.path == first.path
+    mock_put.assert_not_called()
+
+
+async def test_save_upload_limits(saved_paths):
+    data = png_bytes(color="red")
+    with patch.object(settings, "MAX_IMAGE_SIZE", len(data) - 1):
+        with pytest.raises(HTTPException) as e:
+            await save_upload(make_upload(data))
+    assert e.value.status_code == 413
+
+    budget = UploadBudget(limit=len(data) * 2 - 1)
+    saved_paths.append((await save_upload(make_upload(data), budget)).path)
+    with pytest.raises(HTTPException) as e:
+        await save_upload(make_upload(png_bytes(color="yellow")), budget)
+    assert e.value.status_code == 413
+
+    with pytest.raises(HTTPException) as e:
+        await save_upload(make_upload(b"not an image"))
+    assert e.value.status_code == 400
+
+
+async def test_file_removed_with_last_reference(session, saved_paths):
+    saved = await save_upload(make_upload(png_bytes(color="purple")))
+    saved_paths.append(saved.path)
+    first, second = Category(name="refcount_1", image=saved.path), Category(name="refcount_2", image=saved.path)
+    session.add_all([first, second])
+    await session.commit()
+    assert await count_references(session, saved.path) == 2
+
+    repository = ProductCategoryRepository(session)
+    for category, still_referenced in ((first, True), (second, False)):
+        await repository.delete(category.id)
+        await session.commit()
+        await asyncio.gather(*session_hooks._background_tasks)
+        assert os.path.exists(full_path(saved.path)) == still_referenced
+
+
+async def test_file_not_removed_under_uncommitted_reference(session, saved_paths):
+    data = png_bytes(color="teal")
+    saved = await save_upload(make_upload(data))
+    saved_paths.append(saved.path)
+    async with async_session_maker() as request_session:
+        # a concurrent upload of the same content reuses the stored file
+        reused = await save_upload(make_upload(data), session=request_session)
+        assert not reused.created
+        request_session.add(Category(name="uncommitted_reference", image=reused.path))
+        await request_session.flush()
+
+        remover = asyncio.create_task(remove_unreferenced(engine_test, saved.path))
+        await asyncio.sleep(0.2)
+        assert not remover.done()  # waits for the upload's transaction
+        await request_session.commit()
+        assert await remover is False
+    assert os.path.exists(full_path(saved.path))
+    await session.execute(delete(Category).where(Category.name == "uncommitted_reference"))
+    await session.commit()
+
+
+async def test_media_serving_caching_and_ranges(saved_paths):
+    data = png_bytes(color="orange")
+    saved = await save_upload(make_upload(data))
+    saved_paths.append(saved.path)
+    url = "/" + saved.path
+
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert response.content == data
+        assert response.headers["etag"] == f'"{saved.sha256}"'
+        assert "immutable" in response.headers["cache-control"]
+
+        response = await client.get(url, headers={"If-None-Match": f'"{saved.sha256}"'})
+        assert response.status_code == 304
+
+        response = await client.get(url, headers={"Range": "bytes=0-9"})
+        assert response.status_code == 206
+        assert response.content == data[:10]
+        assert response.headers["content-range"] == f"bytes 0-9/{len(data)}"
+
+        with patch.object(settings, "MEDIA_ACCEL_REDIRECT", "/protected-media/"):
+            response = await client.get(url)
+        assert response.status_code == 200
+        assert response.content == b""
+        assert response.headers["x-accel-redirect"] == "/protected-media/" + saved.path.removeprefix("media/")
+        assert response.headers["content-type"] == "image/png"
+
+        # the variant is not generated, the original stands in for it until it is
+        response = await client.get("/" + variant_path(saved.path, "thumb", "webp"))
+        assert response.status_code == 200
+        assert response.content == data
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["cache-control"] == "public, no-cache"
+        response = await client.get("/" + variant_path(saved.path.replace(saved.sha256, "0" * 64), "thumb", "webp"))
+        assert response.status_code == 404
+
+
+def test_single_range():
+    assert single_range("bytes=5-14", 100) == (5, 15)
+    assert single_range("bytes=90-", 100) == (90, 100)
+    assert single_range("bytes=-10", 100) == (90, 100)
+    assert single_range("bytes=50-500", 100) == (50, 100)
+    for http_range in ("bytes=100-", "bytes=0-1,5-6", "bytes=-", "items=0-1"):
+        assert single_range(http_range, 100) is None
+
+
+async def test_media_serving_zerocopy(saved_paths):
+    data = png_bytes(color="pink")
+    saved = await save_upload(make_upload(data))
+    saved_paths.append(saved.path)
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            message["file"].seek(message["offset"])
+            message = {**message, "body": message["file"].read(message["count"] or -1)}
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": saved.path.removeprefix("media"), "root_path": "",
+             "query_string": b"", "headers": [(b"range", b"bytes=5-14")],
+             "extensions": {ZEROCOPY_EXTENSION: {}}}
+    await MediaFiles(directory=MEDIA_DIR)(scope, receive, send)
+
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == ZEROCOPY_EXTENSION
+    assert messages[1]["body"] == data[5:15]
+
+
+async def test_collect_orphans(session, tmp_path):
+    root = tmp_path / "media"
+    objects = root / "objects" / "ab"
+    objects.mkdir(parents=True)
+    files = {name: objects / name for name in (
+        "kept.png", "kept_thumb.webp", "orphan.png", "orphan_thumb.webp", "lost_thumb.webp",
+        "upload.png.1234.tmp", "fresh.png")}
+    for path in files.values():
+        path.write_bytes(b"x")
+    old = time.time() - 7200
+    for name, path in files.items():
+        if name != "fresh.png":
+            os.utime(path, (old, old))
+    session.add(Category(name="gc_category", image="media/objects/ab/kept.png"))
+    await session.commit()
+
+    removed = await collect_orphans(async_session_maker, root=str(root), batch_size=2, grace_period=3600)
+
+    assert removed == 3  # orphan.png (with its variant), lost_thumb.webp, the stale tmp file
+    assert sorted(os.listdir(objects)) == ["fresh.png", "kept.png", "kept_thumb.webp"]
+    await session.execute(delete(Category).where(Category.name == "gc_category"))
+    await session.commit()
+
+
+async def test_direct_upload_local(session, saved_paths):
+    category = Category(name="direct_upload_category")
+    session.add(category)
+    await session.commit()
+    data = png_bytes(color="cyan")
+    intent = {"sha256": hashlib.sha256(data).hexdigest(), "content_type": "image/png", "size": len(data)}
+
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.post("/uploads", json=intent)).status_code == 401
+        app.dependency_overrides[current_active_user] = lambda: None
+        upload = (await client.post("/uploads", json=intent)).json()
+        assert upload["exists"] is False and upload["method"] == "PUT"
+        # the presigned URL and its headers are all the PUT needs
+        del app.dependency_overrides[current_active_user]
+
+        response = await client.put(upload["url"], content=data[:-1] + b"\0", headers=upload["headers"])
+        assert response.status_code == 400
+        response = await client.put(upload["url"] + "x", content=data, headers=upload["headers"])
+        assert response.status_code == 403
+
+        response = await client.put(upload["url"], content=data, headers=upload["headers"])
+        assert response.status_code == 200
+        saved_paths.append(upload["key"])
+        assert response.json()["path"] == upload["key"]
+        app.dependency_overrides[current_active_user] = lambda: None
+        assert (await client.post("/uploads", json=intent)).json()["exists"] is True
+
+        form = {"name": "Direct upload", "description": "d", "price": "10", "gender": "unisex",
+                "category_id": category.id}
+        response = await client.post("/products/products", data={**form, "image_keys": json.dumps(["media/x"])})
+        assert response.status_code == 400
+        response = await client.post("/products/products", data={**form, "image_keys": json.dumps([upload["key"]])})
+        assert response.status_code == 201
+        assert [image["image_url"] for image in response.json()["images"]] == [upload["key"]]
+        assert [image["url"] for image in response.json()["images"]] == [upload["key"]]
+        await client.delete(f"/products/products/{response.json()['id']}")
+    del app.dependency_overrides[current_active_user]
+    await session.delete(category)
+    await session.commit()
+
+
+async def test_s3_storage_presigned_upload():
+    pytest.importorskip("moto")
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        storage = S3Storage("media", endpoint_url=f"http://{host}:{port}", region_name="us-east-1",
+                            aws_access_key_id="test", aws_secret_access_key="test")
+        storage.client.create_bucket(Bucket="media")
+        data = png_bytes(color="white")
+        sha256 = hashlib.sha256(data).hexdigest()
+        key = object_path(sha256, "PNG")
+        assert not await storage.keep(key)
+
+        upload = storage.presign_upload(key, "image/png", len(data), sha256)
+        async with AsyncClient() as client:
+            response = await client.put(upload["url"], content=data, headers=upload["headers"])
+            assert response.status_code == 200
+            assert await storage.keep(key)
+            # private bucket: a presigned download URL
+            assert (await client.get(storage.url(key))).content == data
+        with patch.object(settings, "S3_PUBLIC_URL", "https://cdn.example.com/"):
+            assert storage.url(key) == f"https://cdn.example.com/{key}"
+
+        await storage.delete(key)
+        assert not await storage.keep(key)
+    finally:
+        server.stop()
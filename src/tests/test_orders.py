@@ -0,0 +1,184 @@
+import asyncio
+import uuid
+from decimal import Decimal
+
+import httpx
+import pytest_asyncio
+from httpx import AsyncClient
+from sqlalchemy import delete, func, select, text
+
+from src.auth.f_users import current_active_user
+from src.auth.models import User
+from src.cart.service import user_cart_id
+from src.cart.store import cart_store
+from src.inventory.repository import StockRepository
+from src.main import app
+from src.orders.models import Order
+from src.orders.repository import OrderRepository
+from src.orders.schemas import OrderHistoryFilter
+from src.products.models import Category, Product, ProductImage
+from .conftest import async_session_maker, engine_test
+from .test_products.test_query_plans import explain, plan_nodes
+
+
+@pytest_asyncio.fixture
+async def shopper(session):
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x", name="Test", surname="Shopper")
+    category = Category(name=f"orders_{uuid.uuid4().hex[:8]}")
+    session.add_all([user, category])
+    await session.flush()
+    products = [Product(name=f"Order product {i}", price=price, category_id=category.id)
+                for i, price in enumerate(("10.00", "2.50"))]
+    session.add_all(products)
+    await session.commit()
+    app.dependency_overrides[current_active_user] = lambda: user
+    yield user, products
+    del app.dependency_overrides[current_active_user]
+    await session.execute(delete(User).where(User.id == user.id))
+    await session.execute(delete(Product).where(Product.category_id == category.id))
+    await session.execute(delete(Category).where(Category.id == category.id))
+    await session.commit()
+
+
+async def count_orders(session, user) -> int:
+    return (await session.execute(select(func.count()).where(Order.user_id == user.id))).scalar()
+
+
+async def test_place_order_prices_items_in_the_database(session, shopper, statements):
+    user, (shirt, socks) = shopper
+    stock = StockRepository(session)
+    await stock.set_stock(shirt.id, 10, shards=4)
+    await session.commit()
+    items = [{"product_id": shirt.id, "quantity": 2}, {"product_id": socks.id, "quantity": 3},
+             {"product_id": socks.id, "quantity": 1}]
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        statements.clear()
+        response = await client.post("/orders", json={"items": items})
+    assert response.status_code == 201
+    # price lookup, stock decrement, order insert, one multi-row item insert
+    assert len(statements) == 4
+    # socks are not stock-tracked
+    assert (await stock.read(shirt.id)).quantity == 8
+    assert (await stock.read(socks.id)).shards == 0
+    order = response.json()
+    assert Decimal(order["total_amount"]) == Decimal("30.00")
+    assert sorted((item["product_id"], item["quantity"], item["unit_price"]) for item in order["items"]) == [
+        (shirt.id, 2, "10.00"), (socks.id, 4, "2.50")]
+
+
+async def test_place_order_is_idempotent(session, shopper):
+    user, (shirt, _) = shopper
+    body = {"items": [{"product_id": shirt.id, "quantity": 1}]}
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.post("/orders", json=body, headers=headers)
+        retry = await client.post("/orders", json=body, headers=headers)
+        other = await client.post("/orders", json={"items": [{"product_id": shirt.id, "quantity": 2}]},
+                                  headers=headers)
+        # concurrent retries race on the unique key, none of them makes a second order
+        racing = await asyncio.gather(*(client.post("/orders", json=body, headers={"Idempotency-Key": "race"})
+                                        for _ in range(10)))
+    assert first.status_code == 201
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert other.status_code == 409
+    assert sorted(response.status_code for response in racing) == [200] * 9 + [201]
+    assert len({response.json()["id"] for response in racing}) == 1
+    assert await count_orders(session, user) == 2
+
+
+async def test_place_order_from_cart(session, shopper):
+    user, (shirt, socks) = shopper
+    await cart_store.add(user_cart_id(user.id), shirt.id, 1)
+    await cart_store.add(user_cart_id(user.id), socks.id, 2)
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/orders")
+        assert response.status_code == 201
+        assert Decimal(response.json()["total_amount"]) == Decimal("15.00")
+        assert await cart_store.get(user_cart_id(user.id)) == {}
+
+        response = await client.post("/orders")
+        assert response.status_code == 400
+
+        # a retry of a checkout from the cart, now empty, gets the order
+        await cart_store.add(user_cart_id(user.id), socks.id, 1)
+        headers = {"Idempotency-Key": uuid.uuid4().hex}
+        first = await client.post("/orders", headers=headers)
+        retry = await client.post("/orders", headers=headers)
+        assert (first.status_code, retry.status_code) == (201, 200)
+        assert retry.json() == first.json()
+
+        response = await client.post("/orders", json={"items": [{"product_id": socks.id + 1000}]})
+        assert response.status_code == 400
+    assert await count_orders(session, user) == 2
+
+
+async def test_place_order_never_oversells(session, shopper):
+    user, (shirt, socks) = shopper
+    await StockRepository(session).set_stock(shirt.id, 5, shards=2)
+    await session.commit()
+    body = {"items": [{"product_id": shirt.id, "quantity": 1}, {"product_id": socks.id, "quantity": 1}]}
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        responses = await asyncio.gather(*(client.post("/orders", json=body) for _ in range(8)))
+    assert sorted(response.status_code for response in responses) == [201] * 5 + [409] * 3
+    assert await count_orders(session, user) == 5
+    assert (await StockRepository(session).read(shirt.id)).quantity == 0
+
+
+async def test_order_history_pages_newest_first(session, shopper, statements):
+    user, (shirt, socks) = shopper
+    session.add_all([ProductImage(image_url="media/shirt-back.jpg", product_id=shirt.id, position=1),
+                     ProductImage(image_url="media/shirt-front.jpg", product_id=shirt.id, position=0)])
+    await session.commit()
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        placed = [(await client.post("/orders", json={"items": [{"product_id": shirt.id, "quantity": i + 1},
+                                                                 {"product_id": socks.id}]})).json()["id"]
+                  for i in range(5)]
+        pages, cursor = [], None
+        while True:
+            statements.clear()
+            response = await client.get("/orders", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            # the orders, then the items of all of them
+            assert len(statements) == 2
+            pages.append(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert (await client.get("/orders", params={"cursor": "garbage"})).status_code == 400
+    assert [len(page) for page in pages] == [2, 2, 1]
+    orders = [order for page in pages for order in page]
+    assert [order["id"] for order in orders] == placed[::-1]
+    assert [(item["name"], item["image_url"], item["quantity"]) for item in orders[0]["items"]] == [
+        ("Order product 0", "media/shirt-front.jpg", 5), ("Order product 1", None, 1)]
+    assert [item["image_download_url"] for item in orders[0]["items"]] == ["media/shirt-front.jpg", None]
+
+
+async def test_order_history_query_plan(session):
+    # many users with a long history each, so the planner has to pick the index
+    await session.execute(text("""
+        INSERT INTO "user" (id, email, hashed_password, is_active, is_superuser, is_verified, name, surname)
+        SELECT gen_random_uuid(), 'plan-' || n || '@example.com', 'x', true, false, false, 'Plan', 'User'
+        FROM generate_series(1, 200) AS n
+    """))
+    await session.execute(text("""
+        INSERT INTO "order" (status, total_amount, user_id, created_at, updated_at)
+        SELECT 'PENDING', n % 100, u.id, now() - n * interval '1 minute', now()
+        FROM (SELECT id FROM "user" WHERE email LIKE 'plan-%') AS u, generate_series(1, 100) AS n
+    """))
+    await session.commit()
+    try:
+        async with engine_test.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text('VACUUM ANALYZE "order"'))
+        user_id = (await session.execute(select(User.id).where(User.email == "plan-1@example.com"))).scalar()
+        async with async_session_maker() as other:
+            _, cursor = await OrderRepository(other).history(user_id, OrderHistoryFilter(limit=10))
+        for filters in (OrderHistoryFilter(), OrderHistoryFilter(cursor=cursor)):
+            plan = await explain(OrderRepository(None)._history_stmt(user_id, filters))
+            scans = [node for node in plan_nodes(plan) if node.get("Relation Name") == "order"]
+            assert [(node["Node Type"], node.get("Index Name")) for node in scans] == [
+                ("Index Only Scan", "ix_order_user_id_created_at_id")]
+    finally:
+        await session.execute(delete(User).where(User.email.like("plan-%")))
+        await session.commit()
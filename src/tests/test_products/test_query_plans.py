@@ -0,0 +1,136 @@
+import json
+import os
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select, text
+
+from src.products.models import Category, Product, ProductImage, ProductSpecification
+from src.products.repository import ProductRepository
+from src.products.schemas import GenderEnum, ProductFilter, ProductSortEnum
+from src.tests.conftest import async_session_maker, engine_test
+
+CATALOG_SIZE = int(os.environ.get("QUERY_PLAN_CATALOG_SIZE", 50_000))
+CATEGORIES = 50
+CATEGORY_PREFIX = "plan_category_"
+
+# seeds a large catalog, so it only runs when asked for: RUN_QUERY_PLAN_TESTS=1
+pytestmark = pytest.mark.query_plan
+
+SEED_PRODUCTS = f"""
+INSERT INTO product (name, description, price, gender, category_id, created_at, updated_at)
+SELECT left(md5(n::text), 8) || ' ' || CASE WHEN n % 1000 = 0 THEN 'cashmere sweater'
+                                           ELSE (ARRAY['shirt', 'dress', 'boots', 'jacket'])[n % 4 + 1] END,
+       'Synthetic product ' || n,
+       (n % 500) + 0.99,
+       (ARRAY['MAN', 'WOMAN', 'UNISEX'])[n % 3 + 1]::genderenum,
+       (CAST(:category_ids AS integer[]))[n % {CATEGORIES} + 1],
+       now() - n * interval '1 minute',
+       now()
+FROM generate_series(1, {CATALOG_SIZE}) AS n
+"""
+
+
+async def remove_catalog(session):
+    """Delete the seeded products and categories, images and specifications go with them."""
+    seeded = select(Category.id).where(Category.name.startswith(CATEGORY_PREFIX))
+    await session.execute(delete(Product).where(Product.category_id.in_(seeded)))
+    await session.execute(delete(Category).where(Category.name.startswith(CATEGORY_PREFIX)))
+    await session.commit()
+
+
+@pytest_asyncio.fixture(scope="module")
+async def catalog():
+    async with async_session_maker() as session:
+        await remove_catalog(session)
+        categories = [Category(name=f"{CATEGORY_PREFIX}{i}") for i in range(CATEGORIES)]
+        session.add_all(categories)
+        await session.flush()
+        category_ids = [category.id for category in categories]
+        await session.execute(text(SEED_PRODUCTS), {"category_ids": category_ids})
+        seeded = "SELECT id FROM product WHERE category_id = ANY(:category_ids)"
+        await session.execute(text(
+            f"INSERT INTO productimage (image_url, product_id) SELECT 'media/p/' || id || '.jpg', id FROM ({seeded}) p"),
+            {"category_ids": category_ids})
+        await session.execute(text(
+            f"INSERT INTO productspecification (key, value, product_id) SELECT 'color', 'red', id FROM ({seeded}) p"),
+            {"category_ids": category_ids})
+        await session.execute(text(
+            "INSERT INTO productspecification (key, value, product_id) "
+            "SELECT 'material', CASE WHEN id % 1000 = 0 THEN 'cashmere' ELSE 'cotton' END, id "
+            f"FROM ({seeded}) p"), {"category_ids": category_ids})
+        await session.commit()
+        # VACUUM also merges the GIN pending lists, otherwise fresh GIN indexes look too expensive
+        async with engine_test.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for table in ("product", "productimage", "productspecification"):
+                await conn.execute(text(f"VACUUM ANALYZE {table}"))
+        yield category_ids[0]
+        await remove_catalog(session)
+
+
+async def explain(stmt) -> dict:
+    sql = stmt.compile(dialect=engine_test.dialect, compile_kwargs={"literal_binds": True})
+    async with async_session_maker() as session:
+        result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+        return result.scalar()[0]["Plan"]
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def assert_uses_index(plan: dict, table: str, indexes: set[str]):
+    nodes = list(plan_nodes(plan))
+    seq_scans = [node for node in nodes if node["Node Type"] == "Seq Scan" and node["Relation Name"] == table]
+    assert not seq_scans, json.dumps(plan, indent=2)
+    used = {node["Index Name"] for node in nodes if "Index Name" in node}
+    assert used & indexes, f"expected one of {indexes}, plan used {used}"
+
+
+FILTER_SHAPES = [
+    ("newest", dict(), {"ix_product_created_at_id"}),
+    ("price_asc", dict(sort=ProductSortEnum.price_asc), {"ix_product_price_id"}),
+    ("price_desc", dict(sort=ProductSortEnum.price_desc), {"ix_product_price_id"}),
+    ("category", dict(category=True), {"ix_product_category_created_at_id"}),
+    ("category_price", dict(category=True, sort=ProductSortEnum.price_asc), {"ix_product_category_price_id"}),
+    ("category_gender", dict(category=True, gender=GenderEnum.woman),
+     {"ix_product_category_created_at_id", "ix_product_category_price_id"}),
+    ("gender", dict(gender=GenderEnum.woman), {"ix_product_gender_created_at_id", "ix_product_created_at_id"}),
+    ("gender_price", dict(gender=GenderEnum.man, sort=ProductSortEnum.price_desc),
+     {"ix_product_gender_price_id", "ix_product_price_id"}),
+    ("price_range", dict(min_price=100, max_price=120, sort=ProductSortEnum.price_asc), {"ix_product_price_id"}),
+    ("cursor", dict(cursor=True), {"ix_product_created_at_id"}),
+    ("search", dict(search="cashmere"), {"ix_product_search_vector", "ix_product_name_trgm"}),
+]
+
+
+@pytest.mark.parametrize("name, shape, indexes", FILTER_SHAPES, ids=[shape[0] for shape in FILTER_SHAPES])
+async def test_product_list_query_plan(catalog, name, shape, indexes):
+    shape = dict(shape)
+    if shape.pop("category", False):
+        shape["category_id"] = catalog
+    if shape.pop("cursor", False):
+        async with async_session_maker() as session:
+            _, shape["cursor"] = await ProductRepository(session).list_page(ProductFilter(limit=100))
+    plan = await explain(ProductRepository(None)._list_stmt(ProductFilter(**shape)))
+    assert_uses_index(plan, "product", indexes)
+
+
+@pytest.mark.parametrize("model, index", [
+    (ProductImage, "ix_productimage_product_id"),
+    (ProductSpecification, "uq_productspecification_product_id_key"),
+])
+async def test_relationship_lookup_query_plan(catalog, model, index):
+    async with async_session_maker() as session:
+        product_ids = (await session.execute(select(Product.id).limit(20))).scalars().all()
+    plan = await explain(select(model).where(model.product_id.in_(product_ids)))
+    assert_uses_index(plan, model.__tablename__, {index})
+
+
+async def test_spec_filter_query_plan(catalog):
+    filters = ProductFilter().with_specs({"material": "cashmere"})
+    plan = await explain(ProductRepository(None)._list_stmt(filters))
+    assert_uses_index(plan, "productspecification", {"ix_productspecification_key_value_product_id"})
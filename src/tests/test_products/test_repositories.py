@@ -1,12 +1,19 @@
+import asyncio
+from decimal import Decimal
+
 import pytest
 from fastapi import HTTPException
+from sqlalchemy import literal_column, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from unittest.mock import AsyncMock, patch
 
-from src.products.models import Category, Product
+from src.configs import settings
+from src.core.pagination import encode_cursor
+from src.products.cache import product_key
+from src.products.models import Category, Product, ProductSpecification
 from src.products.repository import ProductCategoryRepository, ProductRepository
-from src.products.schemas import GenderEnum, ProductFilter
+from src.products.schemas import GenderEnum, ProductFilter, ProductSortEnum
 
 test_cat_data = {"name": "some_new_Test",
                 "image": "../assets/test_image.jpg"}
@@ -148,4 +155,168 @@ async def test_product_change(session, product_repository, cat_repository):
     product = await product_repository.update(product.id, update_data)
     assert product.name == "new_name"
     assert int(product.price) == 55
-    await delete_test_product(session, product_repository, cat_repository, product)
\ No newline at end of file
+    await delete_test_product(session, product_repository, cat_repository, product)
+async def test_list_product_cursor_pagination(session, product_repository, cat_repository):
+    category = await create_test_category(session, cat_repository)
+    for price in ("10", "20", "30"):
+        await product_repository.create({**test_product_data, "price": price, "category_id": category.id})
+    await session.commit()
+
+    filters = ProductFilter(category_id=category.id, sort=ProductSortEnum.price_asc, limit=2)
+    first_page, next_cursor = await product_repository.list_page(filters)
+    assert [int(product.price) for product in first_page] == [10, 20]
+    assert next_cursor is not None
+
+    filters = ProductFilter(category_id=category.id, sort=ProductSortEnum.price_asc, limit=2, cursor=next_cursor)
+    second_page, next_cursor = await product_repository.list_page(filters)
+    assert [int(product.price) for product in second_page] == [30]
+    assert next_cursor is None
+
+    for product in first_page + second_page:
+        await product_repository.delete(product.id)
+    await delete_test_category(session, cat_repository, category.id)
+
+async def test_list_product_invalid_cursor(product_repository):
+    with pytest.raises(HTTPException) as exc_info:
+        await product_repository.list_page(ProductFilter(cursor="not-a-cursor"))
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    # well-formed cursors whose values do not fit the sort key
+    for values in ((1,), ("x", 1), (Decimal("1"), 1, 2)):
+        with pytest.raises(HTTPException) as exc_info:
+            await product_repository.list_page(ProductFilter(cursor=encode_cursor("newest", values)))
+        assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+
+async def test_list_product_search(session, product_repository, cat_repository):
+    category = await create_test_category(session, cat_repository)
+    await product_repository.create({**test_product_data, "name": "Cotton summer shirt",
+                                     "description": "light shirt", "category_id": category.id})
+    await product_repository.create({**test_product_data, "name": "Leather boots",
+                                     "description": "winter boots made of leather", "category_id": category.id})
+    await session.commit()
+
+    products = await product_repository.list(ProductFilter(search="shirt"))
+    assert [product.name for product in products] == ["Cotton summer shirt"]
+
+    products = await product_repository.list(ProductFilter(search="leather"))
+    assert [product.name for product in products] == ["Leather boots"]
+
+    # trigram similarity tolerates typos in the product name
+    products = await product_repository.list(ProductFilter(search="Leathr boots"))
+    assert [product.name for product in products] == ["Leather boots"]
+
+    await product_repository.create({**test_product_data, "name": "Linen shirt",
+                                     "description": "shirt for hot days", "category_id": category.id})
+    await session.commit()
+    first_page, next_cursor = await product_repository.list_page(ProductFilter(search="shirt", limit=1))
+    second_page, next_cursor = await product_repository.list_page(ProductFilter(search="shirt", limit=1,
+                                                                                cursor=next_cursor))
+    assert next_cursor is None
+    assert {first_page[0].name, second_page[0].name} == {"Cotton summer shirt", "Linen shirt"}
+
+    for product in await product_repository.list(ProductFilter(category_id=category.id)):
+        await product_repository.delete(product.id)
+    await delete_test_category(session, cat_repository, category.id)
+
+async def test_product_get_is_cached_and_invalidated(session, product_repository, cat_repository):
+    product = await create_test_product(session, product_repository, cat_repository)
+    cache = product_repository.cache
+    await product_repository.get(product.id)
+    hits = cache.stats()["hits"]
+    await product_repository.get(product.id)
+    assert cache.stats()["hits"] == hits + 1
+
+    await product_repository.add_specifications('{"material": "cotton"}', product.id)
+    await session.commit()
+    cached = await product_repository.get(product.id)
+    assert [spec.key for spec in cached.specifications] == ["material"]
+
+    # a read that raced the commit cached the old row again, it is evicted a second time
+    stale = await cache.get(product_key(product.id))
+    with patch.object(settings, "PRODUCT_CACHE_REEVICT_DELAY", 0.01):
+        await product_repository.add_specifications('{"size": "M"}', product.id)
+        await session.commit()
+        await cache.set(product_key(product.id), stale)
+        await asyncio.sleep(0.05)
+    assert await cache.get(product_key(product.id)) is None
+    await delete_test_product(session, product_repository, cat_repository, product)
+
+async def test_category_delete_invalidates_cached_products(session, product_repository, cat_repository):
+    product = await create_test_product(session, product_repository, cat_repository)
+    assert (await product_repository.get(product.id)).category_id == product.category_id
+    await delete_test_category(session, cat_repository, product.category_id)
+    await asyncio.sleep(0)
+    assert (await product_repository.get(product.id)).category_id is None
+    await product_repository.delete(product.id)
+    await session.commit()
+
+@patch("src.products.repository.delete_image", new_callable=AsyncMock)
+@patch("src.products.repository.save_image", new_callable=AsyncMock)
+async def test_update_product_images_diff(mock_save_image, mock_delete_image,
+                                          session, product_repository, cat_repository):
+    product = await create_test_product(session, product_repository, cat_repository)
+    await product_repository.create_images(["media/a.jpg", "media/b.jpg", "media/c.jpg"], product.id)
+    await session.commit()
+    a, b, c = (await product_repository.get(product.id)).images
+
+    # fields only: no image row or file is touched
+    await product_repository.update_product_images(product.id)
+    mock_save_image.assert_not_called()
+    mock_delete_image.assert_not_called()
+
+    mock_save_image.return_value = "media/d.jpg"
+    await product_repository.update_product_images(product.id, [c.id, a.id], ["upload"])
+    await session.commit()
+    images = (await product_repository.get(product.id)).images
+    assert [(image.image_url, image.position) for image in images] == [
+        ("media/c.jpg", 0), ("media/a.jpg", 1), ("media/d.jpg", 2)]
+    assert mock_save_image.await_count == 1
+    mock_delete_image.assert_awaited_once_with(session, "media/b.jpg")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await product_repository.update_product_images(product.id, [b.id])
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    await delete_test_product(session, product_repository, cat_repository, product)
+
+async def test_update_product_specifications_upserts_changes(session, product_repository, cat_repository):
+    product = await create_test_product(session, product_repository, cat_repository)
+    await product_repository.add_specifications('{"material": "cotton", "color": "red"}', product.id)
+    await session.commit()
+    xmin = select(literal_column("xmin")).select_from(ProductSpecification).where(
+        ProductSpecification.product_id == product.id, ProductSpecification.key == "material")
+    material_version = (await session.execute(xmin)).scalar()
+
+    specs = await product_repository.update_product_specifications(
+        product.id, '{"material": "cotton", "color": "blue", "size": "M"}')
+    await session.commit()
+    assert sorted((spec.key, spec.value) for spec in specs) == [("color", "blue"), ("material", "cotton"), ("size", "M")]
+    # the unchanged row is not rewritten
+    assert (await session.execute(xmin)).scalar() == material_version
+
+    specs = await product_repository.update_product_specifications(product.id, '{"size": "L"}')
+    await session.commit()
+    assert [(spec.key, spec.value) for spec in specs] == [("size", "L")]
+    stored = (await product_repository.get(product.id)).specifications
+    assert [(spec.key, spec.value) for spec in stored] == [("size", "L")]
+    await delete_test_product(session, product_repository, cat_repository, product)
+
+async def test_list_product_spec_filters(session, product_repository, cat_repository):
+    category = await create_test_category(session, cat_repository)
+    cotton = await product_repository.create({**test_product_data, "name": "Cotton shirt", "category_id": category.id})
+    linen = await product_repository.create({**test_product_data, "name": "Linen shirt", "category_id": category.id})
+    await session.flush()
+    await product_repository.add_specifications('{"material": "cotton", "size": "M"}', cotton.id)
+    await product_repository.add_specifications('{"material": "linen", "size": "M"}', linen.id)
+    await session.commit()
+
+    filters = ProductFilter(category_id=category.id).with_specs({"material": "cotton"})
+    assert [product.name for product in await product_repository.list(filters)] == ["Cotton shirt"]
+    filters = ProductFilter(category_id=category.id).with_specs({"size": "M"})
+    assert len(await product_repository.list(filters)) == 2
+    assert (await product_repository.facets(filters)).total == 2
+    filters = ProductFilter(category_id=category.id).with_specs({"size": "M", "material": "wool"})
+    assert await product_repository.list(filters) == []
+    assert (await product_repository.facets(filters)).total == 0
+
+    for product in (cotton, linen):
+        await product_repository.delete(product.id)
+    await delete_test_category(session, cat_repository, category.id)
@@ -63,6 +63,12 @@ async def test_get_test_category_update(cleanup_categories, create_product_categ
             assert res_["name"] == "some_new_name"
             assert res_["image"] == "../assets/test_image.jpg"
 
+            # renamed only, the image is kept
+            response = await client.put(f"/products/categories/{_id}", data={"name": "renamed"})
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["name"] == "renamed"
+            assert response.json()["image"] == "../assets/test_image.jpg"
+
 
 async def test_delete_category(create_product_category, cleanup_categories):
     _id = create_product_category.id
@@ -138,9 +144,164 @@ async def test_product_update( create_product):
             assert resp_data["name"] == test_form["name"]
             assert resp_data["category_id"] == test_form.get("category_id")
 
+async def test_product_with_unknown_category_is_rejected(create_product):
+    test_form = {
+        "name": "Orphan Product",
+        "description": "No such category",
+        "price": "19.99",
+        "gender": "unisex",
+        "category_id": create_product.category_id + 1000,
+    }
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/products/products", data=test_form)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = await client.put(f"/products/products/{create_product.id}", data=test_form)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        # rolled back, the product is unchanged
+        response = await client.get(f"/products/products/{create_product.id}")
+        assert response.json()["name"] == create_product.name
+
 async def test_product_delete(create_product):
     async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
         response = await client.delete(f"/products/products/{create_product.id}")
         data = response.json()
         assert response.status_code == status.HTTP_204_NO_CONTENT
         assert data["status"] == "success"
+
+async def test_get_product_facets(cleanup_product, create_product):
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get(f"/products/products/facets",
+                                    params={"category_id": create_product.category_id})
+        facets = response.json()
+        assert response.status_code == status.HTTP_200_OK
+        assert facets["total"] == 1
+        assert facets["categories"] == [{"category_id": create_product.category_id, "count": 1}]
+        assert facets["genders"] == [{"gender": "man", "count": 1}]
+        assert facets["price_buckets"] == [{"min_price": "50", "max_price": "100", "count": 1}]
+
+async def test_import_products(cleanup_product, create_product_category):
+    category_id = create_product_category.id
+    rows = [
+        {"name": "Imported shirt", "price": "10.50", "gender": "man", "category_id": category_id,
+         "specifications": {"color": "red"}, "images": ["media/products/shirt.jpg"]},
+        {"name": "Imported dress", "price": "30", "gender": "woman", "category_id": category_id},
+        {"name": "Broken", "price": "not a price"},
+    ]
+    ndjson = "\n".join(json.dumps(row) for row in rows) + "\n{not json}\n"
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/products/products/import",
+                                     files={"file": ("products.ndjson", io.BytesIO(ndjson.encode()),
+                                                     "application/x-ndjson")})
+        report = response.json()
+        assert response.status_code == status.HTTP_200_OK
+        assert report["total"] == 4
+        assert report["imported"] == 2
+        assert [error["line"] for error in report["errors"]] == [3, 4]
+
+        response = await client.get("/products/products", params={"category_id": category_id,
+                                                                   "sort": "price_asc"})
+        products = response.json()
+        assert [product["name"] for product in products] == ["Imported shirt", "Imported dress"]
+        assert products[0]["specifications"][0]["key"] == "color"
+        assert products[0]["images"][0]["image_url"] == "media/products/shirt.jpg"
+
+async def test_import_products_csv(cleanup_product, create_product_category):
+    csv_data = ("name,description,price,gender,category_id,specifications,images\n"
+                f'Csv shirt,,12,unisex,{create_product_category.id},"{{""size"": ""M""}}",a.jpg|b.jpg\n')
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/products/products/import",
+                                     files={"file": ("products.csv", io.BytesIO(csv_data.encode()), "text/csv")})
+        report = response.json()
+        assert response.status_code == status.HTTP_200_OK
+        assert report["imported"] == 1
+        assert report["failed"] == 0
+
+async def test_import_products_reports_undecodable_rows(cleanup_product, create_product_category):
+    row = f"Csv shirt,,12,unisex,{create_product_category.id},,\n".encode()
+    csv_data = (b"name,description,price,gender,category_id,specifications,images\n" + row
+                + b"Caf\xe9 shirt,,12,unisex,1,,\n" + b'"' + b"x" * 200_000 + b'",,12,unisex,1,,\n' + row)
+    ndjson = b'{"name": "Caf\xe9"}\n'
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/products/products/import",
+                                     files={"file": ("products.csv", io.BytesIO(csv_data), "text/csv")})
+        report = response.json()
+        assert response.status_code == status.HTTP_200_OK
+        assert (report["total"], report["imported"]) == (4, 2)
+        assert [error["line"] for error in report["errors"]] == [3, 4]
+        assert "can't decode" in report["errors"][0]["error"]
+        assert "field larger than field limit" in report["errors"][1]["error"]
+
+        response = await client.post("/products/products/import",
+                                     files={"file": ("products.ndjson", io.BytesIO(ndjson), "application/x-ndjson")})
+        assert [error["line"] for error in response.json()["errors"]] == [1]
+
+async def test_export_products(cleanup_product, create_product):
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products/products/export",
+                                    params={"category_id": create_product.category_id})
+        assert response.status_code == status.HTTP_200_OK
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["id"] for row in rows] == [create_product.id]
+        assert rows[0]["gender"] == "man"
+
+        response = await client.get("/products/products/export", params={"format": "csv"})
+        assert response.status_code == status.HTTP_200_OK
+        lines = response.text.splitlines()
+        assert lines[0].startswith("id,name,description,price")
+        assert len(lines) == 2
+
+async def test_get_products_sparse_fields(cleanup_product, create_product):
+    async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products/products", params={"fields": "name,price", "include": "thumbnail"})
+        products = response.json()
+        assert response.status_code == status.HTTP_200_OK
+        assert products == [{"id": create_product.id, "name": create_product.name,
+                             "price": "50.00", "thumbnail": None}]
+
+        response = await client.get(f"/products/products/{create_product.id}", params={"fields": "name"})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"id": create_product.id, "name": create_product.name}
+
+        response = await client.get("/products/products", params={"fields": "unknown"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"] == "Unknown fields: unknown"
+        response = await client.get(f"/products/products/{create_product.id}", params={"include": "unknown"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_product_writes_round_trips(cleanup_categories, create_product_category, statements):
+    test_form = {
+        "name": "Test Product",
+        "description": "Test description",
+        "price": "19.99",
+        "gender": "unisex",
+        "category_id": create_product_category.id,
+        "specifications": json.dumps({"color": "red", "size": "M"})
+    }
+    with patch("src.products.repository.save_image", new_callable=AsyncMock) as mock_save_image:
+        mock_save_image.return_value = "../assets/test_image.jpg"
+        async with AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            statements.clear()
+            response = await client.post("/products/products", data=test_form,
+                                         files={"product_images": ("test.jpg", io.BytesIO(b"data"), "image/jpeg")})
+            assert response.status_code == status.HTTP_201_CREATED
+            assert len(statements) <= 3
+            created = response.json()
+            assert [image["image_url"] for image in created["images"]] == ["../assets/test_image.jpg"]
+            assert {spec["key"]: spec["value"] for spec in created["specifications"]} == {"color": "red", "size": "M"}
+
+            statements.clear()
+            response = await client.put(f"/products/products/{created['id']}",
+                                        data={**test_form, "name": "new name",
+                                              "specifications": json.dumps({"color": "blue"})})
+            assert response.status_code == status.HTTP_200_OK
+            assert len(statements) <= 3
+            updated = response.json()
+            assert updated["name"] == "new name"
+            assert updated["images"] == created["images"]
+            assert [(spec["key"], spec["value"]) for spec in updated["specifications"]] == [("color", "blue")]
+
+            response = await client.get(f"/products/products/{created['id']}")
+            assert response.json()["name"] == "new name"
+            assert response.json()["specifications"] == updated["specifications"]
+            await client.delete(f"/products/products/{created['id']}")
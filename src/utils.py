@@ -1,29 +1,26 @@
-import os
-import pathlib
-import uuid
+from sqlalchemy.ext.asyncio import AsyncSession
 
-import aiofiles
-from fastapi import HTTPException
+from .core.session_hooks import on_commit
+from .media.store import remove_if_unreferenced, remove_unreferenced
+from .media.uploads import UploadBudget, save_upload
 
-from .configs import MEDIA_DIR
+async def save_image(file, budget: UploadBudget | None = None, session: AsyncSession | None = None) ->str:
+    saved = await save_upload(file, budget, session)
+    return saved.path
 
-async def save_image(folder_name, file) ->str:
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Invalid image type")
-    folder_path = os.path.join(MEDIA_DIR, folder_name)
-    os.makedirs(folder_path, exist_ok=True)
-    ext = os.path.splitext(file.filename)[1]
-    filename = f"{uuid.uuid4()}{ext}"
-    image_path = os.path.join("media", folder_name, filename)
-    async with aiofiles.open(os.path.join(folder_path, filename) , "wb") as f:
-        await f.write(await file.read())
-    return image_path
-
-async def delete_image(image_path):
+async def delete_image(session: AsyncSession, image_path):
+    """Remove the stored file once the transaction dropping its last reference commits."""
     if not str(image_path).startswith("media"):
         return
-    full_path = os.path.join(pathlib.Path(MEDIA_DIR).parent, image_path)
-    try:
-        os.remove(full_path)
-    except Exception as e:
-        print(f"Image {image_path} could not be deleted: {e}")
+    bind = session.bind
+
+    async def _remove():
+        await remove_unreferenced(bind, image_path)
+
+    on_commit(session, _remove)
+
+async def discard_image(session: AsyncSession, image_path):
+    """Remove a file saved for a transaction that was rolled back, unless something else references it."""
+    if image_path and str(image_path).startswith("media"):
+        # in the session that may already hold the file's lock, a fresh one would wait for it
+        await remove_if_unreferenced(session, image_path)